@@ -22,6 +22,13 @@ export RUST_LOG=${RUST_LOG:-error}
 export TEST_POOL_IP=${TEST_POOL_IP:-10.0.0.2}
 
 cd "${HOME}"/src
+case "$(echo "${TAILS_SERVER_READ_ONLY}" | tr '[:upper:]' '[:lower:]')" in
+    1|true|yes)
+        # read-only mirror: no anchor, so no cryptonym to set on ledger
+        exec python -m sanic app.app --host=${HOST_IP} --port=${HOST_PORT}
+        ;;
+esac
+
 von_anchor_setnym app/config/config.ini
 RV=$?
 if [ "${RV}" -eq "0" ]
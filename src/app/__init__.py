@@ -24,20 +24,46 @@ from von_anchor.error import AbsentNym, AbsentPool
 from app.cache import MEM_CACHE
 from app.cfg import init_logging, set_config
 from app.bootseq import boot
+from app.request import BoundedRequest
 
 
 DIR_STATIC = join(dirname(__file__), 'static')
 
 
 # initialize app
-app = Sanic(strict_slashes=True)
+app = Sanic(strict_slashes=True, request_class=BoundedRequest)
 app.static('/static', DIR_STATIC)
 app.static('/favicon.ico', join(DIR_STATIC, 'favicon.ico'))
 init_logging()
-set_config()
+config = set_config()
+
+# admit streaming tails file uploads up to configured size, with headroom for multipart framing;
+# buffer any other request body only up to its own, far smaller limit
+app.config.REQUEST_MAX_SIZE = max(
+    app.config.REQUEST_MAX_SIZE,
+    int(config.get('Tails Server', {}).get('max.upload.mb', '256')) * 1024 * 1024 + 65536)
+app.config.REQUEST_BUFFER_MAX_SIZE = max(1, int(config.get('Tails Server', {}).get('max.body.kb', '1024'))) * 1024
+
+@app.listener('after_server_start')
+async def warmup(app, loop):
+    heat = await MEM_CACHE.get('heat')
+    if heat is not None:
+        heat.start()
+
+    catalog = await MEM_CACHE.get('catalog')
+    if catalog is not None:
+        catalog.start()
 
 @app.listener('before_server_stop')
 async def cleanup(app, loop):
+    heat = await MEM_CACHE.get('heat')
+    if heat is not None:
+        await heat.close()
+
+    catalog = await MEM_CACHE.get('catalog')
+    if catalog is not None:
+        catalog.close()
+
     tsan = await MEM_CACHE.get('tsan')
     if tsan is not None:
         await tsan.wallet.close()
@@ -47,6 +73,14 @@ async def cleanup(app, loop):
     if pool is not None:
         await pool.close()
 
+    jobs = await MEM_CACHE.get('jobs')
+    if jobs is not None:
+        jobs.close()
+
+    verifier = await MEM_CACHE.get('verifier')
+    if verifier is not None:
+        verifier.close()
+
 # start
 try:
     boot()
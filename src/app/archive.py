@@ -0,0 +1,183 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import tarfile
+
+from os import stat
+from os.path import basename
+from typing import Iterator, NamedTuple
+
+from von_anchor.tails import Tails
+from von_anchor.util import rev_reg_id2cred_def_id
+
+
+BLOCK = tarfile.BLOCKSIZE
+COALESCE = 64 * 1024  # bytes of consecutive headers to gather into one segment while streaming
+
+
+class Member(NamedTuple):
+    """
+    Rev reg id in tar archive, with its tails file: cred def id, tails hash, path, size in bytes,
+    modification time as EPOCH time, and whether the archive carries tails file content here (at its first
+    rev reg id) rather than only a symbolic link to it.
+    """
+
+    rr_id: str
+    cd_id: str
+    tails_hash: str
+    path: str
+    size: int
+    mtime: float
+    content: bool
+
+
+def _header(name: str, size: int = 0, mtime: float = 0, linkname: str = None) -> bytes:
+    """
+    Return tar header block(s) for regular file or, given link name, symbolic link.
+
+    :param name: member name
+    :param size: file size in bytes
+    :param mtime: modification time as EPOCH time
+    :param linkname: link target, for symbolic link
+    :return: header bytes
+    """
+
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    if linkname:
+        info.type = tarfile.SYMTYPE
+        info.linkname = linkname
+        info.mode = 0o777
+
+    return info.tobuf(format=tarfile.PAX_FORMAT, encoding='utf-8', errors='strict')
+
+
+def _header_size(name: str, size: int = 0, linkname: str = None) -> int:
+    """
+    Return size of tar header block(s) that _header() returns, without building them: one ustar block,
+    preceded by a pax extended header (one block plus records padded to whole blocks) for any name or link name
+    that is not ASCII or exceeds its ustar field, or for any size that exceeds its ustar field.
+
+    :param name: member name
+    :param size: file size in bytes
+    :param linkname: link target, for symbolic link
+    :return: header size in bytes
+    """
+
+    records = 0
+    for (keyword, value, length) in (
+            ('path', name, tarfile.LENGTH_NAME),
+            ('linkpath', linkname or '', tarfile.LENGTH_LINK)):
+        if len(value) > length or len(value.encode('utf-8')) != len(value):  # too long or not ASCII
+            records += _record_size(keyword, value)
+    if size >= 8 ** 11:
+        records += _record_size('size', str(size))
+
+    return BLOCK + (BLOCK + -(-records // BLOCK) * BLOCK if records else 0)
+
+
+def _record_size(keyword: str, value: str) -> int:
+    """
+    Return size of pax extended header record '<length> <keyword>=<value>\\n', where length counts itself.
+
+    :param keyword: keyword
+    :param value: value
+    :return: record size in bytes
+    """
+
+    rv = len(keyword) + len(value.encode('utf-8')) + 3  # space, equals sign, newline
+    return rv + len(str(rv + len(str(rv))))
+
+
+def tar_members(dir_tails: str, rr_ids: list) -> list:
+    """
+    Return members of tar archive of tails files for rev reg ids, from link resolution and file status
+    only. Skip rev reg ids without tails files. The archive carries content of any tails file only once.
+
+    :param dir_tails: tails directory
+    :param rr_ids: rev reg ids
+    :return: members in archive order
+    """
+
+    rv = []
+    paths = set()
+    for rr_id in rr_ids:
+        path_tails = Tails.linked(dir_tails, rr_id)
+        if not path_tails:
+            continue
+        try:
+            stat_tails = stat(path_tails)
+        except FileNotFoundError:  # dangling link
+            continue
+
+        rv.append(Member(
+            rr_id,
+            rev_reg_id2cred_def_id(rr_id),
+            basename(path_tails),
+            path_tails,
+            stat_tails.st_size,
+            stat_tails.st_mtime,
+            path_tails not in paths))
+        paths.add(path_tails)
+
+    return rv
+
+
+def tar_size(members: list) -> int:
+    """
+    Return size of uncompressed tar archive of members, from their names and tails file sizes alone.
+
+    :param members: members in archive order
+    :return: archive size in bytes
+    """
+
+    rv = 2 * BLOCK  # end of archive
+    for member in members:
+        if member.content:
+            rv += _header_size('{}/{}'.format(member.cd_id, member.tails_hash), member.size)
+            rv += -(-member.size // BLOCK) * BLOCK
+        rv += _header_size('{}/{}'.format(member.cd_id, member.rr_id), linkname=member.tails_hash)
+
+    return rv
+
+
+def tar_segments(members: list) -> Iterator:
+    """
+    Generate content segments of uncompressed tar archive of members, in the layout of the tails tree:
+    each tails file as <cd_id>/<tails_hash>, followed by symbolic link <cd_id>/<rr_id> to it for each rev reg id.
+    Build each header only on reaching its member, gathering consecutive headers and padding into segments
+    of up to COALESCE bytes.
+
+    :param members: members in archive order
+    :return: generator of content segments: bytes, or triples (path, offset, count) for tails file content
+    """
+
+    pending = b''
+    for member in members:
+        if member.content:
+            pending += _header('{}/{}'.format(member.cd_id, member.tails_hash), member.size, member.mtime)
+            yield pending
+            yield (member.path, 0, member.size)
+            pending = bytes(-member.size % BLOCK)
+        pending += _header('{}/{}'.format(member.cd_id, member.rr_id), linkname=member.tails_hash)
+        if len(pending) >= COALESCE:
+            yield pending
+            pending = b''
+
+    yield pending + bytes(2 * BLOCK)  # end of archive
@@ -17,6 +17,8 @@ limitations under the License.
 import json
 import logging
 
+from os.path import dirname, join, realpath
+
 from von_anchor import NominalAnchor
 from von_anchor.error import AbsentNym, AbsentPool, ExtantWallet
 from von_anchor.frill import do_wait
@@ -26,6 +28,14 @@ from von_anchor.op import AnchorData, NodePoolData
 from von_anchor.wallet import WalletManager
 
 from app.cache import MEM_CACHE
+from app.catalog import Catalog
+from app.delivery import Delivery
+from app.heat import Heat
+from app.jobs import UploadJobs
+from app.publish import Publisher
+from app.statcache import StatCache
+from app.variants import Variants
+from app.verify import Verifier
 
 
 LOGGER = logging.getLogger(__name__)
@@ -35,9 +45,31 @@ def boot() -> None:
     """
     Boot the service: instantiate tails server anchor. Raise AbsentPool if node pool ledger configuration
     neither present nor sufficiently specified; raise AbsentNym if tails server anchor nym is not on the ledger.
+
+    A read-only mirror sets up only what serving downloads requires, with neither node pool nor wallet.
     """
 
     config = do_wait(MEM_CACHE.get('config'))
+    read_only = config.get('Tails Server', {}).get('read.only', '0').lower() in ['1', 'true', 'yes']
+
+    if not read_only:
+        # set up signature verifier first: any worker processes must fork before indy-sdk starts its threads
+        do_wait(MEM_CACHE.set('verifier', Verifier.from_config(config)))
+        do_wait(MEM_CACHE.set('jobs', UploadJobs.from_config(config)))
+        do_wait(MEM_CACHE.set('publisher', Publisher.from_config(config)))
+    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+    do_wait(MEM_CACHE.set('delivery', Delivery.from_config(config, dir_tails)))
+    do_wait(MEM_CACHE.set('variants', Variants.from_config(config)))
+    stat_cache = StatCache.from_config(config, dir_tails)
+    do_wait(MEM_CACHE.set('stat_cache', stat_cache))
+    do_wait(MEM_CACHE.set('heat', Heat.from_config(config, join(dirname(dir_tails), 'heat.json'), stat_cache)))
+    catalog = Catalog.from_config(config, join(dirname(dir_tails), 'catalog.db'), dir_tails)
+    do_wait(catalog.open())
+    do_wait(MEM_CACHE.set('catalog', catalog))
+
+    if read_only:
+        LOGGER.info('Booted as read-only mirror: no node pool, wallet, or anchor')
+        return
 
     # setup pool and wallet
     pool_data = NodePoolData(
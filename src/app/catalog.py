@@ -0,0 +1,641 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import json
+import logging
+import sqlite3
+import sys
+
+from concurrent.futures import ThreadPoolExecutor
+from os import lstat, readlink, scandir, stat
+from os.path import basename, dirname, isdir, join, realpath
+from time import time
+from typing import Callable
+from uuid import uuid4
+
+from von_anchor.util import ok_cred_def_id, ok_did, ok_rev_reg_id, rev_reg_id2cred_def_id
+
+
+LOGGER = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS tails ('
+    ' rr_id TEXT PRIMARY KEY,'
+    ' cd_id TEXT NOT NULL,'
+    ' did TEXT NOT NULL,'
+    ' tails_hash TEXT NOT NULL,'
+    ' size INTEGER NOT NULL,'
+    ' uploaded REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS tails_cd_id ON tails (cd_id)',
+    'CREATE INDEX IF NOT EXISTS tails_did ON tails (did)',
+    'CREATE INDEX IF NOT EXISTS tails_hash ON tails (tails_hash)',
+    'CREATE INDEX IF NOT EXISTS tails_uploaded ON tails (uploaded)',
+    'CREATE TABLE IF NOT EXISTS changes ('
+    ' generation INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' rr_id TEXT NOT NULL,'
+    ' cd_id TEXT NOT NULL,'
+    ' did TEXT NOT NULL,'
+    ' added INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS changes_rr_id ON changes (rr_id)',
+    'CREATE INDEX IF NOT EXISTS changes_cd_id ON changes (cd_id)',
+    'CREATE INDEX IF NOT EXISTS changes_did ON changes (did)',
+    'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+VERSION = 2  # schema version, as SQLite user_version once built
+
+
+class StaleGeneration(Exception):
+    """
+    Generation token is not from this catalog, or predates its retained history of changes.
+    """
+
+
+def _scan(dir_cd_id: str) -> list:
+    """
+    Return catalog rows for links from rev reg ids to tails files in cred def id directory of tails tree,
+    ignoring any link named for a rev reg id on another cred def id. Take the modification time of each link
+    as its upload time, and skip any link to a missing tails file.
+
+    :param dir_cd_id: cred def id directory
+    :return: list of rows (rr_id, cd_id, did, tails_hash, size, uploaded)
+    """
+
+    rv = []
+    cd_id = basename(dir_cd_id)
+    try:
+        with scandir(dir_cd_id) as entries:
+            for entry in entries:
+                if not (entry.is_symlink() and ok_rev_reg_id(entry.name)):
+                    continue
+                if rev_reg_id2cred_def_id(entry.name) != cd_id:
+                    continue
+                try:
+                    rv.append((
+                        entry.name,
+                        cd_id,
+                        cd_id.split(':')[0],
+                        basename(readlink(entry.path)),
+                        stat(entry.path).st_size,
+                        lstat(entry.path).st_mtime))
+                except FileNotFoundError:  # dangling link
+                    continue
+    except OSError as x_os:  # e.g., directory deleted during scan
+        LOGGER.debug('Could not scan %s: %s', dir_cd_id, x_os)
+
+    return rv
+
+
+class Catalog:
+    """
+    Catalog of the tails tree in an embedded SQLite database, in WAL mode so that readers never wait on
+    the writer: rev reg id, cred def id, issuer DID, tails hash, size, and upload time of each tails file,
+    indexed for queries by any of these. The server builds the catalog from the tails tree only if it has none,
+    scanning cred def id directories in parallel, and updates it in a transaction as it publishes and deletes
+    tails files, so that neither restarts nor listings walk the tails tree. It caches the serialized JSON
+    listing for all tails files and for each cred def id or issuer DID filter, until a change affects it.
+
+    A single-threaded executor owns the connection for writing, so that no SQLite call runs on the event loop;
+    queries run in the default executor, each on a connection of its own. Before serving from its caches,
+    the catalog checks the writing connection's data version, and drops its caches and reloads its generation
+    if any other connection (e.g., another server process, or the catalog script) has since committed a change.
+
+    Each addition or removal of a rev reg id, whether by upload, deletion, or rebuild, bumps the catalog
+    generation and records the change, so that clients may fetch only the changes since a generation that they
+    have seen. The catalog keeps its generation in the database, reading and advancing it within each write
+    transaction, so that all processes writing the catalog agree on it. Generation tokens name the catalog as
+    well as the generation, so that a client cannot mistake the generation of a catalog built afresh for one
+    that it has seen. The catalog retains a bounded history.
+    The generation of the latest change affecting a filter tags its listings, so that clients polling for
+    a listing can tell that it has not changed.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            dir_tails: str,
+            workers: int = 8,
+            rescan_interval: int = 0,
+            history: int = 100000) -> None:
+        """
+        Initialize catalog.
+
+        :param path: path to SQLite database
+        :param dir_tails: tails directory
+        :param workers: number of threads scanning tails tree
+        :param rescan_interval: interval between rebuilds from tails tree, in seconds, or 0 for none
+            (e.g., for a read-only mirror of a tails tree that another process maintains)
+        :param history: number of most recent changes to retain, for changes since a generation
+        """
+
+        self._path = path
+        self._dir_tails = dir_tails
+        self._workers = max(1, workers)
+        self._rescan_interval = max(0, rescan_interval)
+        self._history = max(1, history)
+        self._conn = None
+        self._executor = None  # owns connection for writing
+        self._data_version = None  # of database, as the connection for writing last saw it
+        self._id = None  # catalog identifier, for generation tokens
+        self._floor = 0  # generation before earliest change retained
+        self._generation = 0
+        self._listings = {}  # filter -> serialized JSON listing
+        self._tags = {}  # filter -> generation token of latest change affecting it
+        self._timer = None
+
+    @staticmethod
+    def from_config(config: dict, path: str, dir_tails: str) -> 'Catalog':
+        """
+        Return catalog as per [Tails Server] configuration section: catalog.scan.workers (default 8),
+        catalog.rescan.sec (default 0 for none), catalog.history (default 100000).
+
+        :param config: configuration dict
+        :param path: path to SQLite database
+        :param dir_tails: tails directory
+        :return: catalog
+        """
+
+        cfg = config.get('Tails Server', {})
+        return Catalog(
+            path,
+            dir_tails,
+            int(cfg.get('catalog.scan.workers', '8') or 8),
+            int(cfg.get('catalog.rescan.sec', '0') or 0),
+            int(cfg.get('catalog.history', '100000') or 100000))
+
+    async def open(self) -> bool:
+        """
+        Open database, creating schema as needed, and build catalog from tails tree if not yet built.
+
+        :return: whether catalog was built from tails tree
+        """
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        (version, count) = await self._execute(self._open)
+        if version < VERSION:
+            await self.build()
+            return True
+
+        LOGGER.info('Opened catalog %s of %s rev reg ids', self._path, count)
+        return False
+
+    def _open(self) -> tuple:
+        """
+        Open database on connection for writing, creating schema as needed, and load catalog identifier
+        and generation. Run in the executor owning the connection.
+
+        :return: pair (schema version, number of rev reg ids in catalog)
+        """
+
+        self._conn = sqlite3.connect(self._path, isolation_level=None)  # transactions explicit, as per _write()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')  # consistent under WAL; a crash may lose latest commits
+        for statement in SCHEMA:
+            self._conn.execute(statement)
+        self._conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('id', uuid4().hex[:16]))
+        self._conn.execute('INSERT OR IGNORE INTO meta VALUES (?, ?)', ('floor', '0'))
+        self._conn.execute(  # catalog predating generation in meta: latest change recorded
+            'INSERT OR IGNORE INTO meta SELECT ?, MAX(COALESCE(MAX(generation), 0), ?) FROM changes',
+            ('generation', int(self._conn.execute('SELECT value FROM meta WHERE key = ?', ('floor',)).fetchone()[0])))
+        self._load()
+
+        return (
+            self._conn.execute('PRAGMA user_version').fetchone()[0],
+            self._conn.execute('SELECT COUNT(*) FROM tails').fetchone()[0])
+
+    def _load(self) -> None:
+        """
+        Load catalog identifier, floor, and generation from database, noting its data version. Run in the executor
+        owning the connection.
+        """
+
+        self._data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+        (self._id, self._floor, self._generation) = (meta['id'], int(meta['floor']), int(meta['generation']))
+
+    def _stale(self) -> bool:
+        """
+        Return whether another connection has committed a change to the database since the connection
+        for writing last saw it; if so, reload catalog identifier, floor, and generation. Run in the executor
+        owning the connection.
+
+        :return: whether database has changed
+        """
+
+        if self._conn.execute('PRAGMA data_version').fetchone()[0] == self._data_version:
+            return False
+
+        self._load()
+        return True
+
+    async def _refresh(self) -> None:
+        """
+        Drop cached listings and tags, and reload generation, if another connection has changed the database.
+        """
+
+        if await self._execute(self._stale):
+            LOGGER.info(
+                'Catalog %s changed outside this process: reloaded at generation %s',
+                self._path,
+                self._generation)
+            (self._listings, self._tags) = ({}, {})
+
+    async def _execute(self, fn: Callable, *args):
+        """
+        Run function in the executor owning the connection for writing.
+
+        :param fn: function
+        :param args: arguments
+        :return: function's return value
+        """
+
+        return await asyncio.get_event_loop().run_in_executor(self._executor, fn, *args)
+
+    def close(self) -> None:
+        """
+        Cancel any scheduled rebuild and close database, waiting on any write in progress.
+        """
+
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._executor:
+            if self._conn:
+                self._executor.submit(self._conn.close).result()
+                self._conn = None
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def build(self) -> int:
+        """
+        Rebuild catalog from tails tree in one transaction, scanning cred def id directories in parallel,
+        and record any additions and removals that it makes.
+
+        :return: number of rev reg ids in catalog
+        """
+
+        start = time()
+        dirs_cd_id = []
+        if isdir(self._dir_tails):
+            with scandir(self._dir_tails) as entries:
+                dirs_cd_id = [e.path for e in entries if e.is_dir(follow_symlinks=False) and ok_cred_def_id(e.name)]
+
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor(max_workers=self._workers) as executor:
+            scans = await asyncio.gather(*[loop.run_in_executor(executor, _scan, d) for d in dirs_cd_id])
+        rows = {row[0]: row for scan in scans for row in scan}
+
+        (added, removed) = await self._execute(self._rebuild, rows)
+        (self._listings, self._tags) = ({}, {})
+        LOGGER.info(
+            'Built catalog of %s rev reg ids from tails tree in %.3f s: %s added, %s removed',
+            len(rows),
+            time() - start,
+            added,
+            removed)
+
+        return len(rows)
+
+    def _rebuild(self, rows: dict) -> tuple:
+        """
+        Replace catalog content with rows from tails tree in one transaction, recording additions and removals.
+        Run in the executor owning the connection.
+
+        :param rows: rows (rr_id, cd_id, did, tails_hash, size, uploaded) by rev reg id
+        :return: pair (number of rev reg ids added, number removed)
+        """
+
+        extant = dict(self._conn.execute('SELECT rr_id, tails_hash FROM tails').fetchall())
+        removed = [(rr_id,) for rr_id in extant if rr_id not in rows]
+        added = [row for (rr_id, row) in rows.items() if extant.get(rr_id, None) != row[3]]
+        self._write(
+            (
+                'INSERT INTO changes (rr_id, cd_id, did, added) SELECT rr_id, cd_id, did, 0 FROM tails WHERE rr_id = ?',
+                removed),
+            ('DELETE FROM tails WHERE rr_id = ?', removed),
+            ('INSERT OR REPLACE INTO tails VALUES (?, ?, ?, ?, ?, ?)', added),
+            ('INSERT INTO changes (rr_id, cd_id, did, added) VALUES (?, ?, ?, 1)', [row[:3] for row in added]),
+            ('PRAGMA user_version={}'.format(VERSION), ()))
+
+        return (len(added), len(removed))
+
+    async def generation(self) -> str:
+        """
+        Return current generation token: catalog identifier and generation.
+
+        :return: generation token
+        """
+
+        await self._refresh()
+        return '{}.{}'.format(self._id, self._generation)
+
+    def start(self) -> None:
+        """
+        Schedule any rebuilds from tails tree on the event loop.
+        """
+
+        if self._rescan_interval:
+            self._timer = asyncio.get_event_loop().call_later(self._rescan_interval, self._tick)
+
+    def _tick(self) -> None:
+        """
+        Rebuild catalog from tails tree, and schedule the next.
+        """
+
+        asyncio.ensure_future(self.build())
+        self._timer = asyncio.get_event_loop().call_later(self._rescan_interval, self._tick)
+
+    async def rr_ids(self, ident: str, after: str = None, limit: int = None) -> list:
+        """
+        Return rev reg ids with tails files, sorted: all, by rev reg id, by cred def id, or by issuer DID;
+        optionally only those following a cursor, up to a limit. Query in the default executor,
+        on a connection of its own.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        :param after: cursor: rev reg id after which to start, or None to start at the first
+        :param limit: maximum number of rev reg ids to return, or None for no limit
+        :return: list of rev reg ids, or None if identifier is not a valid specifier
+        """
+
+        where = Catalog._where(ident)
+        if where is None:
+            return None
+
+        (clauses, params) = ([where[0]] if where[0] else [], list(where[1]))
+        if after is not None:
+            clauses.append('rr_id > ?')
+            params.append(after)
+        sql = 'SELECT rr_id FROM tails{} ORDER BY rr_id{}'.format(
+            ' WHERE {}'.format(' AND '.join(clauses)) if clauses else '',
+            ' LIMIT {}'.format(int(limit)) if limit is not None else '')
+
+        return [row[0] for row in await asyncio.get_event_loop().run_in_executor(None, self._read, sql, tuple(params))]
+
+    async def listing(self, ident: str) -> bytes:
+        """
+        Return serialized JSON array of rev reg ids with tails files on filter, from cache where possible.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        :return: JSON array as bytes, or None if identifier is not a valid specifier
+        """
+
+        await self._refresh()
+        generation = self._generation
+        rv = self._listings.get(ident, None)
+        if rv is None:
+            rr_ids = await self.rr_ids(ident)
+            if rr_ids is None:
+                return None
+            rv = json.dumps(rr_ids).encode()
+            if generation == self._generation and not ok_rev_reg_id(ident):  # unchanged while querying; bounded
+                self._listings[ident] = rv
+
+        return rv
+
+    async def tag(self, ident: str) -> str:
+        """
+        Return generation token of latest change affecting listing on filter, from cache where possible;
+        for a filter without changes in retained history, that of the earliest generation retained.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        :return: generation token, or None if identifier is not a valid specifier
+        """
+
+        where = Catalog._where(ident)
+        if where is None:
+            return None
+        if not where[0]:
+            return await self.generation()
+
+        generation = self._generation
+        rv = self._tags.get(ident, None)
+        if rv is None:
+            latest = (await asyncio.get_event_loop().run_in_executor(
+                None,
+                self._read,
+                'SELECT MAX(generation) FROM changes WHERE {}'.format(where[0]),
+                where[1]))[0][0]
+            rv = '{}.{}'.format(self._id, max(latest or 0, self._floor))
+            if generation == self._generation and not ok_rev_reg_id(ident):  # unchanged while querying; bounded
+                self._tags[ident] = rv
+
+        return rv
+
+    async def changes(self, ident: str, since: str) -> dict:
+        """
+        Return changes to rev reg ids with tails files on filter since generation, as of the generation
+        stored in the catalog. Raise StaleGeneration if generation token is not from this catalog, predates its
+        retained history of changes, or is ahead of its current generation.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        :param since: generation token
+        :return: dict with current generation token, and sorted lists of rev reg ids added and removed since
+            input generation, or None if identifier is not a valid specifier
+        """
+
+        where = Catalog._where(ident)
+        if where is None:
+            return None
+
+        (current, rows) = await asyncio.get_event_loop().run_in_executor(None, self._read_changes, since, where)
+        net = {}  # rev reg id -> whether added, as per latest change
+        for (rr_id, added) in rows:
+            net[rr_id] = bool(added)
+
+        return {
+            'generation': '{}.{}'.format(self._id, current),
+            'added': sorted(rr_id for (rr_id, added) in net.items() if added),
+            'removed': sorted(rr_id for (rr_id, added) in net.items() if not added)
+        }
+
+    async def add(self, rr_id: str, tails_hash: str, size: int) -> None:
+        """
+        Catalog link from rev reg id to tails file, as published now.
+
+        :param rr_id: rev reg id
+        :param tails_hash: tails hash
+        :param size: tails file size in bytes
+        """
+
+        cd_id = rev_reg_id2cred_def_id(rr_id)
+        did = cd_id.split(':')[0]
+        await self._execute(
+            self._write,
+            ('INSERT OR REPLACE INTO tails VALUES (?, ?, ?, ?, ?, ?)', (rr_id, cd_id, did, tails_hash, size, time())),
+            ('INSERT INTO changes (rr_id, cd_id, did, added) VALUES (?, ?, ?, 1)', (rr_id, cd_id, did)))
+        for ident in ('all', did, cd_id):
+            self._listings.pop(ident, None)
+            self._tags.pop(ident, None)
+
+    async def remove(self, ident: str) -> None:
+        """
+        Drop rev reg ids from catalog, as deleted: all, by rev reg id, by cred def id, or by issuer DID.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        """
+
+        where = Catalog._where(ident)
+        if where is None:
+            return
+
+        clause = ' WHERE {}'.format(where[0]) if where[0] else ''
+        await self._execute(
+            self._write,
+            ('INSERT INTO changes (rr_id, cd_id, did, added) SELECT rr_id, cd_id, did, 0 FROM tails{}'.format(clause),
+                where[1]),
+            ('DELETE FROM tails{}'.format(clause), where[1]))
+        (self._listings, self._tags) = ({}, {})
+
+    @staticmethod
+    def _where(ident: str) -> tuple:
+        """
+        Return SQL condition on tails table for filter, and its parameters.
+
+        :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+        :return: pair (condition, or empty string for none; parameters), or None if identifier is not
+            a valid specifier
+        """
+
+        if ident == 'all':  # 'all' is not valid base58 so it can't be any case below
+            return ('', ())
+        if ok_rev_reg_id(ident):
+            return ('rr_id = ?', (ident,))
+        if ok_cred_def_id(ident):
+            return ('cd_id = ?', (ident,))
+        if ok_did(ident):
+            return ('did = ?', (ident,))
+
+        return None
+
+    def _write(self, *statements) -> None:
+        """
+        Execute statements in one transaction, rolling back on any failure. Read generation and floor from
+        the database within the transaction, advance generation past changes recorded, and prune history
+        of changes beyond retention (with some slack, so as to prune in bulk). Run in the executor owning
+        the connection.
+
+        :param statements: pairs (SQL, parameters): a tuple of parameters, or a list of tuples to execute SQL
+            for each
+        """
+
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            meta = dict(self._conn.execute('SELECT key, value FROM meta').fetchall())
+            (generation, floor) = (int(meta['generation']), int(meta['floor']))
+            for (sql, params) in statements:
+                if isinstance(params, list):
+                    self._conn.executemany(sql, params)
+                else:
+                    self._conn.execute(sql, params)
+            generation = max(  # one more per change recorded, as numbered in transaction
+                generation,
+                self._conn.execute('SELECT MAX(generation) FROM changes').fetchone()[0] or 0)
+            self._conn.execute('UPDATE meta SET value = ? WHERE key = ?', (str(generation), 'generation'))
+            if generation - floor > self._history + self._history // 10:
+                floor = generation - self._history
+                self._conn.execute('DELETE FROM changes WHERE generation <= ?', (floor,))
+                self._conn.execute('UPDATE meta SET value = ? WHERE key = ?', (str(floor), 'floor'))
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+
+        (self._generation, self._floor) = (generation, floor)
+
+    def _read(self, sql: str, params: tuple) -> list:
+        """
+        Return result of query on a connection of its own, for use off the event loop.
+
+        :param sql: SQL query
+        :param params: query parameters
+        :return: list of rows
+        """
+
+        conn = sqlite3.connect(self._path)
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def _read_changes(self, since: str, where: tuple) -> tuple:
+        """
+        Return current generation and changes on filter since generation token, reading both in one transaction
+        on a connection of its own, for use off the event loop. Raise StaleGeneration if generation token
+        is not from this catalog, predates its retained history of changes, or is ahead of its current generation.
+
+        :param since: generation token
+        :param where: SQL condition on filter and its parameters, as per _where()
+        :return: pair (current generation, rows (rr_id, added) in order of generation)
+        """
+
+        conn = sqlite3.connect(self._path, isolation_level=None)
+        try:
+            conn.execute('BEGIN')
+            meta = dict(conn.execute('SELECT key, value FROM meta').fetchall())
+            (floor, current) = (int(meta['floor']), int(meta['generation']))
+            (cat_id, _, generation) = (since or '').partition('.')
+            if cat_id != meta['id'] or not generation.isdigit() or not floor <= int(generation) <= current:
+                raise StaleGeneration('Changes since {} unavailable from catalog at {}.{}, retaining since {}'.format(
+                    since,
+                    meta['id'],
+                    current,
+                    floor))
+
+            sql = 'SELECT rr_id, added FROM changes WHERE generation > ? AND generation <= ?{} ORDER BY generation'
+            return (
+                current,
+                conn.execute(
+                    sql.format(' AND {}'.format(where[0]) if where[0] else ''),
+                    (int(generation), current, *where[1])).fetchall())
+        finally:
+            conn.close()
+
+
+def usage() -> None:
+    """
+    Print usage message.
+    """
+
+    print('\nUsage: catalog.py <config-ini> [<dir-tails>]')
+    print()
+    print('where:')
+    print('    * <config-ini> represents the path to the tails server configuration file, and')
+    print('    * <dir-tails> represents the tails directory (default: tails directory of tails server).')
+    print()
+    print('The operation rebuilds the catalog of tails files, in catalog.db next to the tails directory,')
+    print('from the tails tree.')
+    print()
+
+
+if __name__ == '__main__':
+    from von_anchor.frill import do_wait, inis2dict
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)-15s | %(levelname)-8s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    if len(sys.argv) not in (2, 3):
+        usage()
+    else:
+        DIR_TAILS = sys.argv[2] if len(sys.argv) == 3 else join(dirname(dirname(realpath(__file__))), 'tails')
+        if not isdir(DIR_TAILS):
+            print('No such tails directory: {}'.format(DIR_TAILS))
+        else:
+            CATALOG = Catalog.from_config(inis2dict(sys.argv[1]), join(dirname(DIR_TAILS), 'catalog.db'), DIR_TAILS)
+            if not do_wait(CATALOG.open()):
+                do_wait(CATALOG.build())
+            CATALOG.close()
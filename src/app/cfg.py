@@ -48,6 +48,23 @@ def init_logging() -> None:
     logging.getLogger('von_tails').setLevel(logging.INFO)
 
 
+def config_number(cfg: dict, key: str, default: float, cast: type = int) -> float:
+    """
+    Return numeric value from configuration section, or default if missing or blank; an explicit zero stands.
+
+    :param cfg: configuration section dict
+    :param key: configuration key
+    :param default: default value
+    :param cast: numeric type of value
+    :return: configuration value
+    """
+
+    value = cfg.get(key, None)
+    if value is None or not str(value).strip():
+        return default
+    return cast(value)
+
+
 def set_config() -> dict:
     """
     Read configuration file content into memory cache.
@@ -0,0 +1,110 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+from email.utils import formatdate, parsedate_to_datetime
+
+
+def etag(tails_hash: str, encoding: str = None) -> str:
+    """
+    Return strong entity tag for tails file: its tails hash, which identifies its content,
+    qualified by any content encoding of precompressed variant.
+
+    :param tails_hash: tails hash
+    :param encoding: content encoding of variant, or None for tails file as is
+    :return: entity tag, quoted
+    """
+
+    return '"{}-{}"'.format(tails_hash, encoding) if encoding else '"{}"'.format(tails_hash)
+
+
+def http_date(epoch: float) -> str:
+    """
+    Return HTTP date for EPOCH time, to the second.
+
+    :param epoch: EPOCH time
+    :return: HTTP date
+    """
+
+    return formatdate(int(epoch), usegmt=True)
+
+
+def _epoch(date: str) -> int:
+    """
+    Return EPOCH time for HTTP date, or None if malformed.
+
+    :param date: HTTP date
+    :return: EPOCH time, to the second
+    """
+
+    try:
+        return int(parsedate_to_datetime(date).timestamp())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def _etags(header: str) -> list:
+    """
+    Return entity tags from if-none-match or if-match header, with any weakness indicators removed.
+
+    :param header: header value
+    :return: list of entity tags, quoted, or ['*']
+    """
+
+    return [tag.strip()[2:] if tag.strip().startswith('W/') else tag.strip() for tag in header.split(',')]
+
+
+def is_not_modified(headers: dict, tag: str, mtime: float = None) -> bool:
+    """
+    Return whether conditional GET headers show client to have current content, as per RFC 7232:
+    If-None-Match (by weak comparison) takes precedence over If-Modified-Since.
+
+    :param headers: request headers
+    :param tag: entity tag of current content
+    :param mtime: modification time of current content, as EPOCH time, or None if content has none
+    :return: whether to respond with status 304
+    """
+
+    if_none_match = headers.get('if-none-match', None)
+    if if_none_match:
+        tags = _etags(if_none_match)
+        return '*' in tags or tag in tags
+
+    if_modified_since = _epoch(headers.get('if-modified-since', None))
+    if if_modified_since is not None and mtime is not None:
+        return int(mtime) <= if_modified_since
+
+    return False
+
+
+def is_range_current(headers: dict, tag: str, mtime: float) -> bool:
+    """
+    Return whether any If-Range header admits a range request against current content, as per RFC 7233:
+    an entity tag must match by strong comparison, and a date must match modification time exactly.
+
+    :param headers: request headers
+    :param tag: entity tag of current content
+    :param mtime: modification time of current content, as EPOCH time
+    :return: whether to honour any range header
+    """
+
+    if_range = (headers.get('if-range', None) or '').strip()
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == tag
+
+    return _epoch(if_range) == int(mtime)
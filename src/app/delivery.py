@@ -0,0 +1,264 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import logging
+
+from mimetypes import guess_type
+from os import pread
+from typing import Callable, Iterable
+from os.path import join, relpath
+from urllib.parse import quote
+
+from sanic import response
+from sanic.response import HTTPResponse, StreamingHTTPResponse
+
+from app.cfg import config_number
+
+
+LOGGER = logging.getLogger(__name__)
+
+OFFLOAD_HEADERS = ('X-Accel-Redirect', 'X-Sendfile')  # nginx; Apache mod_xsendfile or lighttpd
+
+
+class Delivery:
+    """
+    Delivery of file content in streaming responses, so that worker memory stays flat however many
+    downloads are in progress. Where the event loop supports it (asyncio loop on Python 3.7+), the kernel
+    copies file pages to the socket via sendfile; otherwise, the server reads and writes the file
+    in chunks of configured size.
+
+    Alternatively, a front proxy may deliver files: the server answers with an internal redirect header
+    (X-Accel-Redirect for nginx, X-Sendfile for Apache mod_xsendfile or lighttpd) and no content,
+    and the proxy serves the file from disk.
+    """
+
+    def __init__(
+            self,
+            chunk_size: int = 262144,
+            sendfile: bool = True,
+            offload: str = None,
+            dir_root: str = None,
+            offload_prefix: str = '') -> None:
+        """
+        Initialize delivery.
+
+        :param chunk_size: chunk size in bytes for each sendfile call or read
+        :param sendfile: whether to use sendfile where the event loop supports it
+        :param offload: internal redirect header for front proxy to deliver files, or None to deliver them here
+        :param dir_root: directory under which files to deliver reside, for internal redirects
+        :param offload_prefix: prefix replacing dir_root in internal redirects: internal location URI for
+            X-Accel-Redirect; file system path on proxy host for X-Sendfile, or empty for dir_root itself
+        """
+
+        self._chunk_size = max(4096, chunk_size)
+        self._sendfile = sendfile
+        self._offload = offload
+        self._dir_root = dir_root
+        self._offload_prefix = offload_prefix
+
+    @staticmethod
+    def from_config(config: dict, dir_root: str) -> 'Delivery':
+        """
+        Return delivery as per [Tails Server] configuration section: download.chunk.kb (default 256),
+        download.sendfile (default True), download.offload (default blank for none; x-accel-redirect or x-sendfile),
+        download.offload.prefix (default /tails-internal for x-accel-redirect, blank for x-sendfile).
+
+        :param config: configuration dict
+        :param dir_root: directory under which files to deliver reside
+        :return: delivery
+        """
+
+        cfg = config.get('Tails Server', {})
+        offload = (cfg.get('download.offload', '') or '').strip().lower()
+        header = {h.lower(): h for h in OFFLOAD_HEADERS}.get(offload, None)
+        if offload and not header:
+            LOGGER.warning('Unsupported download.offload %s: delivering files from tails server', offload)
+
+        prefix = (cfg.get('download.offload.prefix', '') or '').strip() or (
+            '/tails-internal' if header == 'X-Accel-Redirect' else dir_root)
+
+        return Delivery(
+            config_number(cfg, 'download.chunk.kb', 256) * 1024,
+            cfg.get('download.sendfile', '1').lower() in ['1', 'true', 'yes'],
+            header,
+            dir_root,
+            prefix)
+
+    @property
+    def offload(self) -> str:
+        """
+        Accessor for internal redirect header for front proxy to deliver files, or None to deliver them here.
+
+        :return: internal redirect header name, or None
+        """
+
+        return self._offload
+
+    def redirect(self, path: str, headers: dict = None, content_type: str = None) -> HTTPResponse:
+        """
+        Return empty response with internal redirect header, for front proxy to deliver file.
+
+        :param path: path to file, under root directory
+        :param headers: response headers for proxy to pass on
+        :param content_type: content type (default as per file name)
+        :return: HTTP response
+        """
+
+        target = join(self._offload_prefix, relpath(path, self._dir_root))
+        headers = dict(headers or {})
+        headers[self._offload] = quote(target, safe='/:') if self._offload == 'X-Accel-Redirect' else target
+
+        return response.raw(b'', headers=headers, content_type=content_type or guess_type(path)[0] or 'text/plain')
+
+    def file(
+            self,
+            path: str,
+            segments: list,
+            status: int = 200,
+            headers: dict = None,
+            content_type: str = None,
+            fh=None,
+            release: Callable = None) -> StreamingHTTPResponse:
+        """
+        Return streaming response with content segments from file, with Content-Length header.
+
+        :param path: path to file
+        :param segments: content segments in order: bytes to write as they are, or pairs (offset, count)
+            for file content
+        :param status: HTTP status
+        :param headers: response headers
+        :param content_type: content type (default as per file name, as per Sanic file response)
+        :param fh: open binary file handle on file, which responses may share, or None to open file by path
+        :param release: callable to call once response has finished streaming, e.g., to let go of file handle
+        :return: streaming response
+        """
+
+        return self.stream(
+            [s if isinstance(s, bytes) else (fh or path, *s) for s in segments],
+            status,
+            headers,
+            content_type or guess_type(path)[0] or 'text/plain',
+            release)
+
+    def stream(
+            self,
+            segments: Iterable,
+            status: int = 200,
+            headers: dict = None,
+            content_type: str = 'application/octet-stream',
+            release: Callable = None,
+            size: int = None) -> StreamingHTTPResponse:
+        """
+        Return streaming response with content segments from any number of files, with Content-Length header.
+
+        :param segments: content segments in order: bytes to write as they are, or triples (file, offset, count)
+            for file content, where file is an open binary file handle or a path to open only once writing;
+            any iterable, which may generate segments only as writing reaches them if the caller specifies size
+        :param status: HTTP status
+        :param headers: response headers
+        :param content_type: content type
+        :param release: callable to call once response has finished streaming, e.g., to let go of file handles
+        :param size: total size of content segments in bytes, or None to sum them (from a list)
+        :return: streaming response
+        """
+
+        headers = dict(headers or {})
+        headers['Content-Length'] = str(
+            sum(len(s) if isinstance(s, bytes) else s[2] for s in segments) if size is None else size)
+
+        async def _streaming_fn(resp: StreamingHTTPResponse) -> None:
+            try:
+                await self._write(resp, segments)
+            finally:
+                if release:
+                    release()
+
+        return response.stream(
+            _streaming_fn,
+            status=status,
+            headers=headers,
+            content_type=content_type,
+            chunked=False)
+
+    async def _write(self, resp: StreamingHTTPResponse, segments: Iterable) -> None:
+        """
+        Write content segments to streaming response, opening files by path one at a time.
+
+        :param resp: streaming response
+        :param segments: content segments: bytes, or triples (file handle or path, offset, count)
+        """
+
+        transport = getattr(resp.protocol, 'transport', None)
+        sendfile = self._sendfile and transport is not None and hasattr(asyncio.get_event_loop(), 'sendfile')
+
+        for segment in segments:
+            if isinstance(segment, bytes):
+                await resp.write(segment)
+                continue
+
+            (src, offset, count) = segment
+            if isinstance(src, str):
+                with open(src, 'rb') as fh:
+                    sendfile = await self._write_file(resp, fh, offset, count, sendfile)
+            else:
+                sendfile = await self._write_file(resp, src, offset, count, sendfile)
+
+    async def _write_file(
+            self,
+            resp: StreamingHTTPResponse,
+            fh,
+            offset: int,
+            count: int,
+            sendfile: bool) -> bool:
+        """
+        Write file content to streaming response. Read file content only at explicit offsets,
+        never from the file position, so that concurrent responses may share a file handle.
+
+        :param resp: streaming response
+        :param fh: open binary file handle
+        :param offset: offset of content in file
+        :param count: number of bytes to write
+        :param sendfile: whether to try sendfile
+        :return: whether sendfile remains available for further file content
+        """
+
+        loop = asyncio.get_event_loop()
+        if sendfile:
+            try:
+                while count > 0:  # in chunks, so a slow client yields the loop to others between calls
+                    sent = await loop.sendfile(
+                        resp.protocol.transport,
+                        fh,
+                        offset,
+                        min(count, self._chunk_size),
+                        fallback=False)
+                    if not sent:
+                        break
+                    (offset, count) = (offset + sent, count - sent)
+                return True
+            except (NotImplementedError, RuntimeError) as x_sendfile:  # no native sendfile for transport
+                LOGGER.debug('Sendfile unavailable, reverting to chunked reads: %s', x_sendfile)
+
+        while count > 0:
+            chunk = await loop.run_in_executor(None, pread, fh.fileno(), min(count, self._chunk_size), offset)
+            if not chunk:
+                break
+            await resp.write(chunk)
+            (offset, count) = (offset + len(chunk), count - len(chunk))
+
+        return False
@@ -0,0 +1,258 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import json
+import logging
+import os
+
+from os import rename
+from os.path import isfile
+from time import time
+
+from app.cfg import config_number
+from app.statcache import StatCache
+
+
+LOGGER = logging.getLogger(__name__)
+
+MIN_SCORE = 0.01  # decayed hits below which to forget rev reg id
+
+
+class Heat:
+    """
+    Access frequency of tails files by rev reg id, as counters of downloads and bytes served that decay
+    exponentially with configured half-life, so that recent demand outweighs old. The server persists counters
+    periodically and, at startup and on schedule, has the kernel read the hottest tails files (and their
+    precompressed variants) into the page cache, so that download latency holds up after a restart.
+    """
+
+    def __init__(
+            self,
+            path: str,
+            stat_cache: StatCache,
+            half_life: int = 86400,
+            persist_interval: int = 300,
+            warm_interval: int = 3600,
+            warm_count: int = 64,
+            warm_bytes: int = 1024 * 1024 * 1024) -> None:
+        """
+        Initialize access counters from any persisted at path.
+
+        :param path: path to file persisting counters
+        :param stat_cache: tails file metadata and handle cache, for resolving tails files to warm
+        :param half_life: half-life of counters, in seconds
+        :param persist_interval: interval between persisting counters, in seconds
+        :param warm_interval: interval between page cache warmings, in seconds, or 0 for startup only
+        :param warm_count: maximum number of tails files to warm
+        :param warm_bytes: maximum total size of files to warm, in bytes
+        """
+
+        self._path = path
+        self._stat_cache = stat_cache
+        self._half_life = max(1, half_life)
+        self._persist_interval = max(1, persist_interval)
+        self._warm_interval = max(0, warm_interval)
+        self._warm_count = max(0, warm_count)
+        self._warm_bytes = max(0, warm_bytes)
+        self._counters = {}  # rev reg id -> [decayed hits, decayed bytes, EPOCH time of last decay]
+        self._timers = {}  # task -> timer handle
+        self._load()
+
+    @staticmethod
+    def from_config(config: dict, path: str, stat_cache: StatCache) -> 'Heat':
+        """
+        Return access counters as per [Tails Server] configuration section: heat.half.life.sec (default 86400),
+        heat.persist.sec (default 300), heat.warm.sec (default 3600), heat.warm.count (default 64),
+        heat.warm.mb (default 1024).
+
+        :param config: configuration dict
+        :param path: path to file persisting counters
+        :param stat_cache: tails file metadata and handle cache
+        :return: access counters
+        """
+
+        cfg = config.get('Tails Server', {})
+        return Heat(
+            path,
+            stat_cache,
+            config_number(cfg, 'heat.half.life.sec', 86400),
+            config_number(cfg, 'heat.persist.sec', 300),
+            config_number(cfg, 'heat.warm.sec', 3600),
+            config_number(cfg, 'heat.warm.count', 64),
+            config_number(cfg, 'heat.warm.mb', 1024) * 1024 * 1024)
+
+    def record(self, rr_id: str, size: int) -> None:
+        """
+        Count download of tails file.
+
+        :param rr_id: rev reg id
+        :param size: bytes served
+        """
+
+        now = time()
+        counter = self._decayed(rr_id, now)
+        self._counters[rr_id] = [counter[0] + 1, counter[1] + size, now]
+
+    def hottest(self, count: int = None) -> list:
+        """
+        Return rev reg ids by decayed bytes served, hottest first.
+
+        :param count: maximum number of rev reg ids to return, or None for all
+        :return: list of rev reg ids
+        """
+
+        now = time()
+        rv = sorted(self._counters, key=lambda rr_id: self._decayed(rr_id, now)[1], reverse=True)
+
+        return rv[:count] if count is not None else rv
+
+    def start(self) -> None:
+        """
+        Warm page cache now, then schedule persistence and any further warming on the event loop.
+        """
+
+        loop = asyncio.get_event_loop()
+        asyncio.ensure_future(self.warm())
+        self._timers['persist'] = loop.call_later(self._persist_interval, self._tick, 'persist')
+        if self._warm_interval:
+            self._timers['warm'] = loop.call_later(self._warm_interval, self._tick, 'warm')
+
+    async def warm(self) -> int:
+        """
+        Advise kernel to read hottest tails files and their variants into page cache, within configured bounds,
+        via file handles from stat cache. Forget rev reg ids without tails files.
+
+        :return: number of tails files warmed
+        """
+
+        metas = []
+        total = 0
+        for rr_id in self.hottest():
+            if len(metas) >= self._warm_count:
+                break
+            meta = self._stat_cache.acquire(rr_id)
+            if not meta:
+                self._counters.pop(rr_id, None)
+                continue
+            held = meta['size'] + sum(meta['variants'].values())
+            if total + held > self._warm_bytes:
+                self._stat_cache.release(meta)
+                break
+            total += held
+            metas.append(meta)
+
+        try:
+            if metas and hasattr(os, 'posix_fadvise'):
+                await asyncio.get_event_loop().run_in_executor(
+                    None,
+                    Heat._fadvise,
+                    [[meta['fh'], *meta['fh_variants'].values()] for meta in metas])
+                LOGGER.info('Warmed page cache with %s hottest tails files (%s bytes)', len(metas), total)
+        finally:
+            for meta in metas:
+                self._stat_cache.release(meta)
+
+        return len(metas)
+
+    async def persist(self) -> None:
+        """
+        Persist counters, forgetting any decayed below threshold; write to temporary file and rename into place.
+        """
+
+        now = time()
+        for rr_id in list(self._counters):
+            if self._decayed(rr_id, now)[0] < MIN_SCORE:
+                del self._counters[rr_id]
+        content = json.dumps({'half_life': self._half_life, 'counters': self._counters})
+
+        def _write() -> None:
+            path_tmp = '{}.tmp'.format(self._path)
+            with open(path_tmp, 'w') as fh:
+                fh.write(content)
+            rename(path_tmp, self._path)
+
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, _write)
+        except OSError as x_os:
+            LOGGER.warning('Could not persist tails file access counters to %s: %s', self._path, x_os)
+
+    async def close(self) -> None:
+        """
+        Cancel schedule and persist counters.
+        """
+
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers = {}
+        await self.persist()
+
+    def _tick(self, task: str) -> None:
+        """
+        Run scheduled persistence or warming, and schedule the next.
+
+        :param task: 'persist' or 'warm'
+        """
+
+        asyncio.ensure_future(self.persist() if task == 'persist' else self.warm())
+        self._timers[task] = asyncio.get_event_loop().call_later(
+            self._persist_interval if task == 'persist' else self._warm_interval,
+            self._tick,
+            task)
+
+    def _decayed(self, rr_id: str, now: float) -> list:
+        """
+        Return counters for rev reg id, decayed to input time.
+
+        :param rr_id: rev reg id
+        :param now: EPOCH time
+        :return: list [decayed hits, decayed bytes, input time]
+        """
+
+        (hits, size, since) = self._counters.get(rr_id, [0, 0, now])
+        factor = 0.5 ** (max(0, now - since) / self._half_life)
+
+        return [hits * factor, size * factor, now]
+
+    def _load(self) -> None:
+        """
+        Load any persisted counters, ignoring any unreadable file.
+        """
+
+        if not isfile(self._path):
+            return
+        try:
+            with open(self._path, 'r') as fh:
+                self._counters = {k: list(v) for (k, v) in json.load(fh).get('counters', {}).items()}
+            LOGGER.info('Loaded tails file access counters for %s rev reg ids', len(self._counters))
+        except (OSError, ValueError, AttributeError) as x_load:
+            LOGGER.warning('Could not load tails file access counters from %s: %s', self._path, x_load)
+
+    @staticmethod
+    def _fadvise(handles: list) -> None:
+        """
+        Advise kernel to read files into page cache.
+
+        :param handles: lists of open binary file handles
+        """
+
+        for fhs in handles:
+            for fh in fhs:
+                try:
+                    os.posix_fadvise(fh.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+                except OSError as x_fadvise:  # e.g., file system does not support advice
+                    LOGGER.debug('Could not warm page cache for file: %s', x_fadvise)
@@ -0,0 +1,189 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import logging
+
+from time import time
+from typing import Awaitable, Callable
+from uuid import uuid4
+
+from sanic.response import HTTPResponse
+
+from app.cfg import config_number
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class JobsBusy(Exception):
+    """
+    Upload job queue is at capacity.
+    """
+
+
+class UploadJobs:
+    """
+    Registry and worker pool for asynchronous upload processing. The server accepts a staged upload,
+    responds at once with a job identifier, and leaves signature verification, ledger lookup, and
+    publication to workers on the event loop; the issuer polls job state for the outcome.
+
+    Job state lives in memory only: a server restart loses queued jobs along with their staged content.
+    """
+
+    def __init__(self, workers: int = 2, queue_max: int = 64, ttl: int = 3600) -> None:
+        """
+        Initialize upload job registry.
+
+        :param workers: maximum jobs to process at once
+        :param queue_max: maximum jobs queued or in progress, beyond which to reject
+        :param ttl: time to retain state of finished jobs, in seconds
+        """
+
+        self._workers = max(1, workers)
+        self._queue_max = max(self._workers, queue_max)
+        self._ttl = max(0, ttl)
+        self._queue = None  # create on first use, on the serving event loop
+        self._tasks = []
+        self._jobs = {}  # job id -> job state
+        self._work = {}  # job id -> (process, cleanup) for jobs not yet started
+
+    @staticmethod
+    def from_config(config: dict) -> 'UploadJobs':
+        """
+        Return upload job registry as per [Tails Server] configuration section: upload.async.workers (default 2),
+        upload.async.queue.max (default 64), upload.async.ttl.sec (default 3600).
+
+        :param config: configuration dict
+        :return: upload job registry
+        """
+
+        cfg = config.get('Tails Server', {})
+        return UploadJobs(
+            config_number(cfg, 'upload.async.workers', 2),
+            config_number(cfg, 'upload.async.queue.max', 64),
+            config_number(cfg, 'upload.async.ttl.sec', 3600))
+
+    @property
+    def pending(self) -> int:
+        """
+        Accessor for number of jobs queued or in progress.
+
+        :return: jobs pending
+        """
+
+        return sum(1 for job in self._jobs.values() if job['state'] != 'done')
+
+    def submit(
+            self,
+            rr_id: str,
+            process: Callable[[], Awaitable[HTTPResponse]],
+            cleanup: Callable[[], None]) -> dict:
+        """
+        Queue upload job. Raise JobsBusy if queue is at capacity.
+
+        :param rr_id: rev reg id of upload
+        :param process: coroutine function processing upload, returning HTTP response as per synchronous upload
+        :param cleanup: function releasing staged content, to call when job is done
+        :return: job state
+        """
+
+        self._prune()
+        if self.pending >= self._queue_max:
+            LOGGER.warning('Upload job queue at capacity (%s): rejecting upload for %s', self.pending, rr_id)
+            raise JobsBusy('Upload job queue at capacity ({})'.format(self.pending))
+
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self._workers)]
+
+        job_id = uuid4().hex
+        self._jobs[job_id] = {
+            'id': job_id,
+            'rr_id': rr_id,
+            'state': 'queued',
+            'created': int(time()),
+            'finished': None,
+            'status': None,
+            'message': None
+        }
+        self._work[job_id] = (process, cleanup)
+        self._queue.put_nowait(job_id)
+        LOGGER.info('Queued upload job %s for %s', job_id, rr_id)
+
+        return dict(self._jobs[job_id])
+
+    def get(self, job_id: str) -> dict:
+        """
+        Return job state by identifier, or None for no such job.
+
+        :param job_id: job identifier
+        :return: job state: identifier, rev reg id, state (queued, running, done), creation and finish times,
+            and, once done, HTTP status and message as per synchronous upload
+        """
+
+        self._prune()
+        job = self._jobs.get(job_id, None)
+        return dict(job) if job else None
+
+    def close(self) -> None:
+        """
+        Cancel workers and release staged content of jobs not yet started.
+        """
+
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        for (job_id, (_, cleanup)) in list(self._work.items()):
+            LOGGER.warning('Abandoning upload job %s for %s on shutdown', job_id, self._jobs[job_id]['rr_id'])
+            cleanup()
+        self._work.clear()
+
+    async def _worker(self) -> None:
+        """
+        Process queued jobs until cancelled.
+        """
+
+        while True:
+            job_id = await self._queue.get()
+            (process, cleanup) = self._work.pop(job_id)
+            job = self._jobs[job_id]
+            job['state'] = 'running'
+            try:
+                rv = await process()
+                (job['status'], job['message']) = (rv.status, rv.body.decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as x:  # keep worker alive; report as server error
+                LOGGER.exception('Upload job %s for %s failed', job_id, job['rr_id'])
+                (job['status'], job['message']) = (500, 'Upload job failed: {}'.format(x))
+            finally:
+                cleanup()
+                job['state'] = 'done'
+                job['finished'] = int(time())
+                self._queue.task_done()
+
+            LOGGER.info('Upload job %s for %s done with status %s', job_id, job['rr_id'], job['status'])
+
+    def _prune(self) -> None:
+        """
+        Forget finished jobs older than time to live.
+        """
+
+        horizon = time() - self._ttl
+        for job_id in [j for (j, job) in self._jobs.items() if job['state'] == 'done' and job['finished'] < horizon]:
+            del self._jobs[job_id]
@@ -0,0 +1,107 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import fcntl
+
+from os import O_CREAT, O_RDWR, close, makedirs, open as os_open
+from os.path import dirname
+
+
+class FileLock:
+    """
+    Advisory exclusive lock (flock) on a file in staging, coordinating all server worker processes
+    as well as concurrent requests within one: each instance opens its own file description, so two instances
+    on the same path exclude each other even in the same process. The kernel releases the lock if its holder dies.
+    """
+
+    def __init__(self, path: str, create: bool = True) -> None:
+        """
+        Initialize lock on file path.
+
+        :param path: path to lock file
+        :param create: whether to create lock file (and its directory) if absent; if not, lock fails on absent file
+        """
+
+        self._path = path
+        self._create = create
+        self._fd = None
+
+    @property
+    def held(self) -> bool:
+        """
+        Accessor for whether this instance holds its lock.
+
+        :return: whether lock is held
+        """
+
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """
+        Take lock without waiting. Return whether it is now held: false if another holder has it,
+        or if lock file is absent and instance does not create it.
+
+        :return: whether lock is held
+        """
+
+        if self._fd is not None:
+            return True
+
+        try:
+            if self._create:
+                makedirs(dirname(self._path), exist_ok=True)
+                fd = os_open(self._path, O_RDWR | O_CREAT, 0o644)
+            else:
+                fd = os_open(self._path, O_RDWR)
+        except FileNotFoundError:
+            return False
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:  # BlockingIOError: held elsewhere
+            close(fd)
+            return False
+
+        self._fd = fd
+        return True
+
+    async def wait(self, interval: float = 0.05) -> bool:
+        """
+        Take lock, polling on the event loop until other holder releases it. Return whether lock was free
+        on first try (false if waited). Polling rather than blocking in an executor thread means that
+        a cancelled waiter never goes on to take the lock. Only for instances that create their lock files.
+
+        :param interval: polling interval, in seconds
+        :return: whether lock was free without waiting
+        """
+
+        rv = self.acquire()
+        while not self.acquire():
+            await asyncio.sleep(interval)
+        return rv
+
+    def release(self) -> None:
+        """
+        Release lock if held.
+        """
+
+        if self._fd is not None:
+            fd = self._fd
+            self._fd = None
+            close(fd)  # closing last descriptor on file description releases flock
@@ -0,0 +1,201 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from os import O_RDONLY, close, fsync, open as os_open, rename
+from os.path import dirname
+from typing import Callable
+
+from app.cfg import config_number
+
+
+LOGGER = logging.getLogger(__name__)
+
+FSYNC_WORKERS = 8  # threads issuing the fsyncs of a batch at once
+
+
+def _fsync_path(path: str) -> None:
+    """
+    Flush file or directory at input path to stable storage.
+
+    :param path: path to file or directory
+    """
+
+    fd = os_open(path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+class Publisher:
+    """
+    Publisher moving complete staged tails files into place in tails tree, as per fsync policy:
+
+    - 'always' flushes each staged file before renaming it into place, and its directory once linked
+    - 'batched' does the same, but gathers publications arriving within a short window into one batch,
+      issuing the fsyncs of all its files at once, on several threads, so that the file system commits them
+      together in one journal transaction and the device can merge their writes; then the same for
+      the distinct directories of the batch
+    - 'never' renames and links without flushing, leaving durability to the operating system.
+
+    Under any policy, a tails file only appears at its final path once complete, and the server links
+    its rev reg id only after that; a crash cannot leave a truncated tails file to block re-upload.
+    """
+
+    POLICIES = ('always', 'batched', 'never')
+
+    def __init__(self, policy: str = 'batched', batch_sec: float = 0.05) -> None:
+        """
+        Initialize publisher.
+
+        :param policy: fsync policy: 'always', 'batched', or 'never'
+        :param batch_sec: time to gather publications into batch under 'batched' policy, in seconds
+        """
+
+        if policy not in Publisher.POLICIES:
+            raise ValueError('Fsync policy {} not in {}'.format(policy, Publisher.POLICIES))
+
+        self._policy = policy
+        self._batch_sec = max(0.0, batch_sec)
+        self._batch = []  # pending (staged path, final path, link function, future) under 'batched' policy
+        self._pool = None  # create on first flush
+
+    @staticmethod
+    def from_config(config: dict) -> 'Publisher':
+        """
+        Return publisher as per [Tails Server] configuration section: fsync.policy (default batched),
+        fsync.batch.ms (default 50).
+
+        :param config: configuration dict
+        :return: publisher
+        """
+
+        cfg = config.get('Tails Server', {})
+        return Publisher(
+            (cfg.get('fsync.policy', 'batched') or 'batched').lower(),
+            config_number(cfg, 'fsync.batch.ms', 50) / 1000)
+
+    @property
+    def policy(self) -> str:
+        """
+        Accessor for fsync policy.
+
+        :return: fsync policy
+        """
+
+        return self._policy
+
+    async def publish(self, path_staged: str, path_final: str, link: Callable[[], None]) -> None:
+        """
+        Move staged file into place and link it, flushing as per fsync policy. Return once published.
+
+        :param path_staged: path to complete staged file, on same file system as final path
+        :param path_final: final path for file
+        :param link: function linking published file (e.g., rev reg id to tails file); runs on event loop
+        """
+
+        loop = asyncio.get_event_loop()
+        if self._policy != 'batched':
+            future = loop.create_future()
+            await self._flush([(path_staged, path_final, link, future)])
+            return await future
+
+        future = loop.create_future()
+        self._batch.append((path_staged, path_final, link, future))
+        if len(self._batch) == 1:
+            loop.call_later(self._batch_sec, lambda: asyncio.ensure_future(self._flush_batch()))
+        await future
+
+    async def _flush_batch(self) -> None:
+        """
+        Publish pending batch.
+        """
+
+        (batch, self._batch) = (self._batch, [])
+        await self._flush(batch)
+
+    async def _fsync_all(self, paths: list) -> list:
+        """
+        Flush files or directories at input paths to stable storage, issuing all fsyncs at once.
+
+        :param paths: paths to files or directories
+        :return: list with, per path, None on success or exception on failure
+        """
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=FSYNC_WORKERS)
+
+        loop = asyncio.get_event_loop()
+        return await asyncio.gather(
+            *[loop.run_in_executor(self._pool, _fsync_path, path) for path in paths],
+            return_exceptions=True)
+
+    async def _flush(self, batch: list) -> None:
+        """
+        Publish batch of staged files and resolve each future on its outcome. On any unexpected failure,
+        fail every future not yet resolved, so that no publication waits forever.
+
+        :param batch: list of (staged path, final path, link function, future)
+        """
+
+        try:
+            await self._flush_staged(batch)
+        except Exception as x:
+            LOGGER.error('Failed to publish batch of %s staged files: %s', len(batch), x)
+            for (_, _, _, future) in batch:
+                if not future.done():
+                    future.set_exception(x)
+
+    async def _flush_staged(self, batch: list) -> None:
+        """
+        Publish batch of staged files: flush all (as per policy), rename each into place and link it,
+        then flush all distinct directories (as per policy). Resolve each future on its outcome.
+
+        :param batch: list of (staged path, final path, link function, future)
+        """
+
+        flush = self._policy != 'never'
+
+        if flush:
+            failures = await self._fsync_all([staged for (staged, _, _, _) in batch])
+        else:
+            failures = [None] * len(batch)
+
+        published = []
+        for ((staged, final, link, future), x_fsync) in zip(batch, failures):
+            try:
+                if x_fsync:
+                    raise x_fsync
+                rename(staged, final)
+                link()
+                published.append((final, future))
+            except Exception as x:
+                LOGGER.error('Failed to publish %s to %s: %s', staged, final, x)
+                future.set_exception(x)
+
+        if flush and published:
+            dirs = list({dirname(final) for (final, _) in published})
+            for x_fsync in await self._fsync_all(dirs):
+                if x_fsync:  # files are complete and in place: leave directory entries to operating system
+                    LOGGER.warning('Failed to flush directory of published file: %s', x_fsync)
+
+        for (_, future) in published:
+            future.set_result(None)
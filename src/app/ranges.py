@@ -0,0 +1,104 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import re
+
+from typing import NamedTuple
+
+
+MAX_RANGES = 16  # cap on ranges per request, beyond which to serve entire file
+
+RE_RANGE_SPEC = re.compile(r'^([0-9]*)-([0-9]*)$')
+
+
+class UnsatisfiableRange(Exception):
+    """
+    Range request has no range overlapping file content.
+    """
+
+
+class ByteRange(NamedTuple):
+    """
+    Satisfiable byte range within file, in the manner of Sanic content range handler: first and last
+    byte offsets (inclusive), size of range, and total size of file.
+    """
+
+    start: int
+    end: int
+    size: int
+    total: int
+
+    def content_range(self) -> str:
+        """
+        Return content-range header value for byte range.
+
+        :return: content-range header value
+        """
+
+        return 'bytes {}-{}/{}'.format(self.start, self.end, self.total)
+
+
+def parse_range(header: str, total: int) -> list:
+    """
+    Parse range header as per RFC 7233 against file of input size. Return None to ignore the header
+    (absent, malformed, in units other than bytes, or with more than MAX_RANGES or overlapping ranges) and
+    serve the entire file. Raise UnsatisfiableRange if no range overlaps file content.
+
+    :param header: range header value, or None if absent
+    :param total: file size in bytes
+    :return: list of satisfiable byte ranges in request order, or None to serve entire file
+    """
+
+    if not header:
+        return None
+
+    (unit, _, specs) = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+
+    specs = [spec.strip() for spec in specs.split(',') if spec.strip()]
+    if len(specs) > MAX_RANGES:
+        return None
+
+    rv = []
+    for spec in specs:
+        match = RE_RANGE_SPEC.match(spec)
+        if not match or not any(match.groups()):
+            return None
+        (first, last) = match.groups()
+        if not first:  # suffix range: final <last> bytes
+            if int(last) == 0 or total == 0:
+                continue
+            start = max(0, total - int(last))
+            end = total - 1
+        else:
+            start = int(first)
+            end = min(int(last), total - 1) if last else total - 1
+            if last and int(last) < start:
+                return None
+            if start >= total:
+                continue
+        rv.append(ByteRange(start, end, end - start + 1, total))
+
+    if not rv:
+        raise UnsatisfiableRange('No range in {} overlaps content of {} bytes'.format(header, total))
+
+    ordered = sorted(rv)
+    if any(ordered[i].start <= ordered[i - 1].end for i in range(1, len(ordered))):
+        return None
+
+    return rv
@@ -0,0 +1,56 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+from sanic.exceptions import PayloadTooLarge
+from sanic.request import Request
+
+
+class BoundedRequest(Request):
+    """
+    Request that the server buffers in memory only up to the application's configured
+    REQUEST_BUFFER_MAX_SIZE. The server raises REQUEST_MAX_SIZE to admit tails file uploads, but only
+    streaming handlers receive such bodies, counting bytes as they spool them; the server buffers the body
+    of a request for any other handler, so it answers any such body exceeding the buffer limit
+    with HTTP status 413 and closes the connection, as Sanic does for REQUEST_MAX_SIZE.
+    """
+
+    def body_init(self) -> None:
+        """
+        Initialize body buffer and its size.
+        """
+
+        super().body_init()
+        self._body_size = 0
+
+    def body_push(self, data: bytes) -> None:
+        """
+        Buffer body data of request for non-streaming handler, up to configured limit.
+
+        :param data: body data
+        """
+
+        if self._body_size < 0:  # already refused
+            return
+
+        self._body_size += len(data)
+        if self._body_size > getattr(self.app.config, 'REQUEST_BUFFER_MAX_SIZE', self.app.config.REQUEST_MAX_SIZE):
+            self._body_size = -1
+            self.body = []
+            self.transport.get_protocol().write_error(PayloadTooLarge('Payload Too Large'))
+            return
+
+        super().body_push(data)
@@ -0,0 +1,396 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import json
+import logging
+import re
+
+from hashlib import sha256
+from os import listdir, makedirs, unlink
+from os.path import getmtime, getsize, isfile, join
+from time import time
+from uuid import uuid4
+
+from base58 import b58encode
+from sanic.request import Request
+
+from app.locks import FileLock
+
+
+LOGGER = logging.getLogger(__name__)
+
+RE_CONTENT_RANGE = re.compile(r'^bytes ([0-9]+)-([0-9]+)/([0-9]+)$')
+
+
+class BadRange(Exception):
+    """
+    Byte range does not fit upload session.
+    """
+
+
+class SessionsFull(Exception):
+    """
+    Upload sessions in staging are at configured capacity.
+    """
+
+
+class UploadSession:
+    """
+    Resumable upload of a tails file in byte ranges, persisting in a staging directory across requests
+    (and server restarts). The session identifier is a random token that the server reveals only to
+    the issuer opening (or resuming) the session, which authorizes puts and finalization; an issuer
+    resumes an interrupted upload by opening a session for the same rev reg id and tails hash again.
+
+    Once complete, a session presents the same interface as a multipart spool for vetting and posting.
+    """
+
+    def __init__(self, dir_sessions: str, sid: str, rr_id: str, tails_hash: str, size: int) -> None:
+        """
+        Initialize session on its staging directory, identifier, rev reg id, tails hash, and size.
+
+        :param dir_sessions: staging directory for upload sessions
+        :param sid: session identifier
+        :param rr_id: rev reg id
+        :param tails_hash: tails hash that issuer cites
+        :param size: tails file size in bytes
+        """
+
+        self._id = sid
+        self._path = join(dir_sessions, '{}.part'.format(self._id))
+        self._path_meta = join(dir_sessions, '{}.json'.format(self._id))
+        self._rr_id = rr_id
+        self._tails_hash = tails_hash
+        self._size = size
+        self._digest = None
+        self._fields = {}
+
+    @staticmethod
+    def open(
+            dir_sessions: str,
+            rr_id: str,
+            tails_hash: str,
+            size: int,
+            max_count: int = 0,
+            max_bytes: int = 0) -> 'UploadSession':
+        """
+        Create upload session with new identifier, or resume any existing session for the same rev reg id,
+        tails hash, and size. Raise SessionsFull if a new session would exceed the maximum number
+        of sessions in staging, or the maximum total size of their tails files.
+
+        :param dir_sessions: staging directory for upload sessions
+        :param rr_id: rev reg id
+        :param tails_hash: tails hash that issuer cites
+        :param size: tails file size in bytes
+        :param max_count: maximum number of sessions in staging (0 for no limit)
+        :param max_bytes: maximum total tails file size of sessions in staging, in bytes (0 for no limit)
+        :return: upload session
+        """
+
+        makedirs(dir_sessions, exist_ok=True)
+        sessions = UploadSession.sessions(dir_sessions)
+        rv = next((s for s in sessions if s.rr_id == rr_id and s.filename == tails_hash), None)
+        if rv and rv.size == size:
+            return rv
+        if rv:
+            rv.discard()  # issuer cites different size: start over
+            sessions.remove(rv)
+
+        if (max_count and len(sessions) >= max_count) or (
+                max_bytes and sum(s.size for s in sessions) + size > max_bytes):
+            LOGGER.warning(
+                'Upload sessions at capacity (%s sessions, %s bytes): refusing session for %s',
+                len(sessions),
+                sum(s.size for s in sessions),
+                rr_id)
+            raise SessionsFull('Upload sessions at capacity ({} sessions)'.format(len(sessions)))
+
+        rv = UploadSession(dir_sessions, uuid4().hex, rr_id, tails_hash, size)
+        with open(rv._path, 'wb'):
+            pass
+        with open(rv._path_meta, 'w') as fh_meta:
+            json.dump({'rr_id': rr_id, 'tails_hash': tails_hash, 'size': size}, fh_meta)
+
+        LOGGER.info('Opened upload session for %s bytes of tails file %s on %s', size, tails_hash, rr_id)
+        return rv
+
+    @staticmethod
+    def sessions(dir_sessions: str) -> list:
+        """
+        Return upload sessions in staging.
+
+        :param dir_sessions: staging directory for upload sessions
+        :return: list of upload sessions
+        """
+
+        rv = []
+        for name in _listdir(dir_sessions):
+            if name.endswith('.json'):
+                session = UploadSession.get(dir_sessions, name[:-len('.json')])
+                if session:
+                    rv.append(session)
+
+        return rv
+
+    @staticmethod
+    def get(dir_sessions: str, sid: str) -> 'UploadSession':
+        """
+        Return existing upload session by identifier, or None for no such session.
+
+        :param dir_sessions: staging directory for upload sessions
+        :param sid: session identifier
+        :return: upload session, or None
+        """
+
+        path_meta = join(dir_sessions, '{}.json'.format(sid))
+        if not (isfile(path_meta) and isfile(join(dir_sessions, '{}.part'.format(sid)))):
+            return None
+
+        with open(path_meta, 'r') as fh_meta:
+            meta = json.load(fh_meta)
+        return UploadSession(dir_sessions, sid, meta['rr_id'], meta['tails_hash'], int(meta['size']))
+
+    @staticmethod
+    def expire(dir_sessions: str, ttl: int) -> None:
+        """
+        Remove upload sessions idle for longer than input time to live.
+
+        :param dir_sessions: staging directory for upload sessions
+        :param ttl: time to live, in seconds
+        """
+
+        horizon = time() - ttl
+        for name in _listdir(dir_sessions):
+            path = join(dir_sessions, name)
+            if name.endswith('.part') and isfile(path) and getmtime(path) < horizon:
+                session = UploadSession.get(dir_sessions, name[:-len('.part')])
+                if session:
+                    LOGGER.info('Expiring idle upload session for %s', session.rr_id)
+                    session.discard()
+                else:
+                    unlink(path)
+
+    @property
+    def id(self) -> str:
+        """
+        Accessor for session identifier.
+
+        :return: session identifier
+        """
+
+        return self._id
+
+    @property
+    def rr_id(self) -> str:
+        """
+        Accessor for rev reg id.
+
+        :return: rev reg id
+        """
+
+        return self._rr_id
+
+    @property
+    def filename(self) -> str:
+        """
+        Accessor for tails hash that issuer cites, as file name of upload (in keeping with multipart spool).
+
+        :return: tails hash that issuer cites
+        """
+
+        return self._tails_hash
+
+    @property
+    def path(self) -> str:
+        """
+        Accessor for path to staging file, None once discarded or claimed.
+
+        :return: path to staging file
+        """
+
+        return self._path
+
+    @property
+    def size(self) -> int:
+        """
+        Accessor for tails file size that issuer cites.
+
+        :return: tails file size in bytes
+        """
+
+        return self._size
+
+    @property
+    def offset(self) -> int:
+        """
+        Accessor for committed offset: content bytes in staging so far.
+
+        :return: committed offset
+        """
+
+        return getsize(self._path) if self._path and isfile(self._path) else 0
+
+    @property
+    def complete(self) -> bool:
+        """
+        Accessor for whether staging file has all content.
+
+        :return: whether upload is complete
+        """
+
+        return self.offset == self._size
+
+    @property
+    def digest(self) -> bytes:
+        """
+        Accessor for SHA-256 digest of content, once hashed.
+
+        :return: digest bytes
+        """
+
+        return self._digest
+
+    @property
+    def tails_hash(self) -> str:
+        """
+        Accessor for tails hash (base58-encoded SHA-256 digest) of content, once hashed.
+
+        :return: tails hash
+        """
+
+        return b58encode(self._digest).decode() if self._digest else None
+
+    @property
+    def fields(self) -> dict:
+        """
+        Accessor for upload fields (signature and protocol version) for posting, in keeping with multipart spool.
+
+        :return: dict mapping field names to content bytes
+        """
+
+        return self._fields
+
+    def state(self) -> dict:
+        """
+        Return session state for client.
+
+        :return: dict with session identifier, rev reg id, tails hash, size, and committed offset
+        """
+
+        return {
+            'id': self._id,
+            'rr_id': self._rr_id,
+            'tails_hash': self._tails_hash,
+            'size': self._size,
+            'offset': self.offset
+        }
+
+    def lock(self) -> FileLock:
+        """
+        Return lock on session for a request in progress, excluding other requests on the session
+        in any server worker process. The lock is on the session metadata file, so it fails once
+        the session is gone.
+
+        :return: file lock on session, not yet acquired
+        """
+
+        return FileLock(self._path_meta, create=False)
+
+    async def write(self, request: Request, content_range: str) -> int:
+        """
+        Append streaming request body to staging file as per content range header. Raise BadRange if range
+        does not start at committed offset or does not fit within size. Keep whatever content arrives,
+        even if connection drops short of range end, so that issuer can resume from committed offset.
+
+        :param request: Sanic request, on route accepting streaming content
+        :param content_range: content-range header value, 'bytes <first>-<last>/<size>'
+        :return: committed offset after write
+        """
+
+        match = RE_CONTENT_RANGE.match(content_range or '')
+        if not match:
+            raise BadRange('Bad content range {}'.format(content_range))
+        (first, last, size) = (int(g) for g in match.groups())
+        if size != self._size or last < first or last >= size:
+            raise BadRange('Content range {} does not fit session size {}'.format(content_range, self._size))
+        if first != self.offset:
+            raise BadRange('Content range {} does not start at committed offset {}'.format(content_range, self.offset))
+
+        loop = asyncio.get_event_loop()
+        remaining = last - first + 1
+        with open(self._path, 'ab') as fh_part:
+            while True:
+                chunk = await request.stream.read()
+                if chunk is None:
+                    break
+                if len(chunk) > remaining:
+                    raise BadRange('Content exceeds range {}'.format(content_range))
+                await loop.run_in_executor(None, fh_part.write, chunk)
+                remaining -= len(chunk)
+
+        return self.offset
+
+    async def hash(self) -> None:
+        """
+        Hash staging file content, in the event loop's default executor.
+        """
+
+        def _hash(path: str) -> bytes:
+            rv = sha256()
+            with open(path, 'rb') as fh_part:
+                for chunk in iter(lambda: fh_part.read(65536), b''):
+                    rv.update(chunk)
+            return rv.digest()
+
+        self._digest = await asyncio.get_event_loop().run_in_executor(None, _hash, self._path)
+
+    def claim(self) -> str:
+        """
+        Release staging file to caller, which becomes responsible for it, and remove session metadata.
+
+        :return: path to staging file
+        """
+
+        rv = self._path
+        self._path = None
+        if isfile(self._path_meta):
+            unlink(self._path_meta)
+        return rv
+
+    def discard(self) -> None:
+        """
+        Remove session staging file and metadata if still present.
+        """
+
+        for path in (self._path, self._path_meta):
+            if path and isfile(path):
+                unlink(path)
+        self._path = None
+
+
+def _listdir(path: str) -> list:
+    """
+    Return directory listing, empty for absent directory.
+
+    :param path: directory
+    :return: names in directory
+    """
+
+    try:
+        return listdir(path)
+    except FileNotFoundError:
+        return []
@@ -0,0 +1,489 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import logging
+import zlib
+
+from hashlib import sha256
+from os import fdopen, makedirs, unlink
+from os.path import isfile
+from tempfile import mkstemp
+
+from base58 import b58encode
+from sanic.headers import parse_content_header
+from sanic.request import Request
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd-encoded uploads unavailable
+
+
+LOGGER = logging.getLogger(__name__)
+
+MAX_FIELD_SIZE = 65536  # cap on in-memory (non-spooled) multipart part content
+MAX_HEADER_SIZE = 16384  # cap on headers per multipart part
+DECODE_CHUNK = 1048576  # cap on decoded output per decompression step
+
+
+class BadUpload(Exception):
+    """
+    Upload body is not well-formed multipart/form-data.
+    """
+
+
+class OversizeUpload(Exception):
+    """
+    Upload body exceeds configured size limit.
+    """
+
+
+class _GzipDecoder:
+    """
+    Streaming gzip decoder, passing decoded content to a sink in bounded steps.
+    """
+
+    def __init__(self, sink) -> None:
+        """
+        Initialize decoder.
+
+        :param sink: function taking decoded content
+        """
+
+        self._zobj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._sink = sink
+
+    def write(self, data: bytes) -> None:
+        """
+        Decode next chunk of encoded content. Raise BadUpload on corrupt content.
+
+        :param data: encoded content
+        """
+
+        try:
+            out = self._zobj.decompress(data, DECODE_CHUNK)
+            self._sink(out)
+            while self._zobj.unconsumed_tail or len(out) == DECODE_CHUNK:
+                out = self._zobj.decompress(self._zobj.unconsumed_tail, DECODE_CHUNK)
+                self._sink(out)
+        except zlib.error as x_zlib:
+            raise BadUpload('Corrupt gzip content: {}'.format(x_zlib))
+
+    def close(self) -> None:
+        """
+        Finish decoding. Raise BadUpload on truncated content.
+        """
+
+        self._sink(self._zobj.flush())
+        if not self._zobj.eof or self._zobj.unused_data:
+            raise BadUpload('Truncated or trailing gzip content')
+
+
+class _SinkWriter:
+    """
+    File-like adapter passing written content to a sink.
+    """
+
+    def __init__(self, sink) -> None:
+        """
+        Initialize adapter.
+
+        :param sink: function taking content
+        """
+
+        self._sink = sink
+
+    def write(self, data: bytes) -> int:
+        """
+        Pass content to sink.
+
+        :param data: content
+        :return: number of bytes written
+        """
+
+        self._sink(data)
+        return len(data)
+
+
+class _ZstdDecoder:
+    """
+    Streaming zstd decoder, passing decoded content to a sink in bounded steps.
+    """
+
+    def __init__(self, sink) -> None:
+        """
+        Initialize decoder.
+
+        :param sink: function taking decoded content
+        """
+
+        self._writer = zstandard.ZstdDecompressor().stream_writer(_SinkWriter(sink), write_size=DECODE_CHUNK)
+
+    def write(self, data: bytes) -> None:
+        """
+        Decode next chunk of encoded content. Raise BadUpload on corrupt content.
+
+        :param data: encoded content
+        """
+
+        try:
+            self._writer.write(data)
+        except zstandard.ZstdError as x_zstd:
+            raise BadUpload('Corrupt zstd content: {}'.format(x_zstd))
+
+    def close(self) -> None:
+        """
+        Finish decoding; the tails hash check catches any truncation.
+        """
+
+
+DECODERS = {
+    'gzip': _GzipDecoder,
+    'zstd': _ZstdDecoder
+}
+
+
+class MultipartSpool:
+    """
+    Incremental multipart/form-data parser spooling one named part to a staging file as it arrives,
+    hashing its content en route, and retaining other (small) parts in memory.
+
+    The spooled part may carry a 'Content-Encoding' header of 'gzip' or (if the zstandard package is present)
+    'zstd', in which case the parser decodes its content as it arrives: the staging file, size limit, and
+    digest apply to decoded content.
+    """
+
+    _PREAMBLE = 0
+    _HEADERS = 1
+    _BODY = 2
+    _DONE = 3
+
+    def __init__(self, boundary: str, dir_staging: str, spool_name: str, max_size: int) -> None:
+        """
+        Initialize parser and open staging file.
+
+        :param boundary: multipart boundary from content-type header
+        :param dir_staging: directory for staging files
+        :param spool_name: name of multipart part to spool to staging file
+        :param max_size: maximum size in bytes of spooled part content
+        """
+
+        self._delimiter = b'--' + boundary.encode()
+        self._spool_name = spool_name
+        self._max_size = max_size
+
+        self._buffer = bytearray()
+        self._state = MultipartSpool._PREAMBLE
+        self._part_name = None
+        self._part_field = None
+
+        self._filename = None
+        self._decoder = None
+        self._size = 0
+        self._sha256 = sha256()
+        self._fields = {}
+
+        makedirs(dir_staging, exist_ok=True)
+        (fd, self._path) = mkstemp(dir=dir_staging, suffix='.part')
+        self._fh = fdopen(fd, 'wb')
+
+    @property
+    def path(self) -> str:
+        """
+        Accessor for path to staging file, None once discarded or claimed.
+
+        :return: path to staging file
+        """
+
+        return self._path
+
+    @property
+    def filename(self) -> str:
+        """
+        Accessor for multipart file name of spooled part.
+
+        :return: file name of spooled part
+        """
+
+        return self._filename
+
+    @property
+    def size(self) -> int:
+        """
+        Accessor for size in bytes of spooled part content.
+
+        :return: size of spooled part content
+        """
+
+        return self._size
+
+    @property
+    def digest(self) -> bytes:
+        """
+        Accessor for SHA-256 digest of spooled part content so far.
+
+        :return: digest bytes
+        """
+
+        return self._sha256.digest()
+
+    @property
+    def tails_hash(self) -> str:
+        """
+        Accessor for tails hash (base58-encoded SHA-256 digest) of spooled part content so far.
+
+        :return: tails hash
+        """
+
+        return b58encode(self._sha256.digest()).decode()
+
+    @property
+    def fields(self) -> dict:
+        """
+        Accessor for content of non-spooled parts by name.
+
+        :return: dict mapping part names to content bytes
+        """
+
+        return self._fields
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Parse next chunk of request body. Raise BadUpload for malformed content or OversizeUpload
+        when spooled content exceeds its limit.
+
+        :param chunk: request body chunk
+        """
+
+        if self._state == MultipartSpool._DONE:
+            return  # ignore epilogue
+
+        self._buffer.extend(chunk)
+        while self._step():
+            pass
+
+    def close(self) -> None:
+        """
+        Finish parsing and close staging file. Raise BadUpload if body ends before closing boundary
+        or never presents part to spool.
+        """
+
+        try:
+            if self._state != MultipartSpool._DONE:
+                raise BadUpload('Multipart body ends before closing boundary')
+            if self._filename is None:
+                raise BadUpload('Multipart body has no {} part'.format(self._spool_name))
+            if self._decoder:
+                self._decoder.close()
+        finally:
+            self._fh.close()
+
+    def claim(self) -> str:
+        """
+        Release staging file to caller, which becomes responsible for it.
+
+        :return: path to staging file
+        """
+
+        rv = self._path
+        self._path = None
+        return rv
+
+    def discard(self) -> None:
+        """
+        Close and remove staging file if still present.
+        """
+
+        if not self._fh.closed:
+            self._fh.close()
+        if self._path and isfile(self._path):
+            unlink(self._path)
+        self._path = None
+
+    def _step(self) -> bool:
+        """
+        Advance parser state as far as buffered content allows.
+
+        :return: whether to call again on current buffer
+        """
+
+        if self._state == MultipartSpool._PREAMBLE:
+            idx = self._buffer.find(self._delimiter)
+            if idx < 0:
+                del self._buffer[:max(0, len(self._buffer) - len(self._delimiter))]
+                return False
+            del self._buffer[:idx]
+            return self._after_delimiter(len(self._delimiter))
+
+        if self._state == MultipartSpool._HEADERS:
+            idx = self._buffer.find(b'\r\n\r\n')
+            if idx < 0:
+                if len(self._buffer) > MAX_HEADER_SIZE:
+                    raise BadUpload('Multipart part headers exceed {} bytes'.format(MAX_HEADER_SIZE))
+                return False
+            self._start_part(bytes(self._buffer[:idx]).decode('latin-1'))
+            del self._buffer[:idx + 4]
+            self._state = MultipartSpool._BODY
+            return True
+
+        if self._state == MultipartSpool._BODY:
+            marker = b'\r\n' + self._delimiter
+            idx = self._buffer.find(marker)
+            if idx < 0:
+                keep = len(marker) - 1  # marker may straddle chunks
+                if len(self._buffer) > keep:
+                    self._emit(bytes(self._buffer[:-keep]))
+                    del self._buffer[:-keep]
+                return False
+            self._emit(bytes(self._buffer[:idx]))
+            del self._buffer[:idx]
+            return self._after_delimiter(len(marker))
+
+        return False
+
+    def _after_delimiter(self, end: int) -> bool:
+        """
+        Handle boundary delimiter ending at input offset in buffer: start next part or finish.
+
+        :param end: buffer offset just past delimiter
+        :return: whether to continue parsing current buffer
+        """
+
+        if len(self._buffer) < end + 2:
+            return False  # need more content to tell next part from closing boundary
+
+        tail = bytes(self._buffer[end:end + 2])
+        if tail == b'--':
+            del self._buffer[:]
+            self._state = MultipartSpool._DONE
+            return False
+        if tail != b'\r\n':
+            raise BadUpload('Multipart boundary delimiter has bad trailer')
+
+        del self._buffer[:end + 2]
+        self._state = MultipartSpool._HEADERS
+        return True
+
+    def _start_part(self, headers: str) -> None:
+        """
+        Set up state for new part from its headers.
+
+        :param headers: header block of new part
+        """
+
+        self._part_name = None
+        filename = None
+        encoding = 'identity'
+        for line in headers.split('\r\n'):
+            (key, _, value) = line.partition(':')
+            if key.strip().lower() == 'content-disposition':
+                (_, options) = parse_content_header(value.strip())
+                self._part_name = options.get('name', None)
+                filename = options.get('filename', None)
+            elif key.strip().lower() == 'content-encoding':
+                encoding = value.strip().lower()
+
+        if not self._part_name:
+            raise BadUpload('Multipart part has no name')
+
+        if self._part_name == self._spool_name:
+            if self._filename is not None:
+                raise BadUpload('Multipart body has more than one {} part'.format(self._spool_name))
+            self._filename = filename or ''
+            self._part_field = None
+            if encoding in DECODERS and (encoding != 'zstd' or zstandard):
+                self._decoder = DECODERS[encoding](self._write)
+            elif encoding != 'identity':
+                raise BadUpload('Multipart part {} has unsupported content encoding {}'.format(
+                    self._spool_name,
+                    encoding))
+        else:
+            self._part_field = bytearray()
+            self._fields[self._part_name] = self._part_field
+
+    def _emit(self, data: bytes) -> None:
+        """
+        Direct part content to staging file or in-memory field.
+
+        :param data: part content
+        """
+
+        if not data:
+            return
+
+        if self._part_field is None:
+            if self._decoder:
+                self._decoder.write(data)
+            else:
+                self._write(data)
+        else:
+            if len(self._part_field) + len(data) > MAX_FIELD_SIZE:
+                raise BadUpload('Multipart part {} exceeds {} bytes'.format(self._part_name, MAX_FIELD_SIZE))
+            self._part_field.extend(data)
+
+    def _write(self, data: bytes) -> None:
+        """
+        Hash and write (decoded) spooled part content to staging file.
+
+        :param data: spooled part content
+        """
+
+        if not data:
+            return
+
+        self._size += len(data)
+        if self._size > self._max_size:
+            raise OversizeUpload('Upload exceeds maximum size of {} bytes'.format(self._max_size))
+        self._sha256.update(data)
+        self._fh.write(data)
+
+
+async def spool_upload(request: Request, dir_staging: str, spool_name: str, max_size: int) -> MultipartSpool:
+    """
+    Read streaming multipart/form-data request body, spooling named part to staging file.
+    Raise BadUpload for non-multipart or malformed content, OversizeUpload for content exceeding limit;
+    the operation removes the staging file on any such failure.
+
+    Parsing, hashing, and writing each chunk run in the event loop's default executor, so that
+    spooling large uploads does not hold up other requests.
+
+    :param request: Sanic request, on route accepting streaming content
+    :param dir_staging: directory for staging files
+    :param spool_name: name of multipart part to spool to staging file
+    :param max_size: maximum size in bytes of spooled part content
+    :return: closed spool, with staging file content and other parts
+    """
+
+    (content_type, options) = parse_content_header(request.headers.get('content-type', ''))
+    if content_type != 'multipart/form-data' or not options.get('boundary', None):
+        raise BadUpload('Upload content type {} is not multipart/form-data with boundary'.format(content_type))
+
+    loop = asyncio.get_event_loop()
+    rv = MultipartSpool(options['boundary'], dir_staging, spool_name, max_size)
+    try:
+        while True:
+            chunk = await request.stream.read()
+            if chunk is None:
+                break
+            await loop.run_in_executor(None, rv.feed, chunk)
+        rv.close()
+    except Exception:
+        rv.discard()
+        raise
+
+    return rv
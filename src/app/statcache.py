@@ -0,0 +1,248 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import logging
+
+from collections import OrderedDict
+from os import fstat, stat, stat_result
+from os.path import basename
+from time import monotonic
+
+from von_anchor.tails import Tails
+from von_anchor.util import rev_reg_id2cred_def_id
+
+from app.cfg import config_number
+from app.variants import SUFFIXES, variant_path
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StatCache:
+    """
+    Bounded cache of tails file metadata and open file handles by rev reg id, from link resolution and
+    file status, so that hot downloads and metadata requests need not touch the file system. The cache evicts
+    least recently used entries beyond a maximum number of entries or a maximum total size of files held open.
+    Uploads and deletions invalidate entries; beyond a time to live, a hit revalidates its entry against
+    the link and the inode and modification time of the tails file and of each variant, present or absent,
+    replacing the entry on any change. Hence a server picks up variants and tails files that another process
+    writes, as for a read-only mirror, within the time to live.
+
+    Each entry counts references to its file handles: the cache holds one, and each response streaming from
+    them holds one (via acquire and release). The handles close as soon as the entry leaves the cache
+    and the last response streaming from them lets go.
+    """
+
+    def __init__(
+            self,
+            dir_tails: str,
+            max_entries: int = 256,
+            max_bytes: int = 1024 * 1024 * 1024,
+            ttl: float = 5) -> None:
+        """
+        Initialize cache on tails directory.
+
+        :param dir_tails: tails directory
+        :param max_entries: maximum number of entries, beyond which to evict least recently used
+        :param max_bytes: maximum total size of files held open, beyond which to evict least recently used
+        :param ttl: time to live in seconds, beyond which a hit revalidates its entry against the file system
+        """
+
+        self._dir_tails = dir_tails
+        self._max_entries = max(1, max_entries)
+        self._max_bytes = max(0, max_bytes)
+        self._ttl = max(0, ttl)
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    @staticmethod
+    def from_config(config: dict, dir_tails: str) -> 'StatCache':
+        """
+        Return cache as per [Tails Server] configuration section: file.cache.entries (default 256),
+        file.cache.mb (default 1024), file.cache.ttl.sec (default 5).
+
+        :param config: configuration dict
+        :param dir_tails: tails directory
+        :return: cache
+        """
+
+        cfg = config.get('Tails Server', {})
+        return StatCache(
+            dir_tails,
+            config_number(cfg, 'file.cache.entries', 256),
+            config_number(cfg, 'file.cache.mb', 1024) * 1024 * 1024,
+            config_number(cfg, 'file.cache.ttl.sec', 5, float))
+
+    def get(self, rr_id: str) -> dict:
+        """
+        Return metadata for tails file associated with rev reg id, or None if there is none. Use its file handles
+        only via acquire and release, since they close once the entry leaves the cache.
+
+        :param rr_id: rev reg id
+        :return: dict with rev reg id, cred def id, issuer DID, tails hash, path, size in bytes,
+            modification time as EPOCH time, sizes in bytes of precompressed variants by content encoding,
+            and open binary file handles on tails file (fh) and on variants by content encoding (fh_variants)
+        """
+
+        rv = self._entries.get(rr_id, None)
+        if rv:
+            if monotonic() - rv['checked'] < self._ttl or self._current(rv):
+                self._entries.move_to_end(rr_id)
+                return rv
+            LOGGER.info('Tails file or variants for rev reg id %s changed since cached: reloading', rr_id)
+            self.invalidate(rr_id)
+
+        path_tails = Tails.linked(self._dir_tails, rr_id)
+        if not path_tails:
+            return None
+        try:
+            fh_tails = open(path_tails, 'rb')
+        except FileNotFoundError:  # dangling link
+            return None
+        stat_tails = fstat(fh_tails.fileno())
+
+        fh_variants = {}
+        for encoding in SUFFIXES:
+            try:
+                fh_variants[encoding] = open(variant_path(path_tails, encoding), 'rb')
+            except FileNotFoundError:
+                pass
+        stat_variants = {encoding: fstat(fh.fileno()) for (encoding, fh) in fh_variants.items()}
+
+        rv = {
+            'rr_id': rr_id,
+            'cd_id': rev_reg_id2cred_def_id(rr_id),
+            'issuer_did': rr_id.split(':')[0],
+            'tails_hash': basename(path_tails),
+            'path': path_tails,
+            'size': stat_tails.st_size,
+            'mtime': stat_tails.st_mtime,
+            'variants': {encoding: stat_var.st_size for (encoding, stat_var) in stat_variants.items()},
+            'fh': fh_tails,
+            'fh_variants': fh_variants,
+            'ident': StatCache._ident(stat_tails, stat_variants),
+            'checked': monotonic(),
+            'refs': 1  # cache's own
+        }
+        self._entries[rr_id] = rv
+        self._bytes += StatCache._held(rv)
+        while len(self._entries) > 1 and (len(self._entries) > self._max_entries or self._bytes > self._max_bytes):
+            (_, evicted) = self._entries.popitem(last=False)
+            self._bytes -= StatCache._held(evicted)
+            StatCache.release(evicted)
+
+        return rv
+
+    def acquire(self, rr_id: str) -> dict:
+        """
+        Return metadata for tails file associated with rev reg id as per get(), holding a reference to
+        its file handles until the caller releases it; return None if there is no such tails file.
+
+        :param rr_id: rev reg id
+        :return: cache entry, or None
+        """
+
+        rv = self.get(rr_id)
+        if rv:
+            rv['refs'] += 1
+
+        return rv
+
+    @staticmethod
+    def release(entry: dict) -> None:
+        """
+        Release a reference to cache entry's file handles, closing them on releasing the last.
+
+        :param entry: cache entry
+        """
+
+        entry['refs'] -= 1
+        if entry['refs'] == 0:
+            for fh in (entry['fh'], *entry['fh_variants'].values()):
+                fh.close()
+
+    def invalidate(self, rr_id: str = None) -> None:
+        """
+        Invalidate entry for rev reg id, or all entries.
+
+        :param rr_id: rev reg id, or None for all
+        """
+
+        if rr_id:
+            evicted = self._entries.pop(rr_id, None)
+            if evicted:
+                self._bytes -= StatCache._held(evicted)
+                StatCache.release(evicted)
+        else:
+            (evicted, self._entries) = (self._entries, OrderedDict())
+            self._bytes = 0
+            for entry in evicted.values():
+                StatCache.release(entry)
+
+    def _current(self, entry: dict) -> bool:
+        """
+        Return whether cache entry is current: its link still resolves to its tails file, and the tails file
+        and its variants present have the same inodes and modification times, with no variants since added
+        or removed. Mark entry as checked now if so.
+
+        :param entry: cache entry
+        :return: whether entry is current
+        """
+
+        try:
+            if Tails.linked(self._dir_tails, entry['rr_id']) != entry['path']:
+                return False
+            stat_tails = stat(entry['path'])
+            stat_variants = {}
+            for encoding in SUFFIXES:
+                try:
+                    stat_variants[encoding] = stat(variant_path(entry['path'], encoding))
+                except FileNotFoundError:
+                    pass
+        except OSError:
+            return False
+        if StatCache._ident(stat_tails, stat_variants) != entry['ident']:
+            return False
+
+        entry['checked'] = monotonic()
+        return True
+
+    @staticmethod
+    def _ident(stat_tails: stat_result, stat_variants: dict) -> tuple:
+        """
+        Return identity of tails file and its variants on the file system: inode and modification time
+        of tails file and of each variant, or None for each variant absent.
+
+        :param stat_tails: status of tails file
+        :param stat_variants: status of each variant present, by content encoding
+        :return: identity tuple
+        """
+
+        return tuple(
+            (st.st_ino, st.st_mtime_ns) if st else None
+            for st in (stat_tails, *(stat_variants.get(encoding, None) for encoding in SUFFIXES)))
+
+    @staticmethod
+    def _held(entry: dict) -> int:
+        """
+        Return total size of files that cache entry holds open.
+
+        :param entry: cache entry
+        :return: size in bytes
+        """
+
+        return entry['size'] + sum(entry['variants'].values())
@@ -0,0 +1,294 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import gzip
+import logging
+import sys
+
+from os import O_RDONLY, close, fsync, open as os_open, rename, stat, unlink
+from os.path import dirname, isdir, isfile, join, realpath
+from tempfile import mkstemp
+
+from von_anchor.tails import Tails
+
+from app.cfg import config_number
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd variants unavailable
+
+
+LOGGER = logging.getLogger(__name__)
+
+SUFFIXES = {  # file name suffix per content encoding, in order of preference on equal size
+    'zstd': '.zst',
+    'gzip': '.gz'
+}
+COPY_CHUNK = 1024 * 1024  # bytes per read when compressing
+
+
+def variant_path(path_tails: str, encoding: str) -> str:
+    """
+    Return path to variant of tails file in input content encoding, next to tails file.
+
+    :param path_tails: path to tails file
+    :param encoding: content encoding, 'gzip' or 'zstd'
+    :return: path to variant
+    """
+
+    return '{}{}'.format(path_tails, SUFFIXES[encoding])
+
+
+def accepted(header: str) -> dict:
+    """
+    Parse Accept-Encoding header as per RFC 7231 into quality values by content coding, lower case.
+
+    :param header: accept-encoding header value, or None if absent
+    :return: dict mapping content coding (or '*') to quality value
+    """
+
+    rv = {}
+    for token in (header or '').split(','):
+        (coding, *params) = [part.strip() for part in token.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            (name, _, value) = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        rv[coding.lower()] = q
+
+    return rv
+
+
+def _compress(path_tails: str, encoding: str, level: int, max_ratio: float) -> int:
+    """
+    Write variant of tails file in input content encoding via temporary file in same directory, then flush
+    and rename it into place. Discard the variant if it does not shrink content to at most the input ratio.
+
+    :param path_tails: path to tails file
+    :param encoding: content encoding, 'gzip' or 'zstd'
+    :param level: compression level, or 0 for encoder default
+    :param max_ratio: maximum ratio of variant size to tails file size, beyond which to discard variant
+    :return: variant size in bytes, or None if discarded
+    """
+
+    (fd, path_tmp) = mkstemp(dir=dirname(path_tails), prefix='.', suffix='{}.part'.format(SUFFIXES[encoding]))
+    try:
+        with open(path_tails, 'rb') as fh_tails, open(fd, 'wb') as fh_var:
+            if encoding == 'gzip':
+                with gzip.GzipFile(fileobj=fh_var, mode='wb', compresslevel=level or 9, mtime=0) as gz:
+                    for chunk in iter(lambda: fh_tails.read(COPY_CHUNK), b''):
+                        gz.write(chunk)
+            else:
+                cctx = zstandard.ZstdCompressor(level=level or 3)
+                cctx.copy_stream(fh_tails, fh_var, read_size=COPY_CHUNK, write_size=COPY_CHUNK)
+            fh_var.flush()
+            fsync(fh_var.fileno())
+            size = fh_var.tell()
+
+        if size > max_ratio * stat(path_tails).st_size:
+            unlink(path_tmp)
+            return None
+
+        rename(path_tmp, variant_path(path_tails, encoding))
+        dir_fd = os_open(dirname(path_tails), O_RDONLY)
+        try:
+            fsync(dir_fd)
+        finally:
+            close(dir_fd)
+    except BaseException:
+        if isfile(path_tmp):
+            unlink(path_tmp)
+        raise
+
+    return size
+
+
+class Variants:
+    """
+    Precompressed variants of tails files, next to each tails file in the tails tree. Tails files are immutable
+    once linked, so the server compresses each one once, in the background after upload (or in batch over
+    an existing tree), and serves the variant that a download request's Accept-Encoding header admits.
+    """
+
+    def __init__(self, encodings: list, level: int = 0, max_ratio: float = 0.9) -> None:
+        """
+        Initialize variants.
+
+        :param encodings: content encodings for which to produce variants; zstd requires zstandard package
+        :param level: compression level, or 0 for encoder default
+        :param max_ratio: maximum ratio of variant size to tails file size, beyond which to discard variant
+        """
+
+        self._encodings = [enc for enc in SUFFIXES if enc in encodings and (enc != 'zstd' or zstandard)]
+        if 'zstd' in encodings and not zstandard:
+            LOGGER.warning('Tails file variants in zstd require zstandard package: producing none')
+        self._level = max(0, level)
+        self._max_ratio = max_ratio
+        self._lock = None
+
+    @staticmethod
+    def from_config(config: dict) -> 'Variants':
+        """
+        Return variants as per [Tails Server] configuration section: variant.encodings (default gzip),
+        variant.level (default 0 for encoder default), variant.max.ratio.pct (default 90).
+
+        :param config: configuration dict
+        :return: variants
+        """
+
+        cfg = config.get('Tails Server', {})
+        return Variants(
+            [enc.strip().lower() for enc in cfg.get('variant.encodings', 'gzip').split(',') if enc.strip()],
+            config_number(cfg, 'variant.level', 0),
+            config_number(cfg, 'variant.max.ratio.pct', 90) / 100)
+
+    @property
+    def encodings(self) -> list:
+        """
+        Accessor for content encodings of variants to produce and serve.
+
+        :return: content encodings
+        """
+
+        return self._encodings
+
+    def negotiate(self, accept_encoding: str, sizes: dict) -> str:
+        """
+        Return content encoding of smallest variant present that Accept-Encoding header admits,
+        or None to serve tails file as is.
+
+        :param accept_encoding: accept-encoding header value, or None if absent
+        :param sizes: dict mapping content encoding to size in bytes, for each variant present
+        :return: content encoding, or None for identity
+        """
+
+        q = accepted(accept_encoding)
+        admitted = [enc for enc in self._encodings if enc in sizes and q.get(enc, q.get('*', 0)) > 0]
+
+        return min(admitted, key=lambda enc: sizes[enc]) if admitted else None
+
+    async def produce(self, path_tails: str) -> list:
+        """
+        Produce any variants missing for tails file, one tails file at a time, compressing in the default
+        executor. Log and skip any variant that fails.
+
+        :param path_tails: path to tails file
+        :return: content encodings of variants produced
+        """
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        rv = []
+        async with self._lock:
+            for encoding in self._encodings:
+                if isfile(variant_path(path_tails, encoding)):
+                    continue
+                try:
+                    size = await asyncio.get_event_loop().run_in_executor(
+                        None,
+                        _compress,
+                        path_tails,
+                        encoding,
+                        self._level,
+                        self._max_ratio)
+                except OSError as x_os:
+                    LOGGER.warning('Could not produce %s variant of tails file %s: %s', encoding, path_tails, x_os)
+                    continue
+                if size is None:
+                    LOGGER.info('Discarded %s variant of tails file %s: insufficient compression', encoding, path_tails)
+                else:
+                    LOGGER.info('Produced %s variant (%s bytes) of tails file %s', encoding, size, path_tails)
+                    rv.append(encoding)
+
+        return rv
+
+
+def remove_variants(path_tails: str) -> None:
+    """
+    Remove any variants of tails file.
+
+    :param path_tails: path to tails file
+    """
+
+    for encoding in SUFFIXES:
+        path_var = variant_path(path_tails, encoding)
+        if isfile(path_var):
+            unlink(path_var)
+            LOGGER.info('Deleted %s', path_var)
+
+
+async def produce_all(dir_tails: str, variants: Variants) -> int:
+    """
+    Produce any variants missing for all linked tails files in tails tree.
+
+    :param dir_tails: tails directory
+    :param variants: variants
+    :return: number of variants produced
+    """
+
+    rv = 0
+    for path_tails in sorted({realpath(link) for link in Tails.links(dir_tails)}):
+        if isfile(path_tails):
+            rv += len(await variants.produce(path_tails))
+
+    return rv
+
+
+def usage() -> None:
+    """
+    Print usage message.
+    """
+
+    print('\nUsage: variants.py <config-ini> [<dir-tails>]')
+    print()
+    print('where:')
+    print('    * <config-ini> represents the path to the tails server configuration file, and')
+    print('    * <dir-tails> represents the tails directory (default: tails directory of tails server).')
+    print()
+    print('The operation produces any missing variants of tails files, as per the variant.* entries')
+    print('in section [Tails Server] of the configuration file.')
+    print()
+
+
+if __name__ == '__main__':
+    from von_anchor.frill import do_wait, inis2dict
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)-15s | %(levelname)-8s | %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+
+    if len(sys.argv) not in (2, 3):
+        usage()
+    else:
+        DIR_TAILS = sys.argv[2] if len(sys.argv) == 3 else join(dirname(dirname(realpath(__file__))), 'tails')
+        if not isdir(DIR_TAILS):
+            print('No such tails directory: {}'.format(DIR_TAILS))
+        else:
+            LOGGER.info(
+                'Produced %s variants in %s',
+                do_wait(produce_all(DIR_TAILS, Variants.from_config(inis2dict(sys.argv[1])))),
+                DIR_TAILS)
@@ -0,0 +1,258 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import asyncio
+import json
+import logging
+
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from typing import Callable, Union
+
+from indy import crypto
+from indy.error import IndyError
+from von_anchor import NominalAnchor
+
+from app.cfg import config_number
+
+
+LOGGER = logging.getLogger(__name__)
+
+_WORKER_LOOP = None  # event loop for indy calls in worker process
+
+
+class VerifyBusy(Exception):
+    """
+    Verification queue is at capacity.
+    """
+
+
+def upload_v1_plain(epoch: int, path: str) -> str:
+    """
+    Return legacy (version 1) upload signature plaintext over epoch and entire tails file content.
+
+    :param epoch: EPOCH time from upload request
+    :param path: path to (staged) tails file
+    :return: plaintext that issuer signed
+    """
+
+    with open(path, 'rb') as fh_tails:
+        return '{}||{}'.format(epoch, fh_tails.read())
+
+
+def _noop() -> None:
+    """
+    Do nothing, in a worker process.
+    """
+
+
+def _verify(verkey: str, message: Union[bytes, str, Callable], signature: bytes) -> bool:
+    """
+    Verify signature in worker process.
+
+    :param verkey: signer verification key
+    :param message: signed content, or callable producing it
+    :param signature: signature
+    :return: whether signature is valid
+    """
+
+    global _WORKER_LOOP
+    if _WORKER_LOOP is None:
+        _WORKER_LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(_WORKER_LOOP)
+
+    if callable(message):
+        message = message()
+    try:
+        return _WORKER_LOOP.run_until_complete(crypto.crypto_verify(verkey, message, signature))
+    except IndyError:
+        return False
+
+
+class Verifier:
+    """
+    Dispatcher for signature verification, bounding the verifications in progress and keeping timing metrics.
+
+    Under the 'process' executor, verifications (including preparation of any legacy plaintext over an
+    entire tails file) run in a pool of worker processes; the event loop only resolves signer verification keys.
+    Under the 'anchor' executor, the tails server anchor verifies on the event loop, with legacy plaintext
+    preparation in a thread.
+    """
+
+    EXECUTORS = ('process', 'anchor')
+
+    def __init__(self, executor: str = 'process', workers: int = 2, queue_max: int = 32) -> None:
+        """
+        Initialize verifier. Start any worker processes now, before the caller opens any
+        indy-sdk resources that would not survive a fork.
+
+        :param executor: 'process' for worker process pool, 'anchor' for tails server anchor
+        :param workers: maximum concurrent verifications
+        :param queue_max: maximum verifications in progress or waiting, beyond which to reject
+        """
+
+        if executor not in Verifier.EXECUTORS:
+            raise ValueError('Verification executor {} not in {}'.format(executor, Verifier.EXECUTORS))
+
+        self._executor = executor
+        self._workers = max(1, workers)
+        self._queue_max = max(self._workers, queue_max)
+        self._slots = None  # create on first use, on the serving event loop
+        self._pending = 0
+        self._stats = {
+            'count': 0,
+            'failed': 0,
+            'rejected': 0,
+            'wait.sec': 0.0,
+            'verify.sec': 0.0,
+            'verify.max.sec': 0.0
+        }
+
+        self._pool = None
+        if self._executor == 'process':
+            self._pool = ProcessPoolExecutor(max_workers=self._workers)
+            self._pool.submit(_noop).result()  # fork workers while process is still clean
+
+    @staticmethod
+    def from_config(config: dict) -> 'Verifier':
+        """
+        Return verifier as per [Tails Server] configuration section: verify.executor (default process),
+        verify.workers (default 2), verify.queue.max (default 32).
+
+        :param config: configuration dict
+        :return: verifier
+        """
+
+        cfg = config.get('Tails Server', {})
+        return Verifier(
+            cfg.get('verify.executor', 'process') or 'process',
+            config_number(cfg, 'verify.workers', 2),
+            config_number(cfg, 'verify.queue.max', 32))
+
+    @property
+    def pending(self) -> int:
+        """
+        Accessor for number of verifications in progress or waiting.
+
+        :return: verifications pending
+        """
+
+        return self._pending
+
+    @property
+    def stats(self) -> dict:
+        """
+        Accessor for verification metrics: counts of verifications, failures, and rejections
+        (queue at capacity), with cumulative wait and verification times and maximum verification time.
+
+        :return: metrics dict
+        """
+
+        return dict(self._stats)
+
+    async def verify(
+            self,
+            tsan: NominalAnchor,
+            message: Union[bytes, str, Callable],
+            signature: bytes,
+            signer: str) -> bool:
+        """
+        Verify signature by signer DID. Raise VerifyBusy if queue is at capacity.
+
+        :param tsan: tails server anchor, for signer verification key lookup
+        :param message: signed content, or picklable callable producing it
+        :param signature: signature
+        :param signer: signer DID
+        :return: whether signature is valid
+        """
+
+        if self._pending >= self._queue_max:
+            self._stats['rejected'] += 1
+            LOGGER.warning('Verification queue at capacity (%s): rejecting verification for %s', self._pending, signer)
+            raise VerifyBusy('Verification queue at capacity ({})'.format(self._pending))
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._workers)
+
+        self._pending += 1
+        try:
+            start = time()
+            async with self._slots:
+                started = time()
+                rv = await self._dispatch(tsan, message, signature, signer)
+            done = time()
+        finally:
+            self._pending -= 1
+
+        self._stats['count'] += 1
+        self._stats['failed'] += 0 if rv else 1
+        self._stats['wait.sec'] += started - start
+        self._stats['verify.sec'] += done - started
+        self._stats['verify.max.sec'] = max(self._stats['verify.max.sec'], done - started)
+        LOGGER.info(
+            'Verified signature by %s (%s) in %.3f s after %.3f s queued',
+            signer,
+            'OK' if rv else 'failed',
+            done - started,
+            started - start)
+
+        return rv
+
+    async def _dispatch(
+            self,
+            tsan: NominalAnchor,
+            message: Union[bytes, str, Callable],
+            signature: bytes,
+            signer: str) -> bool:
+        """
+        Verify signature on configured executor.
+
+        :param tsan: tails server anchor
+        :param message: signed content, or picklable callable producing it
+        :param signature: signature
+        :param signer: signer DID
+        :return: whether signature is valid
+        """
+
+        if not signature:
+            return False
+
+        loop = asyncio.get_event_loop()
+        if self._executor == 'anchor':
+            if callable(message):
+                message = await loop.run_in_executor(None, message)
+            return await tsan.verify(message, signature, signer)
+
+        if signer == tsan.did:
+            verkey = tsan.verkey
+        else:
+            nym = json.loads(await tsan.get_nym(signer))
+            verkey = nym.get('verkey', None) if nym else None
+        if not verkey:
+            LOGGER.error('No verification key on ledger for signer %s', signer)
+            return False
+
+        return await loop.run_in_executor(self._pool, _verify, verkey, message, signature)
+
+    def close(self) -> None:
+        """
+        Shut down any worker processes.
+        """
+
+        if self._pool:
+            self._pool.shutdown(wait=False)
+            self._pool = None
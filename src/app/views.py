@@ -15,27 +15,46 @@ limitations under the License.
 """
 
 
+import asyncio
 import json
 import logging
 
+from functools import partial
+from mimetypes import guess_type
 from os import makedirs, unlink
 from os.path import basename, dirname, exists, isdir, isfile, islink, join, realpath
 from shutil import rmtree
 from time import time
+from typing import Awaitable, Callable, Union
+from urllib.parse import urlencode
+from uuid import uuid4
 
 from sanic import response
 from sanic.request import Request
-from sanic.response import HTTPResponse
+from sanic.response import HTTPResponse, StreamingHTTPResponse
 from von_anchor.error import AbsentRevReg
 from von_anchor.tails import Tails
-from von_anchor.util import ok_cred_def_id, ok_did, ok_rev_reg_id, rev_reg_id2cred_def_id
+from von_anchor.util import ok_cred_def_id, ok_did, ok_rev_reg_id
 
 from app import app
+from app.archive import tar_members, tar_segments, tar_size
 from app.cache import MEM_CACHE
+from app.catalog import StaleGeneration
+from app.conditional import etag, http_date, is_not_modified, is_range_current
+from app.jobs import JobsBusy
+from app.locks import FileLock
+from app.ranges import UnsatisfiableRange, parse_range
+from app.session import BadRange, SessionsFull, UploadSession
+from app.spool import BadUpload, MultipartSpool, OversizeUpload, spool_upload
+from app.variants import remove_variants, variant_path
+from app.verify import VerifyBusy, upload_v1_plain
 
 
 LOGGER = logging.getLogger(__name__)
 
+UPLOADS_IN_FLIGHT = {}  # rev reg id -> upload in this worker's processing: tails hash it cites, future for outcome
+LIST_PAGE_MAX = 10000  # maximum rev reg ids per page of listing, and per catalog read while streaming one
+
 
 async def is_current(epoch: int) -> bool:
     """
@@ -50,29 +69,265 @@ async def is_current(epoch: int) -> bool:
     return abs(epoch - int(time())) <= max_skew
 
 
+async def accepts_upload_v1() -> bool:
+    """
+    Return whether to accept legacy (version 1) upload signatures over entire tails file content,
+    as per configuration (default true).
+
+    :return: whether to accept version 1 upload signatures
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return cfg.get('Tails Server', {}).get('upload.v1.accept', '1').lower() in ['1', 'true', 'yes']
+
+
+async def is_upload_async() -> bool:
+    """
+    Return whether to process uploads asynchronously, responding with status 202 and a job identifier
+    once content is staged, as per configuration (default false).
+
+    :return: whether to process uploads asynchronously
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return cfg.get('Tails Server', {}).get('upload.async', '0').lower() in ['1', 'true', 'yes']
+
+
+async def is_read_only() -> bool:
+    """
+    Return whether server is a read-only mirror, serving downloads without node pool or wallet and
+    rejecting uploads and deletions, as per configuration (default false).
+
+    :return: whether server is a read-only mirror
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return cfg.get('Tails Server', {}).get('read.only', '0').lower() in ['1', 'true', 'yes']
+
+
+async def cache_max_age() -> int:
+    """
+    Return maximum age in seconds for caches to keep tails files, as per configuration (default 31536000).
+
+    :return: cache maximum age in seconds
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return max(0, int(cfg.get('Tails Server', {}).get('cache.max.age.sec', '31536000')))
+
+
+async def session_ttl() -> int:
+    """
+    Return time to live in seconds for idle upload sessions, as per configuration (default 86400).
+
+    :return: upload session time to live in seconds
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return max(0, int(cfg.get('Tails Server', {}).get('session.ttl.sec', '86400')))
+
+
+async def session_limits() -> tuple:
+    """
+    Return maximum number of upload sessions in staging and maximum total size in bytes of their tails files,
+    as per configuration (default 16 sessions, 1024 MiB).
+
+    :return: pair (maximum sessions, maximum total bytes)
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return (
+        max(1, int(cfg.get('Tails Server', {}).get('session.max.count', '16'))),
+        max(1, int(cfg.get('Tails Server', {}).get('session.max.mb', '1024'))) * 1024 * 1024)
+
+
+async def max_upload_size() -> int:
+    """
+    Return maximum size in bytes of tails file upload, as per configuration (default 256 MiB).
+
+    :return: maximum upload size in bytes
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return max(1, int(cfg.get('Tails Server', {}).get('max.upload.mb', '256'))) * 1024 * 1024
+
+
+async def archive_max_count() -> int:
+    """
+    Return maximum number of rev reg ids per request for archive of tails files, as per configuration
+    (default 1000).
+
+    :return: maximum rev reg ids per archive
+    """
+
+    cfg = await MEM_CACHE.get('config')
+    return max(1, int(cfg.get('Tails Server', {}).get('archive.max.count', '1000')))
+
+
+@app.middleware('request')
+async def guard_read_only(request: Request) -> HTTPResponse:
+    """
+    Reject any request that would change content on a read-only mirror: all but GET, HEAD,
+    and POST for archive of tails files.
+
+    :param request: Sanic request
+    :return: HTTP response with status 405 to reject request, or None to proceed
+    """
+
+    if request.method in ('GET', 'HEAD') or (request.method == 'POST' and request.path == '/tails/archive'):
+        return None
+
+    if await is_read_only():
+        LOGGER.error('%s %s rejected: tails server is a read-only mirror', request.method, request.path)
+        return response.text(
+            '{} {} rejected: tails server is a read-only mirror'.format(request.method, request.path),
+            status=405,
+            headers={'Allow': 'GET, HEAD'})
+
+    return None
+
+
 @app.get('/did')
 async def get_did(request: Request) -> HTTPResponse:
     """
-    Get the DID of Tails Server anchor
+    Get the DID of Tails Server anchor: on a read-only mirror, as per configuration.
 
     :param request: Sanic request
     :return: response containing DID of tails server nominal anchor
     """
 
     tsan = await MEM_CACHE.get('tsan')
-    return response.text(tsan.did)
+    if tsan:
+        return response.text(tsan.did)
+
+    cfg = await MEM_CACHE.get('config')
+    did = cfg.get('Tails Server', {}).get('read.only.did', '')
+    if not ok_did(did):
+        LOGGER.error('GET for DID of tails server anchor: no anchor, and no DID configured for read-only mirror')
+        return response.text('Tails server has no anchor DID', status=404)
+
+    return response.text(did)
+
+
+async def _vet_new_tails(verb: str, rr_id: str, tails_hash: str) -> HTTPResponse:
+    """
+    Check that input tails hash looks valid and that server has neither tails file for rev reg id
+    nor file at tails hash. Return error response on failure, None for OK.
+
+    :param verb: request method, for messages
+    :param rr_id: revocation registry identifier
+    :param tails_hash: tails hash that request cites
+    :return: error response, or None for OK
+    """
+
+    if not Tails.ok_hash(tails_hash or ''):
+        LOGGER.error('%s cited bad tails file hash %s', verb, tails_hash)
+        return response.text('{} cited bad tails file hash {}'.format(verb, tails_hash), status=400)
+
+    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+
+    if Tails.linked(dir_tails, rr_id):
+        LOGGER.error('%s cited tails file %s, already present', verb, rr_id)
+        return response.text('{} cited tails file {}, already present'.format(verb, rr_id), status=403)
+
+    path_tails_hash = join(Tails.dir(dir_tails, rr_id), tails_hash)
+    if exists(path_tails_hash):
+        LOGGER.error('%s cited tails file %s, already present at %s', verb, rr_id, path_tails_hash)
+        return response.text(
+            '{} cited tails file {}, already present at {}'.format(verb, rr_id, path_tails_hash),
+            status=403)
+
+    return None
+
 
+async def _vet_ledger_hash(verb: str, rr_id: str, tails_hash: str) -> HTTPResponse:
+    """
+    Check that ledger has rev reg definition for rev reg id, with input tails hash.
+    Return error response on failure, None for OK.
+
+    :param verb: request method, for messages
+    :param rr_id: revocation registry identifier
+    :param tails_hash: tails hash that request cites
+    :return: error response, or None for OK
+    """
 
-@app.post('/tails/<rr_id:.+>/<epoch:[0-9]+>')
+    tsan = await MEM_CACHE.get('tsan')
+    try:
+        rev_reg_def = json.loads(await tsan.get_rev_reg_def(rr_id))
+        ledger_hash = rev_reg_def.get('value', {}).get('tailsHash', None)
+        if ledger_hash != tails_hash:
+            LOGGER.error('%s cited tails file hash %s differing from ledger value %s', verb, tails_hash, ledger_hash)
+            return response.text(
+                '{} cited tails file hash {} differing from ledger value {}'.format(verb, tails_hash, ledger_hash),
+                status=400)
+    except AbsentRevReg:
+        LOGGER.error('%s revocation registry not present on ledger for %s', verb, rr_id)
+        return response.text('{} revocation registry not present on ledger for {}'.format(verb, rr_id), status=400)
+
+    return None
+
+
+@app.put('/tails/<rr_id:.+>/preflight')
+async def preflight_tails(request: Request, rr_id: str) -> HTTPResponse:
+    """
+    Check whether server would accept upload of tails file for rev reg id, before issuer sends any tails file
+    content: rev reg id must be valid, server must not already have its tails file, and ledger must
+    have its rev reg definition with tails hash as specified. Upload POST repeats all checks.
+
+    Query parameters specify 'tails-hash' (required) and 'size' (optional, in bytes) of the tails file.
+
+    :param request: Sanic request structure
+    :param rr_id: revocation registry identifier
+    :return: empty text response, status 200 if server would accept upload
+    """
+
+    if not ok_rev_reg_id(rr_id):
+        LOGGER.error('PUT preflight cited bad rev reg id %s', rr_id)
+        return response.text('PUT preflight cited bad rev reg id {}'.format(rr_id), status=400)
+
+    size = request.args.get('size', '')
+    if size:
+        if not size.isdigit():
+            LOGGER.error('PUT preflight cited bad size %s', size)
+            return response.text('PUT preflight cited bad size {}'.format(size), status=400)
+        max_size = await max_upload_size()
+        if int(size) > max_size:
+            LOGGER.error('PUT preflight cited size %s over maximum %s for %s', size, max_size, rr_id)
+            return response.text(
+                'PUT preflight cited size {} over maximum {} for {}'.format(size, max_size, rr_id),
+                status=413)
+
+    tails_hash = request.args.get('tails-hash', None)
+    rv = await _vet_new_tails('PUT preflight', rr_id, tails_hash) or (
+        await _vet_ledger_hash('PUT preflight', rr_id, tails_hash))
+    if rv:
+        return rv
+
+    LOGGER.info('Preflight OK for upload of tails file %s for rev reg id %s', tails_hash, rr_id)
+    return response.text('')
+
+
+@app.post('/tails/<rr_id:.+>/<epoch:[0-9]+>', stream=True)
 async def post_tails(request: Request, rr_id: str, epoch: int) -> HTTPResponse:
     """
     Post tails file to server, auth-encrypted from issuer (by DID) to tails server anchor.
     Multipart file name must be tails hash.
 
+    Under upload protocol version 2 (multipart field 'version' of '2'), the signature covers
+    '<epoch>||<rr_id>||<sha256-hex>', where the digest is over tails file content. Legacy version 1
+    (no 'version' field) signs '<epoch>||<tails>' over the representation of the entire tails file;
+    the server accepts it only as configured.
+
+    The server streams the tails file attachment into a staging file as it arrives, subject to
+    the configured maximum upload size, rather than buffering the request body in memory. The attachment
+    may carry a 'Content-Encoding' header of 'gzip' or 'zstd', for the server to decode as it arrives.
+    If so configured, the server then queues the staged upload for asynchronous processing
+    and responds with status 202 and job state.
+
     :param request: Sanic request structure
     :param rr_id: revocation registry identifier
     :param epoch: current EPOCH time, must be within configured proximity to current server time
-    :return: empty text response
+    :return: empty text response, or JSON job state for asynchronous processing
     """
 
     if not ok_rev_reg_id(rr_id):
@@ -84,116 +339,898 @@ async def post_tails(request: Request, rr_id: str, epoch: int) -> HTTPResponse:
         LOGGER.error('POST epoch %s in too far from current server time', epoch)
         return response.text('POST epoch {} is too far from current server time'.format(epoch), status=400)
 
-    tails_hash = request.files['tails-file'][0].name
-    if not Tails.ok_hash(tails_hash):
-        LOGGER.error('POST attached file named with bad tails file hash %s', tails_hash)
-        return response.text('POST attached file named with bad tails file hash {}'.format(tails_hash), status=400)
+    dir_staging = join(dirname(dirname(realpath(__file__))), 'staging')
+    try:
+        spool = await spool_upload(request, dir_staging, 'tails-file', await max_upload_size())
+    except OversizeUpload as x_oversize:
+        LOGGER.error('POST attached tails file for %s too large: %s', rr_id, x_oversize)
+        return response.text(
+            'POST attached tails file for {} too large: {}'.format(rr_id, x_oversize),
+            status=413)
+    except BadUpload as x_bad:
+        LOGGER.error('POST attachments for %s failed to parse: %s', rr_id, x_bad)
+        return response.text('POST attachments for {} failed to parse: {}'.format(rr_id, x_bad), status=400)
 
-    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
-    dir_cd_id = Tails.dir(dir_tails, rr_id)
+    process = partial(
+        _process_upload,
+        'POST',
+        rr_id,
+        spool.filename,
+        partial(_post_staged_tails, rr_id, did, epoch, spool))
+    if await is_upload_async():
+        return await _submit_upload_job(rr_id, process, spool.discard)
 
-    makedirs(dir_cd_id, exist_ok=True)
+    try:
+        return await process()
+    finally:
+        spool.discard()
 
-    if Tails.linked(dir_tails, rr_id):
-        LOGGER.error('POST attached tails file %s, already present', rr_id)
-        return response.text('POST attached tails file {}, already present'.format(rr_id), status=403)
 
-    path_tails_hash = join(dir_cd_id, tails_hash)
-    if exists(path_tails_hash):
-        LOGGER.error('POST attached tails file %s, already present at %s', rr_id, path_tails_hash)
+def _take_off(rr_id: str, tails_hash: str) -> None:
+    """
+    Register upload in processing for rev reg id, for any concurrent duplicate uploads to wait on.
+
+    :param rr_id: revocation registry identifier
+    :param tails_hash: tails hash that upload cites
+    """
+
+    UPLOADS_IN_FLIGHT[rr_id] = {
+        'tails_hash': tails_hash,
+        'outcome': asyncio.get_event_loop().create_future()
+    }
+
+
+def _land(rr_id: str, rv: HTTPResponse) -> None:
+    """
+    Deregister upload in processing for rev reg id, passing its outcome to any duplicate uploads waiting on it.
+
+    :param rr_id: revocation registry identifier
+    :param rv: HTTP response for upload, or None if processing failed
+    """
+
+    flight = UPLOADS_IN_FLIGHT.pop(rr_id, None)
+    if flight and not flight['outcome'].done():
+        flight['outcome'].set_result(None if rv is None else (rv.status, rv.body, rv.content_type, dict(rv.headers)))
+
+
+async def _process_upload(
+        verb: str,
+        rr_id: str,
+        tails_hash: str,
+        process: Callable[[], Awaitable[HTTPResponse]],
+        shared: Callable[[], None] = None) -> HTTPResponse:
+    """
+    Process staged upload once no other upload for the same rev reg id is in processing, so that the server
+    does not verify, look up, and write the same tails file twice at once. Only processing waits: each upload
+    stages its own content first, so a slow upload holds up no other.
+
+    A duplicate upload shares the outcome of the upload in processing only if that upload succeeds and cites
+    the same tails hash; otherwise, the duplicate goes on to process on its own merits, with its own
+    content and signature.
+
+    Duplicates within this worker process wait on the in-flight registry; across worker processes, an upload
+    in processing holds a file lock per rev reg id in staging, and a duplicate in another worker that waits
+    on it shares its outcome if the tails file for the rev reg id is then in place at the same tails hash.
+
+    :param verb: HTTP verb for logging
+    :param rr_id: revocation registry identifier
+    :param tails_hash: tails hash that upload cites
+    :param process: coroutine function processing staged upload, returning HTTP response for upload
+    :param shared: function to call on sharing outcome of another upload instead of processing, if any
+    :return: HTTP response for upload
+    """
+
+    while rr_id in UPLOADS_IN_FLIGHT:
+        flight = UPLOADS_IN_FLIGHT[rr_id]
+        LOGGER.info('%s for %s waits on upload already in processing', verb, rr_id)
+        outcome = await asyncio.shield(flight['outcome'])
+        if outcome and outcome[0] == 200 and flight['tails_hash'] == tails_hash:
+            LOGGER.info('%s for %s shares outcome of upload of same tails file %s', verb, rr_id, tails_hash)
+            if shared:
+                shared()
+            (status, body, content_type, headers) = outcome
+            return response.raw(body, status=status, headers=headers, content_type=content_type)
+
+    _take_off(rr_id, tails_hash)
+    rv = None
+    lock = FileLock(join(dirname(dirname(realpath(__file__))), 'staging', 'locks', '{}.lock'.format(rr_id)))
+    try:
+        if not await lock.wait():
+            LOGGER.info('%s for %s waited on upload in processing in another worker', verb, rr_id)
+            path_tails = Tails.linked(join(dirname(dirname(realpath(__file__))), 'tails'), rr_id)
+            if path_tails and basename(path_tails) == tails_hash:
+                LOGGER.info('%s for %s shares outcome of upload of same tails file %s', verb, rr_id, tails_hash)
+                if shared:
+                    shared()
+                rv = response.text('')
+                return rv
+        rv = await process()
+        return rv
+    finally:
+        lock.release()
+        _land(rr_id, rv)
+
+
+async def _submit_upload_job(
+        rr_id: str,
+        process: Callable[[], Awaitable[HTTPResponse]],
+        cleanup: Callable[[], None]) -> HTTPResponse:
+    """
+    Queue staged upload for asynchronous processing.
+
+    :param rr_id: revocation registry identifier
+    :param process: coroutine function processing staged upload, returning HTTP response for POST request
+    :param cleanup: function releasing staged upload, to call once processed or on rejection
+    :return: JSON response with job state and status 202, or status 503 if job queue is at capacity
+    """
+
+    jobs = await MEM_CACHE.get('jobs')
+    try:
+        job = jobs.submit(rr_id, process, cleanup)
+    except JobsBusy:
+        cleanup()
+        LOGGER.error('POST for %s deferred: upload job queue at capacity', rr_id)
         return response.text(
-            'POST attached tails file {}, already present at {}'.format(rr_id, path_tails_hash),
-            status=403)
+            'POST for {} deferred: upload job queue at capacity'.format(rr_id),
+            status=503,
+            headers={'Retry-After': '5'})
+
+    return response.json(job, status=202, headers={'Location': '/tails/job/{}'.format(job['id'])})
+
+
+async def _post_staged_tails(
+        rr_id: str,
+        did: str,
+        epoch: int,
+        spool: Union[MultipartSpool, UploadSession]) -> HTTPResponse:
+    """
+    Vet tails file content in staging from POST request or upload session and, if acceptable,
+    move it into place in tails tree.
+
+    :param rr_id: revocation registry identifier
+    :param did: issuer DID
+    :param epoch: EPOCH time from request
+    :param spool: multipart spool or complete upload session, with tails file in staging
+    :return: HTTP response for POST request
+    """
+
+    tails_hash = spool.filename
+    rv = await _vet_new_tails('POST', rr_id, tails_hash)
+    if rv:
+        return rv
+
+    if spool.tails_hash != tails_hash:
+        LOGGER.error('POST attached file named %s has content with tails hash %s', tails_hash, spool.tails_hash)
+        return response.text(
+            'POST attached file named {} has content with tails hash {}'.format(tails_hash, spool.tails_hash),
+            status=400)
 
     tsan = await MEM_CACHE.get('tsan')
-    signature = request.files['signature'][0].body
-    epoch_tails = '{}||{}'.format(epoch, request.files['tails-file'][0].body)
-    if not tsan.verify(epoch_tails, signature, did):
+    signature = bytes(spool.fields.get('signature', b''))
+    version = bytes(spool.fields.get('version', b'1')).decode('latin-1').strip()
+    if version == '2':
+        plain = '{}||{}||{}'.format(epoch, rr_id, spool.digest.hex()).encode()
+    elif version == '1' and await accepts_upload_v1():
+        plain = partial(upload_v1_plain, epoch, spool.path)  # verifier reads staged file in its executor
+    else:
+        LOGGER.error('POST attached file %s cited unsupported upload protocol version %s', tails_hash, version)
+        return response.text(
+            'POST attached file {} cited unsupported upload protocol version {}'.format(tails_hash, version),
+            status=400)
+
+    verifier = await MEM_CACHE.get('verifier')
+    try:
+        verified = await verifier.verify(tsan, plain, signature, did)
+    except VerifyBusy:
+        LOGGER.error('POST attached file %s deferred: verification queue at capacity', tails_hash)
+        return response.text(
+            'POST attached file {} deferred: verification queue at capacity'.format(tails_hash),
+            status=503,
+            headers={'Retry-After': '5'})
+    if not verified:
         LOGGER.error('POST attached file %s failed to verify', tails_hash)
         return response.text('POST attached file {} failed to verify'.format(tails_hash), status=400)
 
-    try:
-        rev_reg_def = json.loads(await tsan.get_rev_reg_def(rr_id))
-        ledger_hash = rev_reg_def.get('value', {}).get('tailsHash', None)
-        if ledger_hash != tails_hash:
-            LOGGER.error('POST attached tails file hash %s differs from ledger value %s', tails_hash, ledger_hash)
-            return response.text(
-                'POST attached tails file hash {} differs from ledger value {}'.format(tails_hash, ledger_hash),
-                status=400)
-    except AbsentRevReg:
-        LOGGER.error('POST revocation registry not present on ledger for %s', rr_id)
-        return response.text('POST revocation registry not present on ledger for {}'.format(rr_id), status=400)
+    rv = await _vet_ledger_hash('POST', rr_id, tails_hash)
+    if rv:
+        return rv
 
-    with open(path_tails_hash, 'wb') as fh_tails:
-        fh_tails.write(request.files['tails-file'][0].body)
+    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+    dir_cd_id = Tails.dir(dir_tails, rr_id)
+    makedirs(dir_cd_id, exist_ok=True)
+    path_tails_hash = join(dir_cd_id, tails_hash)
+    path_staged = spool.claim()
+    publisher = await MEM_CACHE.get('publisher')
+    try:  # staging dir is on same file system as tails tree: publisher renames into place
+        await publisher.publish(path_staged, path_tails_hash, partial(Tails.associate, dir_tails, rr_id, tails_hash))
+    finally:
+        if isfile(path_staged):
+            unlink(path_staged)
+        (await MEM_CACHE.get('stat_cache')).invalidate(rr_id)
+    await (await MEM_CACHE.get('catalog')).add(rr_id, tails_hash, spool.size)
+
+    LOGGER.info(
+        'Associated link %s to POST tails file attachment (%s bytes) saved to %s',
+        rr_id,
+        spool.size,
+        path_tails_hash)
 
-    Tails.associate(dir_tails, rr_id, tails_hash)
-    LOGGER.info('Associated link %s to POST tails file attachment saved to %s', rr_id, path_tails_hash)
+    if (await MEM_CACHE.get('variants')).encodings:
+        asyncio.ensure_future(_produce_variants(rr_id, path_tails_hash))
 
     return response.text('')
 
 
+async def _produce_variants(rr_id: str, path_tails: str) -> None:
+    """
+    Produce precompressed variants of newly published tails file, then drop its cached metadata
+    so that downloads may find them.
+
+    :param rr_id: rev reg id for revocation registry to which tails file pertains
+    :param path_tails: path to tails file
+    """
+
+    if await (await MEM_CACHE.get('variants')).produce(path_tails):
+        (await MEM_CACHE.get('stat_cache')).invalidate(rr_id)
+
+
+@app.post('/tails/session/<rr_id:.+>')
+async def open_upload_session(request: Request, rr_id: str) -> HTTPResponse:
+    """
+    Open resumable upload session for tails file, or resume existing session for the same
+    rev reg id and tails hash. Query parameters specify 'tails-hash' and 'size' (in bytes) of the tails file,
+    and current 'epoch' time. Request body is issuer signature over '<epoch>||<rr_id>||<tails-hash>||<size>',
+    so that only the issuer learns the session identifier, which authorizes puts and finalization.
+    The server performs the same checks as on preflight before opening the session, and refuses
+    new sessions beyond configured capacity with status 503.
+
+    :param request: Sanic request structure
+    :param rr_id: revocation registry identifier
+    :return: JSON response with session identifier, rev reg id, tails hash, size, and committed offset
+    """
+
+    if not ok_rev_reg_id(rr_id):
+        LOGGER.error('POST session cited bad rev reg id %s', rr_id)
+        return response.text('POST session cited bad rev reg id {}'.format(rr_id), status=400)
+
+    size = request.args.get('size', '')
+    if not size.isdigit():
+        LOGGER.error('POST session cited bad size %s', size)
+        return response.text('POST session cited bad size {}'.format(size), status=400)
+    max_size = await max_upload_size()
+    if int(size) > max_size:
+        LOGGER.error('POST session cited size %s over maximum %s for %s', size, max_size, rr_id)
+        return response.text(
+            'POST session cited size {} over maximum {} for {}'.format(size, max_size, rr_id),
+            status=413)
+
+    epoch = request.args.get('epoch', '')
+    if not (epoch.isdigit() and await is_current(int(epoch))):
+        LOGGER.error('POST session epoch %s is missing or too far from current server time', epoch)
+        return response.text(
+            'POST session epoch {} is missing or too far from current server time'.format(epoch),
+            status=400)
+
+    tails_hash = request.args.get('tails-hash', None)
+    rv = await _vet_new_tails('POST session', rr_id, tails_hash)
+    if rv:
+        return rv
+
+    tsan = await MEM_CACHE.get('tsan')
+    verifier = await MEM_CACHE.get('verifier')
+    try:
+        verified = await verifier.verify(
+            tsan,
+            '{}||{}||{}||{}'.format(epoch, rr_id, tails_hash, size).encode(),
+            request.body,
+            rr_id.split(':')[0])
+    except VerifyBusy:
+        LOGGER.error('POST session deferred: verification queue at capacity')
+        return response.text(
+            'POST session deferred: verification queue at capacity',
+            status=503,
+            headers={'Retry-After': '5'})
+    if not verified:
+        LOGGER.error('POST session signature failed to verify for %s', rr_id)
+        return response.text('POST session signature failed to verify for {}'.format(rr_id), status=400)
+
+    rv = await _vet_ledger_hash('POST session', rr_id, tails_hash)
+    if rv:
+        return rv
+
+    dir_sessions = join(dirname(dirname(realpath(__file__))), 'staging', 'sessions')
+    UploadSession.expire(dir_sessions, await session_ttl())
+    try:
+        session = UploadSession.open(dir_sessions, rr_id, tails_hash, int(size), *(await session_limits()))
+    except SessionsFull:
+        LOGGER.error('POST session deferred for %s: upload sessions at capacity', rr_id)
+        return response.text(
+            'POST session deferred for {}: upload sessions at capacity'.format(rr_id),
+            status=503,
+            headers={'Retry-After': '60'})
+
+    return response.json(session.state())
+
+
+@app.get('/tails/session/<sid:[0-9a-f]{32}>')
+async def get_upload_session(request: Request, sid: str) -> HTTPResponse:
+    """
+    Get upload session state.
+
+    :param request: Sanic request structure
+    :param sid: session identifier
+    :return: JSON response with session identifier, rev reg id, tails hash, size, and committed offset
+    """
+
+    session = UploadSession.get(join(dirname(dirname(realpath(__file__))), 'staging', 'sessions'), sid)
+    if not session:
+        LOGGER.error('GET cited no such upload session %s', sid)
+        return response.text('GET cited no such upload session {}'.format(sid), status=404)
+
+    return response.json(session.state())
+
+
+@app.put('/tails/session/<sid:[0-9a-f]{32}>', stream=True)
+async def put_upload_session(request: Request, sid: str) -> HTTPResponse:
+    """
+    Put byte range of tails file content to upload session, per 'Content-Range: bytes <first>-<last>/<size>'
+    header. Range must start at committed offset; otherwise, the server responds with status 409 and
+    session state, from which the issuer may resume.
+
+    :param request: Sanic request structure
+    :param sid: session identifier
+    :return: JSON response with session identifier, rev reg id, tails hash, size, and committed offset
+    """
+
+    session = UploadSession.get(join(dirname(dirname(realpath(__file__))), 'staging', 'sessions'), sid)
+    if not session:
+        LOGGER.error('PUT cited no such upload session %s', sid)
+        await _drain(request)
+        return response.text('PUT cited no such upload session {}'.format(sid), status=404)
+
+    lock = session.lock()
+    if not lock.acquire():
+        LOGGER.error('PUT cited upload session %s, already in use', sid)
+        await _drain(request)
+        return response.json(session.state(), status=409)
+
+    try:
+        await session.write(request, request.headers.get('content-range', None))
+    except BadRange as x_range:
+        LOGGER.error('PUT to upload session %s rejected: %s', sid, x_range)
+        await _drain(request)
+        return response.json(session.state(), status=409)
+    except OSError as x_os:
+        LOGGER.error('PUT to upload session %s failed to write: %s', sid, x_os)
+        await _drain(request)
+        return response.text('PUT to upload session {} failed to write'.format(sid), status=500)
+    finally:
+        lock.release()
+
+    return response.json(session.state())
+
+
+async def _drain(request: Request) -> None:
+    """
+    Read and discard the rest of a streaming request body, so that a response before its end leaves
+    no unread content on a keep-alive connection to corrupt the next request.
+
+    :param request: Sanic request, on route accepting streaming content
+    """
+
+    while (await request.stream.read()) is not None:
+        pass
+
+
+@app.post('/tails/session/<sid:[0-9a-f]{32}>/<epoch:[0-9]+>')
+async def post_upload_session(request: Request, sid: str, epoch: int) -> HTTPResponse:
+    """
+    Finalize upload session: vet complete content as per POST of tails file and, if acceptable,
+    move it into place in tails tree. Request body is issuer signature over
+    '<epoch>||<rr_id>||<sha256-hex>' as per upload protocol version 2. If so configured,
+    the server queues the session for asynchronous processing and responds with status 202 and job state.
+
+    :param request: Sanic request structure
+    :param sid: session identifier
+    :param epoch: current EPOCH time, must be within configured proximity to current server time
+    :return: empty text response, or JSON job state for asynchronous processing
+    """
+
+    session = UploadSession.get(join(dirname(dirname(realpath(__file__))), 'staging', 'sessions'), sid)
+    if not session:
+        LOGGER.error('POST cited no such upload session %s', sid)
+        return response.text('POST cited no such upload session {}'.format(sid), status=404)
+
+    if not await is_current(int(epoch)):
+        LOGGER.error('POST epoch %s in too far from current server time', epoch)
+        return response.text('POST epoch {} is too far from current server time'.format(epoch), status=400)
+
+    lock = session.lock()
+    if not (session.complete and lock.acquire()):
+        LOGGER.error('POST cited upload session %s, in use or incomplete', sid)
+        return response.json(session.state(), status=409)
+
+    process = partial(
+        _process_upload,
+        'POST',
+        session.rr_id,
+        session.filename,
+        partial(_finish_upload_session, session, epoch, request.body),
+        session.discard)
+    if await is_upload_async():
+        return await _submit_upload_job(session.rr_id, process, lock.release)
+
+    try:
+        return await process()
+    finally:
+        lock.release()
+
+
+async def _finish_upload_session(session: UploadSession, epoch: int, signature: bytes) -> HTTPResponse:
+    """
+    Hash complete upload session content, vet it as per POST of tails file and, if acceptable,
+    move it into place in tails tree. Discard session once done or if content is no good.
+
+    :param session: complete upload session
+    :param epoch: EPOCH time from request
+    :param signature: issuer signature over '<epoch>||<rr_id>||<sha256-hex>'
+    :return: HTTP response for POST request
+    """
+
+    await session.hash()
+    session.fields.update({'signature': signature, 'version': b'2'})
+    rv = await _post_staged_tails(session.rr_id, session.rr_id.split(':')[0], epoch, session)
+    if rv.status in (200, 403) or session.tails_hash != session.filename:
+        session.discard()  # done, or content is no good
+
+    return rv
+
+
+@app.get('/tails/job/<job_id:[0-9a-f]{32}>')
+async def get_upload_job(request: Request, job_id: str) -> HTTPResponse:
+    """
+    Get state of asynchronous upload job. Once done, the state includes the HTTP status and message
+    that the server would have returned for synchronous upload.
+
+    :param request: Sanic request structure
+    :param job_id: job identifier
+    :return: JSON response with job state
+    """
+
+    jobs = await MEM_CACHE.get('jobs')
+    job = jobs.get(job_id) if jobs else None
+    if not job:
+        LOGGER.error('GET cited no such upload job %s', job_id)
+        return response.text('GET cited no such upload job {}'.format(job_id), status=404)
+
+    return response.json(job)
+
+
 @app.get('/tails/<rr_id:.+>')
 async def get_tails(request: Request, rr_id: str) -> HTTPResponse:
     """
-    Get tails file pertaining to input revocation registry identifier.
+    Get tails file pertaining to input revocation registry identifier, streaming it (via sendfile where
+    available) from a cached open file handle rather than reading it into memory. Serve any byte ranges
+    that a 'Range' header specifies, as per RFC 7233: one range with status 206, several as
+    multipart/byteranges with status 206, none satisfiable with status 416.
+
+    Tails files are immutable: the tails hash serves as strong entity tag, the server answers
+    conditional requests (If-None-Match, If-Modified-Since, If-Range) accordingly, and caches may keep
+    tails files for the configured maximum age.
+
+    Absent a 'Range' header, serve the smallest precompressed variant (gzip or zstd) present
+    that the 'Accept-Encoding' header admits, with a corresponding 'Content-Encoding' header.
+
+    If configuration delegates delivery to a front proxy, answer with an internal redirect header
+    instead, for the proxy to serve the file (and any byte ranges) from disk.
 
     :param request: Sanic request structure
     :param rr_id: rev reg id for revocation registry to which tails file pertains
-    :return: HTTP response with tails file, having tails hash as name
+    :return: HTTP response with tails file (or byte ranges thereof), having tails hash as name
     """
 
     if not ok_rev_reg_id(rr_id):
         LOGGER.error('GET cited bad rev reg id %s', rr_id)
         return response.text('GET cited bad rev reg id {}'.format(rr_id), status=400)
 
-    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
-    dir_cd_id = Tails.dir(dir_tails, rr_id)
+    stat_cache = await MEM_CACHE.get('stat_cache')
+    meta = stat_cache.acquire(rr_id)
+    if not meta:
+        LOGGER.error('GET cited rev reg id %s for which tails file not present', rr_id)
+        return response.text('GET cited rev reg id {} for which tails file not present'.format(rr_id), status=404)
 
-    if not isdir(dir_cd_id):
-        LOGGER.error('GET cited rev reg id %s for which tails file dir %s not present', rr_id, dir_cd_id)
+    rv = None
+    try:
+        rv = await _tails_response(request, rr_id, meta, partial(stat_cache.release, meta))
+        return rv
+    finally:
+        if not isinstance(rv, StreamingHTTPResponse):  # no response streaming from file handles to release them
+            stat_cache.release(meta)
+
+
+async def _tails_response(request: Request, rr_id: str, meta: dict, release: Callable) -> HTTPResponse:
+    """
+    Return response to GET request for tails file, as per get_tails(). Any streaming response calls
+    the input callable once it finishes, to release the cached file handles it streams from.
+
+    :param request: Sanic request structure
+    :param rr_id: rev reg id for revocation registry to which tails file pertains
+    :param meta: tails file metadata from stat cache, with reference held on its file handles
+    :param release: callable releasing reference on file handles
+    :return: HTTP response with tails file (or byte ranges thereof), having tails hash as name
+    """
+
+    path_tails = meta['path']
+    size = meta['size']
+    encoding = await _tails_encoding(request, meta)
+    tag = etag(meta['tails_hash'], encoding)
+    headers = await _tails_headers(meta, encoding)
+
+    if is_not_modified(request.headers, tag, meta['mtime']):
+        LOGGER.info('GET for tails file %s associated with rev reg id %s: not modified', path_tails, rr_id)
+        return response.empty(status=304, headers=headers)
+
+    delivery = await MEM_CACHE.get('delivery')
+    heat = await MEM_CACHE.get('heat')
+    if delivery.offload:
+        heat.record(rr_id, meta['variants'][encoding] if encoding else size)
+        LOGGER.info(
+            'Delegating download GET request for tails file %s associated with rev reg id %s to front proxy',
+            path_tails,
+            rr_id)
+        headers['Content-Disposition'] = 'attachment; filename="{}"'.format(basename(path_tails))
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return delivery.redirect(
+            variant_path(path_tails, encoding) if encoding else path_tails,
+            headers,
+            guess_type(path_tails)[0] or 'text/plain')
+
+    try:
+        ranges = None
+        if is_range_current(request.headers, tag, meta['mtime']):
+            ranges = parse_range(request.headers.get('range', None), size)
+    except UnsatisfiableRange as x_range:
+        LOGGER.error('GET for tails file %s cited unsatisfiable range: %s', path_tails, x_range)
         return response.text(
-            'GET cited rev reg id {} for which tails file dir {} not present'.format(rr_id, dir_cd_id),
-            status=404)
+            'GET for tails file {} cited unsatisfiable range: {}'.format(basename(path_tails), x_range),
+            status=416,
+            headers={'Content-Range': 'bytes */{}'.format(size), 'ETag': tag})
+
+    headers['Content-Disposition'] = 'attachment; filename="{}"'.format(basename(path_tails))
+    if encoding:
+        LOGGER.info(
+            'Fulfilling download GET request for %s variant of tails file %s associated with rev reg id %s',
+            encoding,
+            path_tails,
+            rr_id)
+        headers['Content-Encoding'] = encoding
+        heat.record(rr_id, meta['variants'][encoding])
+        return delivery.file(
+            variant_path(path_tails, encoding),
+            [(0, meta['variants'][encoding])],
+            headers=headers,
+            content_type=guess_type(path_tails)[0] or 'text/plain',
+            fh=meta['fh_variants'][encoding],
+            release=release)
+
+    if not ranges:
+        LOGGER.info(
+            'Fulfilling download GET request for tails file %s associated with rev reg id %s',
+            path_tails,
+            rr_id)
+        heat.record(rr_id, size)
+        return delivery.file(path_tails, [(0, size)], headers=headers, fh=meta['fh'], release=release)
+
+    LOGGER.info(
+        'Fulfilling download GET request for ranges %s of tails file %s associated with rev reg id %s',
+        ', '.join('{}-{}'.format(r.start, r.end) for r in ranges),
+        path_tails,
+        rr_id)
+    heat.record(rr_id, sum(r.size for r in ranges))
+    if len(ranges) == 1:
+        headers['Content-Range'] = ranges[0].content_range()
+        return delivery.file(
+            path_tails,
+            [(ranges[0].start, ranges[0].size)],
+            status=206,
+            headers=headers,
+            fh=meta['fh'],
+            release=release)
+
+    boundary = uuid4().hex
+    segments = []
+    for byte_range in ranges:
+        segments.append('--{}\r\nContent-Type: application/octet-stream\r\nContent-Range: {}\r\n\r\n'.format(
+            boundary,
+            byte_range.content_range()).encode())
+        segments.append((byte_range.start, byte_range.size))
+        segments.append(b'\r\n')
+    segments.append('--{}--\r\n'.format(boundary).encode())
+
+    return delivery.file(
+        path_tails,
+        segments,
+        status=206,
+        headers=headers,
+        content_type='multipart/byteranges; boundary={}'.format(boundary),
+        fh=meta['fh'],
+        release=release)
+
+
+async def _tails_encoding(request: Request, meta: dict) -> str:
+    """
+    Return content encoding of precompressed variant of tails file to serve, or None for tails file as is.
+    Byte ranges refer to tails file as is; under X-Accel-Redirect, nginx serves any gzip variant itself
+    (via gzip_static) since it does not pass on content encoding from an internal redirect.
+
+    :param request: Sanic request structure
+    :param meta: tails file metadata from stat cache
+    :return: content encoding, or None
+    """
+
+    if 'range' in request.headers or (await MEM_CACHE.get('delivery')).offload == 'X-Accel-Redirect':
+        return None
+
+    return (await MEM_CACHE.get('variants')).negotiate(request.headers.get('accept-encoding', None), meta['variants'])
+
+
+async def _tails_headers(meta: dict, encoding: str = None) -> dict:
+    """
+    Return response headers for tails file: byte range support, entity tag, modification time, and caching,
+    varying by accept-encoding if the server keeps precompressed variants.
+
+    :param meta: tails file metadata from stat cache
+    :param encoding: content encoding of variant to serve, or None for tails file as is
+    :return: headers dict
+    """
+
+    rv = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag(meta['tails_hash'], encoding),
+        'Last-Modified': http_date(meta['mtime']),
+        'Cache-Control': 'public, max-age={}, immutable'.format(await cache_max_age())
+    }
+    if (await MEM_CACHE.get('variants')).encodings:
+        rv['Vary'] = 'Accept-Encoding'
+
+    return rv
+
+
+@app.head('/tails/<rr_id:.+>')
+async def head_tails(request: Request, rr_id: str) -> HTTPResponse:
+    """
+    Get headers for tails file pertaining to input revocation registry identifier, as per GET but without content,
+    from cached metadata.
+
+    :param request: Sanic request structure
+    :param rr_id: rev reg id for revocation registry to which tails file pertains
+    :return: empty HTTP response with tails file headers
+    """
+
+    if not ok_rev_reg_id(rr_id):
+        LOGGER.error('HEAD cited bad rev reg id %s', rr_id)
+        return response.text('HEAD cited bad rev reg id {}'.format(rr_id), status=400)
 
-    path_tails = Tails.linked(dir_tails, rr_id)
-    if not path_tails:
+    meta = (await MEM_CACHE.get('stat_cache')).get(rr_id)
+    if not meta:
+        LOGGER.error('HEAD cited rev reg id %s for which tails file not present', rr_id)
+        return response.text('HEAD cited rev reg id {} for which tails file not present'.format(rr_id), status=404)
+
+    encoding = await _tails_encoding(request, meta)
+    headers = await _tails_headers(meta, encoding)
+    headers['Content-Disposition'] = 'attachment; filename="{}"'.format(meta['tails_hash'])
+    headers['Content-Length'] = str(meta['variants'][encoding] if encoding else meta['size'])
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    status = 304 if is_not_modified(request.headers, headers['ETag'], meta['mtime']) else 200
+
+    return response.raw(b'', status=status, headers=headers, content_type=guess_type(meta['path'])[0] or 'text/plain')
+
+
+@app.get('/tails/<rr_id:.+>/meta')
+async def get_tails_meta(request: Request, rr_id: str) -> HTTPResponse:
+    """
+    Get metadata for tails file pertaining to input revocation registry identifier, from cached metadata.
+
+    :param request: Sanic request structure
+    :param rr_id: rev reg id for revocation registry to which tails file pertains
+    :return: JSON response with rev reg id, cred def id, issuer DID, tails hash, size in bytes,
+        modification time as EPOCH time, and sizes in bytes of precompressed variants by content encoding
+    """
+
+    if not ok_rev_reg_id(rr_id):
+        LOGGER.error('GET cited bad rev reg id %s', rr_id)
+        return response.text('GET cited bad rev reg id {}'.format(rr_id), status=400)
+
+    meta = (await MEM_CACHE.get('stat_cache')).get(rr_id)
+    if not meta:
         LOGGER.error('GET cited rev reg id %s for which tails file not present', rr_id)
         return response.text('GET cited rev reg id {} for which tails file not present'.format(rr_id), status=404)
 
-    LOGGER.info('Fulfilling download GET request for tails file %s associated with rev reg id %s', path_tails, rr_id)
-    return await response.file(path_tails, filename=basename(path_tails))
+    return response.json(
+        {k: meta[k] for k in ('rr_id', 'cd_id', 'issuer_did', 'tails_hash', 'size', 'mtime', 'variants')})
 
 
 @app.get('/tails/list/<ident:.+>')
 async def list_tails(request: Request, ident: str) -> HTTPResponse:
     """
-    List tails files by corresponding rev reg ids: all, by rev reg id, by cred def id, or by issuer DID.
+    List tails files by corresponding rev reg ids: all, by rev reg id, by cred def id, or by issuer DID,
+    in sorted order.
+
+    Query parameters after=<rr_id> and limit=<n> select a page following the cursor; a JSON page that
+    may have more after it carries a Link header to the next. With Accept: application/x-ndjson, the server
+    streams rev reg ids as newline-delimited JSON strings instead, reading the catalog a page at a time.
+
+    Every listing carries the catalog generation token in header X-Tails-Generation. A whole listing (without
+    after or limit) carries an entity tag for the latest change on its filter, and a request with a matching
+    If-None-Match header gets status 304 without content. Query parameter
+    since=<generation> selects a JSON object with the current generation token and the rev reg ids added and
+    removed since then instead, or status 410 if the server no longer has the changes since then or the generation
+    is ahead of the catalog's (e.g., a generation token from a catalog since restored from backup).
 
     :param request: Sanic request structure
     :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
-    :return: HTTP response with JSON array of rev reg ids corresponding to available tails files
+    :return: HTTP response with JSON array or NDJSON stream of rev reg ids corresponding to available tails files,
+        or JSON object with changes since generation
     """
 
-    rv = []
-    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+    catalog = await MEM_CACHE.get('catalog')
+    since = request.args.get('since', None)
+    if since is not None:
+        try:
+            changes = await catalog.changes(ident, since)
+        except StaleGeneration:
+            LOGGER.info('GET listing tails files cited generation %s without changes since: list in full', since)
+            return response.text(
+                'Changes since generation {} unavailable: list in full'.format(since),
+                status=410,
+                headers={'X-Tails-Generation': await catalog.generation()})
+        if changes is None:
+            LOGGER.error('Token %s is not a valid specifier for tails files', ident)
+            return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
+        LOGGER.info('Fulfilling GET request listing changes to tails files on filter %s since %s', ident, since)
+        return response.json(changes, headers={'X-Tails-Generation': changes['generation']})
 
-    if ident == 'all':  # list everything: 'all' is not valid base58 so it can't be any case below
-        rv = [basename(link) for link in Tails.links(dir_tails)]
-    elif ok_rev_reg_id(ident):  # it's a rev reg id
-        if Tails.linked(dir_tails, ident):
-            rv = [ident]
-    elif ok_cred_def_id(ident):  # it's a cred def id (starts with issuer DID)
-        rv = [basename(link) for link in Tails.links(dir_tails, ident.split(':')[0])
-            if rev_reg_id2cred_def_id(basename(link)) == ident]
-    elif ok_did(ident):  # it's an issuer DID
-        rv = [basename(link) for link in Tails.links(dir_tails, ident)]
-    else:
+    # generation before reading: client may see changes twice, never miss
+    headers = {'X-Tails-Generation': await catalog.generation()}
+    after = request.args.get('after', None)
+    if after is not None and not ok_rev_reg_id(after):
+        LOGGER.error('GET listing tails files cited bad cursor %s', after)
+        return response.text('GET listing tails files cited bad cursor {}'.format(after), status=400)
+    limit = request.args.get('limit', None)
+    if limit is not None:
+        if not limit.isdigit() or int(limit) == 0:
+            LOGGER.error('GET listing tails files cited bad limit %s', limit)
+            return response.text('GET listing tails files cited bad limit {}'.format(limit), status=400)
+        limit = int(limit)
+    ndjson = 'application/x-ndjson' in request.headers.get('Accept', '')
+
+    if after is None and limit is None:  # whole listing: tag it, for clients to poll with If-None-Match
+        tag = await catalog.tag(ident)
+        if tag is None:
+            LOGGER.error('Token %s is not a valid specifier for tails files', ident)
+            return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
+        headers['ETag'] = '"{}{}"'.format(tag, '-ndjson' if ndjson else '')
+        headers['Vary'] = 'Accept'
+        headers['Cache-Control'] = 'no-cache'
+        if is_not_modified(request.headers, headers['ETag']):
+            LOGGER.info('GET request listing tails files on filter %s: not modified', ident)
+            return response.empty(status=304, headers=headers)
+
+    if after is None and limit is None and not ndjson:
+        listing = await catalog.listing(ident)
+        if listing is None:
+            LOGGER.error('Token %s is not a valid specifier for tails files', ident)
+            return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
+        LOGGER.info('Fulfilling GET request listing tails files on filter %s', ident)
+        return response.raw(listing, headers=headers, content_type='application/json')
+
+    page_size = min(limit or LIST_PAGE_MAX, LIST_PAGE_MAX)
+    page = await catalog.rr_ids(ident, after, page_size)
+    if page is None:
         LOGGER.error('Token %s is not a valid specifier for tails files', ident)
         return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
 
-    LOGGER.info('Fulfilling GET request listing tails files on filter %s', ident)
-    return response.json(rv)
+    if not ndjson:
+        LOGGER.info('Fulfilling GET request listing page of tails files on filter %s after %s', ident, after)
+        if len(page) == page_size:
+            headers['Link'] = '<{}?{}>; rel="next"'.format(
+                request.path,
+                urlencode({'after': page[-1], 'limit': page_size}))
+        return response.json(page, headers=headers)
+
+    async def _streaming_fn(resp: StreamingHTTPResponse) -> None:
+        (chunk, remaining) = (page, limit)
+        while chunk:
+            await resp.write(''.join('{}\n'.format(json.dumps(rr_id)) for rr_id in chunk))
+            if remaining is not None:
+                remaining -= len(chunk)
+                if remaining <= 0:
+                    break
+            if len(chunk) < page_size:
+                break
+            chunk = await catalog.rr_ids(ident, chunk[-1], min(remaining or LIST_PAGE_MAX, LIST_PAGE_MAX))
+
+    LOGGER.info('Fulfilling GET request streaming listing of tails files on filter %s after %s', ident, after)
+    return response.stream(_streaming_fn, headers=headers, content_type='application/x-ndjson')
+
+
+@app.get('/tails/archive/<ident:.+>')
+async def get_tails_archive(request: Request, ident: str) -> HTTPResponse:
+    """
+    Get tar archive of tails files by corresponding rev reg ids: all, by rev reg id, by cred def id,
+    or by issuer DID, streaming it without buffering tails file content. Refuse with HTTP status 413
+    a filter matching more rev reg ids than configured maximum.
+
+    :param request: Sanic request structure
+    :param ident: 'all' for no filter; rev reg id, cred def id, or issuer DID to filter by any such identifier
+    :return: HTTP response with tar archive of tails files and links in tails tree layout
+    """
+
+    rr_ids = await (await MEM_CACHE.get('catalog')).rr_ids(ident, None, await archive_max_count() + 1)
+    if rr_ids is None:
+        LOGGER.error('Token %s is not a valid specifier for tails files', ident)
+        return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
+
+    LOGGER.info('Fulfilling GET request for archive of tails files on filter %s', ident)
+    return await _tails_archive(rr_ids)
+
+
+@app.post('/tails/archive')
+async def post_tails_archive(request: Request) -> HTTPResponse:
+    """
+    Get tar archive of tails files for rev reg ids in JSON array request body, streaming it
+    without buffering tails file content. Skip rev reg ids without tails files. Refuse with HTTP status 413
+    a body citing more rev reg ids than configured maximum.
+
+    :param request: Sanic request structure
+    :return: HTTP response with tar archive of tails files and links in tails tree layout
+    """
+
+    try:
+        rr_ids = json.loads(request.body.decode() or '[]')
+    except ValueError:
+        rr_ids = None
+    if not isinstance(rr_ids, list) or not all(isinstance(rr_id, str) and ok_rev_reg_id(rr_id) for rr_id in rr_ids):
+        LOGGER.error('POST for archive of tails files cited body other than JSON array of rev reg ids')
+        return response.text('POST for archive of tails files requires JSON array of rev reg ids', status=400)
+
+    LOGGER.info('Fulfilling POST request for archive of tails files on %s rev reg ids', len(rr_ids))
+    return await _tails_archive(rr_ids)
+
+
+async def _tails_archive(rr_ids: list) -> HTTPResponse:
+    """
+    Return streaming response with tar archive of tails files for rev reg ids, in the layout of the tails tree,
+    or HTTP status 413 for more rev reg ids than configured maximum. Resolve tails files up front, for
+    Content-Length and header 'X-Tails-Count' with the number of rev reg ids in the archive; build tar headers
+    only as the response streams.
+
+    :param rr_ids: rev reg ids
+    :return: HTTP response with tar archive
+    """
+
+    rr_ids = list(dict.fromkeys(rr_ids))
+    max_count = await archive_max_count()
+    if len(rr_ids) > max_count:
+        LOGGER.error('Archive of tails files cited more than maximum %s rev reg ids', max_count)
+        return response.text(
+            'Archive of tails files cited more than maximum {} rev reg ids'.format(max_count),
+            status=413,
+            headers={'X-Tails-Archive-Max': str(max_count)})
+
+    dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+    members = await asyncio.get_event_loop().run_in_executor(None, tar_members, dir_tails, rr_ids)
+
+    return (await MEM_CACHE.get('delivery')).stream(
+        tar_segments(members),
+        headers={
+            'Content-Disposition': 'attachment; filename="tails.tar"',
+            'X-Tails-Count': str(len(members))
+        },
+        content_type='application/x-tar',
+        size=tar_size(members))
 
 
 @app.delete('/tails/<ident:.+>/<epoch:[0-9]+>')
@@ -215,11 +1252,21 @@ async def delete_tails(request: Request, ident: str, epoch: int) -> HTTPResponse
     plain = '{}||{}'.format(epoch, ident)
 
     tsan = await MEM_CACHE.get('tsan')
-    if not tsan.verify(plain, signature, tsan.did):
+    verifier = await MEM_CACHE.get('verifier')
+    try:
+        verified = await verifier.verify(tsan, plain, signature, tsan.did)
+    except VerifyBusy:
+        LOGGER.error('DELETE deferred: verification queue at capacity')
+        return response.text(
+            'DELETE deferred: verification queue at capacity',
+            status=503,
+            headers={'Retry-After': '5'})
+    if not verified:
         LOGGER.error('DELETE signature failed to verify')
         return response.text('DELETE signature failed to verify', status=400)
 
     dir_tails = join(dirname(dirname(realpath(__file__))), 'tails')
+    (await MEM_CACHE.get('stat_cache')).invalidate(ident if ok_rev_reg_id(ident) else None)
 
     if ident == 'all':  # delete everything -- note that 'all' is not valid base58 so no case below can apply
         if isdir(dir_tails):
@@ -231,6 +1278,7 @@ async def delete_tails(request: Request, ident: str, epoch: int) -> HTTPResponse
         if path_tails and isfile(path_tails):
             unlink(path_tails)
             LOGGER.info('Deleted %s', path_tails)
+            remove_variants(path_tails)
         path_link = join(Tails.dir(dir_tails, ident), ident)
         if path_link and islink(path_link):
             unlink(path_link)
@@ -260,5 +1308,6 @@ async def delete_tails(request: Request, ident: str, epoch: int) -> HTTPResponse
         LOGGER.error('Token %s is not a valid specifier for tails files', ident)
         return response.text('Token {} is not a valid specifier for tails files'.format(ident), status=400)
 
+    await (await MEM_CACHE.get('catalog')).remove(ident)
     LOGGER.info('Fulfilled DELETE request deleting tails files on filter %s', ident)
     return response.text('')
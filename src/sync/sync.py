@@ -16,17 +16,26 @@ limitations under the License.
 
 
 import atexit
+import json
 import logging
 import re
+import tarfile
+import zlib
 
 from enum import Enum
-from os import makedirs, sys
-from os.path import basename, isdir, join
+from gzip import GzipFile
+from hashlib import sha256
+from os import O_RDONLY, close, fdopen, fstat, fsync, makedirs, open as os_open, rename, sys, unlink
+from os.path import basename, dirname, getsize, isdir, isfile, join
+from shutil import copyfileobj
+from tempfile import TemporaryFile, mkstemp
 from time import time
 from urllib.parse import quote
+from uuid import uuid4
 
 import requests
-from requests.exceptions import ConnectionError as RequestsConnectionError
+from requests.exceptions import ChunkedEncodingError, ConnectionError as RequestsConnectionError
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
 
 from von_anchor import NominalAnchor
 from von_anchor.error import ExtantWallet
@@ -35,11 +44,18 @@ from von_anchor.indytween import Role
 from von_anchor.nodepool import NodePool, NodePoolManager
 from von_anchor.op import AnchorData, NodePoolData
 from von_anchor.tails import Tails
-from von_anchor.util import ok_rev_reg_id
+from von_anchor.util import ok_cred_def_id, ok_rev_reg_id, rev_reg_id2cred_def_id
 from von_anchor.wallet import WalletManager
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None  # zstd-encoded uploads and downloads unavailable
+
 
 CONFIG = {}
+GENERATION_FILE = '.sync-generation'  # in tails directory: generation of server catalog last synchronized
+ARCHIVE_BATCH = 1000  # rev reg ids per archive request, within server's default archive.max.count
 
 
 class Profile(Enum):
@@ -88,6 +104,17 @@ def usage() -> None:
     print('      - issuer: to upload to the tails file server')
     print('      - prover: to download from the tails file server')
     print('    - tails.dir: the local directory serving as the tails tree')
+    print('    - upload.chunk.mb: (issuer only, default 0) upload tails files larger')
+    print('        than this many MiB in chunks over resumable upload sessions')
+    print('    - upload.encoding: (issuer only, default identity) content encoding')
+    print('        for single-request uploads: identity, gzip, or zstd (requires')
+    print('        zstandard package)')
+    print('    - fsync.policy: (prover only, default batched) when to flush downloaded')
+    print('        tails files to disk before moving them into place: always, for')
+    print('        each file; batched, once per synchronization; or never')
+    print('    - survey.full.sec: (prover only, default 3600) between full surveys of')
+    print('        the tails server, ask it only for changes since the last')
+    print('        synchronization; 0 to survey in full every time')
     print('  * (issuer only) section [Node Pool]:')
     print('    - name: the name of the node pool to which the operation applies')
     print('    - genesis.txn.path: the path to the genesis transaction file')
@@ -103,10 +130,30 @@ def usage() -> None:
     print()
 
 
-def survey(dir_tails: str, host: str, port: int, issuer_did: str = None) -> tuple:
+def sha256_hex(path: str) -> str:
+    """
+    Return hex digest of SHA-256 hash over file content, reading the file in chunks.
+
+    :param path: path to file
+    :return: hex digest
+    """
+
+    rv = sha256()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(65536), b''):
+            rv.update(chunk)
+
+    return rv.hexdigest()
+
+
+def survey(dir_tails: str, host: str, port: int, issuer_did: str = None, etag: str = None) -> tuple:
     """
     Return tuple with paths to local tails symbolic links (revocation registry identifiers) and
-    revocation registry identifiers of interest on tails server.
+    revocation registry identifiers of interest on tails server, with server catalog generation token
+    and entity tag of remote listing.
+
+    Given the entity tag of the remote listing from a previous survey, skip the survey if the server
+    answers that the listing has not changed since (status 304), returning None for local and remote content.
 
     Raise ConnectionError on connection failure.
 
@@ -114,16 +161,291 @@ def survey(dir_tails: str, host: str, port: int, issuer_did: str = None) -> tupl
     :param host: tails server host
     :param port: tails server port
     :param issuer_did: issuer DID of interest for local and remote tails file survey (default all)
-    :return: pair (remote paths to tails links, remote rev reg ids)
+    :param etag: entity tag of remote listing as of previous survey, if any
+    :return: tuple (local paths to tails links, remote rev reg ids, server catalog generation token or None,
+        entity tag of remote listing or None)
     """
 
-    loc = Tails.links(dir_tails, issuer_did)
     url = 'http://{}:{}/tails/list/{}'.format(host, port, issuer_did if issuer_did else 'all')
-    resp = requests.get(url)
-    rem = set(resp.json())
+    headers = {'Accept': 'application/x-ndjson, application/json'}
+    if etag:
+        headers['If-None-Match'] = etag
+    with requests.get(url, headers=headers, stream=True) as resp:
+        generation = resp.headers.get('X-Tails-Generation', None)
+        tag = resp.headers.get('ETag', None)
+        if resp.status_code == 304:
+            logging.debug('Survey: remote listing not modified since %s, generation=%s', etag, generation)
+            return (None, None, generation, tag or etag)
+        if resp.headers.get('Content-Type', '').startswith('application/x-ndjson'):
+            rem = {json.loads(line) for line in resp.iter_lines() if line}
+        else:  # server predates streamed listings
+            rem = set(resp.json())
+
+    loc = Tails.links(dir_tails, issuer_did)
+    logging.debug('Survey: local=%s, remote=%s, generation=%s', ppjson(loc), ppjson(rem), generation)
+    return (loc, rem, generation, tag)
+
+
+def survey_changes(host: str, port: int, since: str) -> tuple:
+    """
+    Return server catalog generation token and rev reg ids added on tails server since input generation,
+    or None if the server cannot list changes since then (or predates listing changes), calling for full survey.
+
+    Raise ConnectionError on connection failure.
+
+    :param host: tails server host
+    :param port: tails server port
+    :param since: server catalog generation token as of last synchronization
+    :return: pair (server catalog generation token, remote rev reg ids added since), or None
+    """
+
+    url = 'http://{}:{}/tails/list/all'.format(host, port)
+    resp = requests.get(url, params={'since': since})
+    if resp.status_code != 200:
+        logging.info('Survey: no changes since generation %s (status %s): surveying in full', since, resp.status_code)
+        return None
+    changes = resp.json()
+    if not isinstance(changes, dict):  # server predates listing changes
+        return None
+
+    logging.debug('Survey: added=%s, removed=%s since %s', ppjson(changes['added']), ppjson(changes['removed']), since)
+    return (changes['generation'], set(changes['added']))
+
+
+def load_generation(dir_tails: str, host: str, port: int) -> dict:
+    """
+    Return state of last prover synchronization against tails server: server catalog generation token,
+    EPOCH time of last full survey, and entity tag of remote listing, or empty dict for none.
+
+    :param dir_tails: local tails directory
+    :param host: tails server host
+    :param port: tails server port
+    :return: dict with 'generation', 'full', and 'etag' entries, or empty dict
+    """
+
+    try:
+        with open(join(dir_tails, GENERATION_FILE), 'r') as fh:
+            return json.load(fh).get('{}:{}'.format(host, port), {})
+    except (OSError, ValueError, AttributeError):
+        return {}
+
+
+def save_generation(dir_tails: str, host: str, port: int, state: dict) -> None:
+    """
+    Save state of prover synchronization against tails server; write to temporary file and rename into place.
+
+    :param dir_tails: local tails directory
+    :param host: tails server host
+    :param port: tails server port
+    :param state: dict with 'generation', 'full', and 'etag' entries
+    """
+
+    path = join(dir_tails, GENERATION_FILE)
+    try:
+        with open(path, 'r') as fh:
+            states = json.load(fh)
+    except (OSError, ValueError):
+        states = {}
+    if not isinstance(states, dict):
+        states = {}
+    states['{}:{}'.format(host, port)] = state
+
+    with open('{}.tmp'.format(path), 'w') as fh:
+        json.dump(states, fh)
+    rename('{}.tmp'.format(path), path)
+
+
+def preflight(host: str, port: int, rr_id: str, path_tails: str) -> bool:
+    """
+    Ask tails server whether it would accept upload of tails file for rev reg id, before sending any content.
+    Proceed if server predates preflight support.
+
+    :param host: tails server host
+    :param port: tails server port
+    :param rr_id: rev reg id
+    :param path_tails: path to local tails file
+    :return: whether to proceed with upload
+    """
+
+    url = 'http://{}:{}/tails/{}/preflight'.format(host, port, quote(rr_id))
+    try:
+        resp = requests.put(url, params={'tails-hash': basename(path_tails), 'size': getsize(path_tails)})
+    except RequestsConnectionError:
+        logging.error('PUT connection refused: %s', url)
+        return False
+
+    if resp.status_code in (requests.codes.not_found, requests.codes.method_not_allowed):  # no preflight endpoint
+        return True
+    if resp.status_code != requests.codes.ok:
+        logging.info('Upload preflight: url %s status %s: %s', url, resp.status_code, resp.text)
+        return False
+
+    return True
+
+
+def encode_upload(tails_fh, encoding: str):
+    """
+    Return temporary file with tails file content compressed as per content encoding, rewound for reading.
+
+    :param tails_fh: tails file, open for binary read
+    :param encoding: content encoding, 'gzip' or 'zstd'
+    :return: temporary file with encoded content
+    """
+
+    rv = TemporaryFile()
+    if encoding == 'gzip':
+        with GzipFile(fileobj=rv, mode='wb') as gz_fh:
+            copyfileobj(tails_fh, gz_fh, 65536)
+    else:
+        zstandard.ZstdCompressor().copy_stream(tails_fh, rv)
+    rv.seek(0)
+
+    return rv
+
+
+class MultipartBody:
+    """
+    Body of multipart/form-data request, for requests to send as it reads: part headers and values in memory,
+    file content from disk as the request goes, so that client memory stays flat however large the file.
+    """
+
+    def __init__(self, fields: dict) -> None:
+        """
+        Initialize body from fields, each mapping name to a tuple in the manner of requests file parts:
+        (file name or None, value as str, bytes, or file open for binary read from its position to its end,
+        content type (optional), dict of further part headers (optional)).
+
+        :param fields: dict mapping field names to tuples as above
+        """
+
+        self._boundary = uuid4().hex
+        self._segments = []
+        for (name, (filename, value, *extra)) in fields.items():
+            head = 'Content-Disposition: form-data; name="{}"{}\r\n'.format(
+                name,
+                '; filename="{}"'.format(filename) if filename else '')
+            if extra and extra[0]:
+                head += 'Content-Type: {}\r\n'.format(extra[0])
+            for (header, header_value) in (extra[1] if len(extra) > 1 else {}).items():
+                head += '{}: {}\r\n'.format(header, header_value)
+            self._segments.append('--{}\r\n{}\r\n'.format(self._boundary, head).encode())
+            self._segments.append(value.encode() if isinstance(value, str) else value)
+            self._segments.append(b'\r\n')
+        self._segments.append('--{}--\r\n'.format(self._boundary).encode())
+
+        self._length = sum(
+            len(s) if isinstance(s, bytes) else fstat(s.fileno()).st_size - s.tell() for s in self._segments)
+        self._index = 0
+        self._offset = 0  # into current bytes segment
+
+    @property
+    def content_type(self) -> str:
+        """
+        Accessor for content type of body, with its boundary.
+
+        :return: content type
+        """
+
+        return 'multipart/form-data; boundary={}'.format(self._boundary)
+
+    def __len__(self) -> int:
+        """
+        Return length of body in bytes, for requests to send as Content-Length.
+
+        :return: body length
+        """
+
+        return self._length
+
+    def read(self, size: int = -1) -> bytes:
+        """
+        Return next body content up to specified size, or empty bytes at end of body.
+
+        :param size: maximum number of bytes to read, or -1 for all the rest
+        :return: body content
+        """
+
+        rv = b''
+        while self._index < len(self._segments) and (size < 0 or len(rv) < size):
+            segment = self._segments[self._index]
+            want = -1 if size < 0 else size - len(rv)
+            if isinstance(segment, bytes):
+                chunk = segment[self._offset:] if want < 0 else segment[self._offset:self._offset + want]
+                self._offset += len(chunk)
+                done = self._offset >= len(segment)
+            else:
+                chunk = segment.read(want)
+                done = not chunk or want < 0
+            rv += chunk
+            if done:
+                (self._index, self._offset) = (self._index + 1, 0)
 
-    logging.debug('Survey: local=%s, remote=%s', ppjson(loc), ppjson(rem))
-    return (loc, rem)
+        return rv
+
+
+async def upload_session(
+        host: str,
+        port: int,
+        rr_id: str,
+        path_tails: str,
+        chunk_size: int,
+        noman: NominalAnchor) -> bool:
+    """
+    Upload tails file in chunks over resumable upload session, opened with signature, resuming from the
+    committed offset of any session already in progress at the server, then finalize session with signature.
+    Raise ConnectionError on connection failure; a later call resumes where this one stopped. If the server
+    refuses to open the session, log the refusal and leave the caller to fall back to a single POST.
+
+    :param host: tails server host
+    :param port: tails server port
+    :param rr_id: rev reg id
+    :param path_tails: path to local tails file
+    :param chunk_size: chunk size in bytes
+    :param noman: open issuer anchor
+    :return: whether upload session handled tails file (false to fall back to single POST, as when server
+        does not support upload sessions or refuses to open one)
+    """
+
+    size = getsize(path_tails)
+    url = 'http://{}:{}/tails/session/{}'.format(host, port, quote(rr_id))
+    epoch = int(time())
+    sig = await noman.sign('{}||{}||{}||{}'.format(epoch, rr_id, basename(path_tails), size).encode())
+    resp = requests.post(url, params={'tails-hash': basename(path_tails), 'size': size, 'epoch': epoch}, data=sig)
+    if resp.status_code in (requests.codes.not_found, requests.codes.method_not_allowed):
+        return False
+    if resp.status_code != requests.codes.ok:
+        logging.error('Upload session refused: url %s status %s: %s', url, resp.status_code, resp.text)
+        return False
+
+    url_session = 'http://{}:{}/tails/session/{}'.format(host, port, resp.json()['id'])
+    offset = resp.json()['offset']
+    if offset:
+        logging.info('Upload session: resuming %s at offset %s of %s', rr_id, offset, size)
+
+    with open(path_tails, 'rb') as tails_fh:
+        while offset < size:
+            tails_fh.seek(offset)
+            chunk = tails_fh.read(chunk_size)
+            resp = requests.put(
+                url_session,
+                data=chunk,
+                headers={'Content-Range': 'bytes {}-{}/{}'.format(offset, offset + len(chunk) - 1, size)})
+            if resp.status_code not in (requests.codes.ok, requests.codes.conflict):
+                logging.info('Upload session: url %s status %s: %s', url_session, resp.status_code, resp.text)
+                return True
+            committed = resp.json()['offset']
+            if resp.status_code == requests.codes.conflict and committed == offset:  # in use by another upload
+                logging.info('Upload session: url %s in use, offset %s', url_session, offset)
+                return True
+            offset = committed
+
+    epoch = int(time())
+    url_final = '{}/{}'.format(url_session, epoch)
+    sig = await noman.sign('{}||{}||{}'.format(epoch, rr_id, sha256_hex(path_tails)).encode())
+    resp = requests.post(url_final, data=sig)
+    logging.info('Upload: url %s status %s', url_final, resp.status_code)
+
+    return True
 
 
 async def sync_issuer(
@@ -131,15 +453,24 @@ async def sync_issuer(
         host: str,
         port: int,
         local_only: set,
-        noman: NominalAnchor) -> None:
+        noman: NominalAnchor,
+        chunk_size: int = 0,
+        encoding: str = 'identity') -> None:
     """
-    Synchronize for issuer: upload any tails files appearing locally but not remotely.
+    Synchronize for issuer: upload any tails files appearing locally but not remotely, signing
+    each upload over epoch, rev reg id, and SHA-256 digest of tails file content (upload protocol version 2).
+    Upload any tails file larger than chunk size over a resumable upload session, if server supports it
+    and opens one; otherwise, upload it in a single request, compressed as per content encoding and streamed from disk
+    so that client memory stays flat whatever the tails file size. The signature covers
+    the digest of uncompressed content in any case.
 
     :param dir_tails: local tails directory
     :param host: tails server host
     :param port: tails server port
     :param local_only: paths to local tails symbolic links (rev reg ids) without corresponding remote tails files
     :param noman: open issuer anchor
+    :param chunk_size: upload session chunk size in bytes (0 for no upload sessions)
+    :param encoding: content encoding for single-request uploads: 'identity', 'gzip', or 'zstd'
     """
 
     logging.debug('Sync-issuer: local-only=%s', ppjson(local_only))
@@ -155,61 +486,360 @@ async def sync_issuer(
                 noman.wallet.name)
             continue
 
+        path_tails = Tails.linked(dir_tails, rr_id)
+        if chunk_size and getsize(path_tails) > chunk_size:
+            try:
+                if await upload_session(host, port, rr_id, path_tails, chunk_size, noman):
+                    continue
+            except RequestsConnectionError:
+                logging.error('Upload session connection refused or dropped: %s', rr_id)
+                continue
+
+        if not preflight(host, port, rr_id, path_tails):
+            continue
+
         epoch = int(time())
         url = 'http://{}:{}/tails/{}/{}'.format(host, port, quote(rr_id), epoch)
-        path_tails = Tails.linked(dir_tails, rr_id)
-        with open(path_tails, 'rb') as tails_fh:
-            tails = tails_fh.read()
-            sig = await noman.sign('{}||{}'.format(epoch, tails))
+        sig = await noman.sign('{}||{}||{}'.format(epoch, rr_id, sha256_hex(path_tails)).encode())
         try:
-            resp = requests.post(
-                url,
-                files={
-                    'tails-file': (basename(path_tails), tails),
-                    'signature': ('signature', sig)
-                })
+            with open(path_tails, 'rb') as tails_fh:
+                upload_fh = tails_fh if encoding == 'identity' else encode_upload(tails_fh, encoding)
+                with upload_fh:
+                    body = MultipartBody({
+                        'tails-file': (
+                            basename(path_tails),
+                            upload_fh,
+                            'application/octet-stream',
+                            {} if encoding == 'identity' else {'Content-Encoding': encoding}),
+                        'signature': ('signature', sig),
+                        'version': (None, '2')
+                    })
+                    resp = requests.post(url, data=body, headers={'Content-Type': body.content_type})
             logging.info('Upload: url %s status %s', url, resp.status_code)
         except RequestsConnectionError:
             logging.error('POST connection refused: %s', url)
 
 
-async def sync_prover(dir_tails: str, host: str, port: int, remote_only: set) -> None:
+def fsync_path(path: str) -> None:
+    """
+    Flush file or directory at input path to stable storage.
+
+    :param path: path to file or directory
+    """
+
+    fd = os_open(path, O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        close(fd)
+
+
+def head_tails(url: str) -> tuple:
+    """
+    Return tails hash and size of tails file at URL, from its headers alone. Return None if server
+    has no such tails file or predates HEAD support. Raise ConnectionError on connection failure.
+
+    :param url: tails file URL
+    :return: pair (tails hash, size in bytes), or None
+    """
+
+    resp = requests.head(url, headers={'Accept-Encoding': 'identity'})
+    if resp.status_code != requests.codes.ok:
+        return None
+
+    re_tails_hash = re.search('filename="(.+)"', resp.headers.get('content-disposition', ''))
+    if not re_tails_hash or not resp.headers.get('content-length', '').isdigit():
+        return None
+
+    return (re_tails_hash.group(1), int(resp.headers['content-length']))
+
+
+def download_decoder(encoding: str):
+    """
+    Return streaming decoder for content encoding of download, or None for identity.
+
+    :param encoding: content encoding: 'identity', 'gzip', or 'zstd'
+    :return: decompression object with decompress() method
+    """
+
+    if encoding == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def download_tails(url: str, dir_cd_id: str, attempts: int = 3, size: int = None) -> tuple:
+    """
+    Download tails file to temporary file in its target directory. If the transfer drops, resume it
+    with a range request for the remainder, up to the specified number of attempts in all.
+    Raise ConnectionError if the last attempt fails to connect or drops.
+
+    Accept a precompressed variant (zstd if the zstandard package is present, or gzip) in the first
+    request, decoding it while writing to disk; the server serves any range request as is.
+
+    Make any range request conditional (If-Range) on the entity tag of the tails file as is, so that
+    the server sends the whole file again if it has changed since; append only a range that starts at the
+    offset so far and belongs to a file of the expected size, otherwise truncate and start over.
+
+    :param url: tails file URL
+    :param dir_cd_id: target directory for tails file
+    :param attempts: maximum number of requests
+    :param size: tails file size in bytes, if known in advance
+    :return: pair (temporary path, tails hash), or None if server has no such tails file
+    """
+
+    (fd, path_tmp) = mkstemp(dir=dir_cd_id, prefix='.', suffix='.part')
+    tails_hash = None
+    validator = None  # entity tag of tails file as is, for If-Range
+    try:
+        with fdopen(fd, 'wb') as fh_tails:
+            for attempt in range(1, attempts + 1):
+                offset = fh_tails.tell()
+                try:
+                    if offset:
+                        headers = {'Range': 'bytes={}-'.format(offset)}
+                        if validator:
+                            headers['If-Range'] = validator
+                    else:
+                        headers = {'Accept-Encoding': 'zstd, gzip' if zstandard else 'gzip'}
+                    resp = requests.get(url, stream=True, headers=headers)
+                    if resp.status_code == requests.codes.ok:
+                        fh_tails.seek(0)
+                        fh_tails.truncate()
+                    elif resp.status_code == requests.codes.partial_content:
+                        re_range = re.match(
+                            r'bytes ([0-9]+)-[0-9]+/([0-9]+)$',
+                            resp.headers.get('content-range', '').strip())
+                        if not re_range or int(re_range.group(1)) != offset or (
+                                size is not None and int(re_range.group(2)) != size):
+                            resp.close()
+                            fh_tails.seek(0)
+                            fh_tails.truncate()
+                            raise ChunkedEncodingError('Response range {} does not resume at offset {} of {}'.format(
+                                resp.headers.get('content-range', None),
+                                offset,
+                                size))
+                        size = int(re_range.group(2))
+                    else:
+                        logging.error('Download: url %s, responded with status %s', url, resp.status_code)
+                        tails_hash = None
+                        break
+
+                    re_tails_hash = re.search('filename="(.+)"', resp.headers.get('content-disposition', ''))
+                    tails_hash = tails_hash or (re_tails_hash.group(1) if re_tails_hash else None)
+                    if not tails_hash:
+                        logging.error('Download: url %s, responded with no tails-hash', url)
+                        break
+
+                    encoding = resp.headers.get('content-encoding', 'identity').strip().lower()
+                    if encoding not in ('identity', 'gzip', 'zstd') or (encoding == 'zstd' and not zstandard):
+                        logging.error('Download: url %s, responded with unsupported encoding %s', url, encoding)
+                        tails_hash = None
+                        break
+                    if encoding == 'identity':
+                        validator = resp.headers.get('etag', None)
+                        if resp.status_code == requests.codes.ok and resp.headers.get('content-length', '').isdigit():
+                            size = int(resp.headers['content-length'])
+                    else:  # server tags variant apart from tails file as is, which it tags with tails hash
+                        validator = '"{}"'.format(tails_hash)
+
+                    decoder = download_decoder(encoding)
+                    (received, expected) = (0, int(resp.headers.get('content-length', 0)))
+                    try:
+                        for chunk in resp.raw.stream(65536, decode_content=False):
+                            received += len(chunk)
+                            fh_tails.write(decoder.decompress(chunk) if decoder else chunk)
+                    except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as x_decode:
+                        logging.error('Download: url %s, responded with bad %s content: %s', url, encoding, x_decode)
+                        tails_hash = None
+                        break
+                    if received < expected or not getattr(decoder, 'eof', True):
+                        raise ChunkedEncodingError('Response ended at {} of {} bytes'.format(received, expected))
+                    break
+                except (RequestsConnectionError, ChunkedEncodingError, ProtocolError, ReadTimeoutError) as x_conn:
+                    if attempt == attempts:
+                        raise RequestsConnectionError(x_conn)
+                    logging.warning('Download: url %s dropped at offset %s, resuming: %s', url, fh_tails.tell(), x_conn)
+    except BaseException:
+        unlink(path_tmp)
+        raise
+
+    if not tails_hash:
+        unlink(path_tmp)
+        return None
+
+    return (path_tmp, tails_hash)
+
+
+def download_archive(url: str, dir_tails: str, rr_ids: list) -> tuple:
+    """
+    Download tar archive of tails files for rev reg ids, unpacking each tails file as it streams in
+    to a temporary file in its target directory. Skip content of tails files already present locally.
+    Return None if the server does not serve archives. If the transfer fails part way, keep the tails files
+    already complete, for the caller to download the rest one by one.
+
+    :param url: tails archive URL
+    :param dir_tails: local tails directory
+    :param rr_ids: rev reg ids of tails files to download
+    :return: pair (list of (temporary path, rev reg id, tails hash) per downloaded tails file,
+        list of (rev reg id, tails hash) per rev reg id to link to tails file present or downloaded), or None
+    """
+
+    resp = requests.post(url, json=rr_ids, stream=True, headers={'Accept-Encoding': 'identity'})
+    if resp.status_code != requests.codes.ok:
+        logging.info('Archive: url %s, responded with status %s', url, resp.status_code)
+        return None
+
+    wanted = set(rr_ids)
+    downloads = []
+    links = []
+    staged = {}  # (cred def id, tails hash) -> temporary path, or None once claimed by a download
+    try:
+        with tarfile.open(fileobj=resp.raw, mode='r|') as tar:
+            for member in tar:
+                (cd_id, _, name) = member.name.partition('/')
+                if not ok_cred_def_id(cd_id) or '/' in name:
+                    logging.warning('Archive: url %s, skipping unexpected member %s', url, member.name)
+                    continue
+                dir_cd_id = join(dir_tails, cd_id)
+
+                if member.isfile() and Tails.ok_hash(name):
+                    if isfile(join(dir_cd_id, name)) or (cd_id, name) in staged:
+                        continue  # tar stream skips content
+                    makedirs(dir_cd_id, exist_ok=True)
+                    (fd, path_tmp) = mkstemp(dir=dir_cd_id, prefix='.', suffix='.part')
+                    staged[(cd_id, name)] = path_tmp
+                    with fdopen(fd, 'wb') as fh_tails:
+                        copyfileobj(tar.extractfile(member), fh_tails, 65536)
+                        complete = fh_tails.tell() == member.size
+                    if not complete:
+                        raise tarfile.ReadError('Member {} ended short of {} bytes'.format(member.name, member.size))
+
+                elif member.issym() and name in wanted and rev_reg_id2cred_def_id(name) == cd_id and (
+                        Tails.ok_hash(member.linkname)):
+                    tails_hash = member.linkname
+                    if staged.get((cd_id, tails_hash), None):
+                        downloads.append((staged[(cd_id, tails_hash)], name, tails_hash))
+                        staged[(cd_id, tails_hash)] = None
+                    elif (cd_id, tails_hash) in staged or isfile(join(dir_cd_id, tails_hash)):  # claimed or local
+                        links.append((name, tails_hash))
+
+                else:
+                    logging.warning('Archive: url %s, skipping unexpected member %s', url, member.name)
+    except (tarfile.TarError, RequestsConnectionError, ProtocolError, ReadTimeoutError) as x_archive:
+        logging.warning('Archive: url %s dropped after %s tails files: %s', url, len(downloads), x_archive)
+    finally:
+        for path_tmp in staged.values():
+            if path_tmp and isfile(path_tmp):  # never claimed or incomplete
+                unlink(path_tmp)
+
+    return (downloads, links)
+
+
+def publish_downloads(dir_tails: str, downloads: list, flush: bool) -> None:
+    """
+    Move complete downloaded tails files into place and link their rev reg ids, flushing files
+    beforehand and their directories afterward if so specified.
+
+    :param dir_tails: local tails directory
+    :param downloads: list of (temporary path, rev reg id, tails hash) per downloaded tails file
+    :param flush: whether to flush files and directories to stable storage
+    """
+
+    if flush:
+        for (path_tmp, _, _) in downloads:
+            fsync_path(path_tmp)
+
+    for (path_tmp, rr_id, tails_hash) in downloads:
+        rename(path_tmp, join(dirname(path_tmp), tails_hash))
+        Tails.associate(dir_tails, rr_id, tails_hash)
+
+    if flush:
+        for dir_cd_id in {dirname(path_tmp) for (path_tmp, _, _) in downloads}:
+            fsync_path(dir_cd_id)
+
+
+async def sync_prover(
+        dir_tails: str,
+        host: str,
+        port: int,
+        remote_only: set,
+        fsync_policy: str = 'batched') -> None:
     """
     Synchronize for prover: download any tails files appearing remotely but not locally.
 
+    Download several tails files at once as a single tar archive, unpacking it into the tails directory
+    as it streams in, then download any that the archive missed one by one. Download each tails file
+    to a temporary file in its target directory, then rename it into place
+    and link it, so that an interrupted download cannot leave a truncated tails file behind.
+    Flush tails files to stable storage before moving them into place as per fsync policy:
+    'always' for each file, 'batched' once per synchronization, or 'never'.
+
     :param dir_tails: local tails directory
     :param host: tails server host
     :param port: tails server port
     :param remote_only: paths to remote rev reg ids without corresponding local tails files
+    :param fsync_policy: fsync policy: 'always', 'batched', or 'never'
     """
 
     if not remote_only:
         return
 
-    for rr_id in remote_only:
-        dir_cd_id = Tails.dir(dir_tails, rr_id)
-        makedirs(dir_cd_id, exist_ok=True)
-        url = 'http://{}:{}/tails/{}'.format(host, port, rr_id)
-        try:
-            resp = requests.get(url, stream=True)
-            if resp.status_code == requests.codes.ok:
-                re_tails_hash = re.search('filename="(.+)"', resp.headers['content-disposition'])
-                tails_hash = re_tails_hash.group(1) if re_tails_hash.lastindex > 0 else None
-
-                if tails_hash:
+    batch = []
+    links = []
+    remaining = set(remote_only)
+    try:
+        if len(remote_only) > 1:
+            url = 'http://{}:{}/tails/archive'.format(host, port)
+            wanted = sorted(remote_only)
+            for start in range(0, len(wanted), ARCHIVE_BATCH):
+                try:
+                    archive = download_archive(url, dir_tails, wanted[start:start + ARCHIVE_BATCH])
+                except RequestsConnectionError:
+                    logging.error('POST connection refused: %s', url)
+                    archive = None
+                if not archive:
+                    break
+                (downloads, archive_links) = archive
+                logging.info(
+                    'Downloaded: url %s, %s tails files, %s further links',
+                    url,
+                    len(downloads),
+                    len(archive_links))
+                if fsync_policy == 'batched':
+                    batch.extend(downloads)
+                elif downloads:
+                    publish_downloads(dir_tails, downloads, fsync_policy == 'always')
+                links.extend(archive_links)
+                remaining -= {rr_id for (_, rr_id, _) in downloads} | {rr_id for (rr_id, _) in archive_links}
+
+        for rr_id in remaining:
+            dir_cd_id = Tails.dir(dir_tails, rr_id)
+            makedirs(dir_cd_id, exist_ok=True)
+            url = 'http://{}:{}/tails/{}'.format(host, port, rr_id)
+            try:
+                held = head_tails(url)
+                if held and isfile(join(dir_cd_id, held[0])) and getsize(join(dir_cd_id, held[0])) == held[1]:
+                    logging.info('Tails file %s already present for %s: linking', held[0], rr_id)
+                    Tails.associate(dir_tails, rr_id, held[0])
+                    continue
+
+                download = download_tails(url, dir_cd_id, size=held[1] if held else None)
+                if download:
+                    (path_tmp, tails_hash) = download
                     logging.info('Downloaded: url %s tails-hash %s', url, tails_hash)
-                    with open(join(dir_cd_id, tails_hash), 'wb') as fh_tails:
-                        for chunk in resp.iter_content(chunk_size=1024):
-                            if chunk:
-                                fh_tails.write(chunk)
-                    Tails.associate(dir_tails, rr_id, tails_hash)
-                else:
-                    logging.error('Download: url %s, responded with no tails-hash', url)
-
-            else:
-                logging.error('Download: url %s, responded with status %s', url, resp.status_code)
-        except RequestsConnectionError:
-            logging.error('GET connection refused: %s', url)
+                    if fsync_policy == 'batched':
+                        batch.append((path_tmp, rr_id, tails_hash))
+                    else:
+                        publish_downloads(dir_tails, [(path_tmp, rr_id, tails_hash)], fsync_policy == 'always')
+            except RequestsConnectionError:
+                logging.error('GET connection refused: %s', url)
+    finally:
+        if batch:
+            publish_downloads(dir_tails, batch, True)
+        for (rr_id, tails_hash) in links:  # once any tails files to which they link are in place
+            Tails.associate(dir_tails, rr_id, tails_hash)
 
 
 async def setup(ini_path: str) -> tuple:
@@ -306,6 +936,25 @@ def close_anchor(anchor: NominalAnchor) -> None:
     do_wait(anchor.close())
 
 
+def upload_encoding() -> str:
+    """
+    Return content encoding for single-request uploads as per configuration (default identity),
+    falling back to identity for any encoding unavailable.
+
+    :return: content encoding: 'identity', 'gzip', or 'zstd'
+    """
+
+    rv = (CONFIG['Tails Client'].get('upload.encoding', 'identity') or 'identity').lower()
+    if rv not in ('identity', 'gzip', 'zstd'):
+        logging.warning('Unsupported upload encoding %s: uploading uncompressed', rv)
+        return 'identity'
+    if rv == 'zstd' and not zstandard:
+        logging.warning('Upload encoding zstd requires zstandard package: uploading uncompressed')
+        return 'identity'
+
+    return rv
+
+
 async def main(profile: Profile, noman: NominalAnchor) -> None:
     """
     Survey local and remote content, dispatch to synchronize issuer or prover.
@@ -324,16 +973,44 @@ async def main(profile: Profile, noman: NominalAnchor) -> None:
         port = int(port)
         try:
             if profile == Profile.ISSUER:
-                (paths_local, tails_remote) = survey(dir_tails, host, port, noman.did)
+                (paths_local, tails_remote, _, _) = survey(dir_tails, host, port, noman.did)
                 await sync_issuer(
                     dir_tails,
                     host,
                     port,
                     set(basename(p) for p in paths_local) - tails_remote,
-                    noman)
+                    noman,
+                    int(CONFIG['Tails Client'].get('upload.chunk.mb', '0') or 0) * 1024 * 1024,
+                    upload_encoding())
             else:
-                (paths_local, tails_remote) = survey(dir_tails, host, port)
-                await sync_prover(dir_tails, host, port, tails_remote - set(basename(p) for p in paths_local))
+                state = load_generation(dir_tails, host, port)
+                changes = None
+                if state.get('generation') and time() - state.get('full', 0) < int(
+                        CONFIG['Tails Client'].get('survey.full.sec', '3600') or 0):
+                    changes = survey_changes(host, port, state['generation'])
+                if changes:
+                    (generation, tails_remote) = changes
+                    remote_only = {rr_id for rr_id in tails_remote if not Tails.linked(dir_tails, rr_id)}
+                    (full, tag) = (state['full'], state.get('etag', None))  # server vets tag on next full survey
+                else:
+                    (paths_local, tails_remote, generation, tag) = survey(
+                        dir_tails,
+                        host,
+                        port,
+                        etag=state.get('etag', None))
+                    if tails_remote is None:  # remote listing unchanged since last complete synchronization
+                        remote_only = set()
+                    else:
+                        remote_only = tails_remote - set(basename(p) for p in paths_local)
+                    full = time()
+                await sync_prover(
+                    dir_tails,
+                    host,
+                    port,
+                    remote_only,
+                    (CONFIG['Tails Client'].get('fsync.policy', 'batched') or 'batched').lower())
+                if generation and all(Tails.linked(dir_tails, rr_id) for rr_id in remote_only):
+                    save_generation(dir_tails, host, port, {'generation': generation, 'full': full, 'etag': tag})
         except RequestsConnectionError:
             logging.error('Could not connect to tails server at %s:%s - connection refused', host, port)
     else:
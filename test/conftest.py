@@ -17,11 +17,14 @@ limitations under the License.
 import asyncio
 import json
 import logging
+import sys
 
 from os import environ
+from os.path import abspath, dirname, join
 from pathlib import Path
 from shutil import rmtree
 from tempfile import gettempdir
+from types import ModuleType
 
 import pytest
 
@@ -35,6 +38,16 @@ logging.getLogger('indy').setLevel(logging.ERROR)
 logging.getLogger('urllib3').setLevel(logging.ERROR)
 logging.getLogger('requests').setLevel(logging.ERROR)
 
+# unit tests import tails client and server modules from source tree
+DIR_SRC = join(dirname(dirname(abspath(__file__))), 'src')
+if DIR_SRC not in sys.path:
+    sys.path.insert(0, DIR_SRC)
+
+# importing app package boots the tails server: unit tests import its modules without running app/__init__.py
+if 'app' not in sys.modules:
+    sys.modules['app'] = ModuleType('app')
+    sys.modules['app'].__path__ = [join(DIR_SRC, 'app')]
+
 
 @pytest.fixture(scope='session')
 def event_loop():
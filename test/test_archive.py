@@ -0,0 +1,117 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import io
+import tarfile
+
+from hashlib import sha256
+from os import makedirs, urandom
+from os.path import join
+
+from base58 import b58encode
+from von_anchor.tails import Tails
+
+from app.archive import COALESCE, tar_members, tar_segments, tar_size
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+CD_ID = '{}:3:CL:20:tag'.format(DID)
+
+
+def rr_id_for(tag, cd_id=CD_ID):
+    return '{}:4:{}:CL_ACCUM:{}'.format(DID, cd_id, tag)
+
+
+def tails_file(dir_tails, rr_ids, size, cd_id=CD_ID):
+    content = urandom(size)
+    tails_hash = b58encode(sha256(content).digest()).decode()
+    makedirs(join(dir_tails, cd_id), exist_ok=True)
+    with open(join(dir_tails, cd_id, tails_hash), 'wb') as fh:
+        fh.write(content)
+    for rr_id in rr_ids:
+        Tails.associate(dir_tails, rr_id, tails_hash)
+    return (tails_hash, content)
+
+
+def archive(members):
+    rv = bytearray()
+    for segment in tar_segments(members):
+        if isinstance(segment, tuple):
+            (path, offset, count) = segment
+            with open(path, 'rb') as fh:
+                fh.seek(offset)
+                rv += fh.read(count)
+        else:
+            rv += segment
+    return bytes(rv)
+
+
+def test_archive(tmpdir):
+    dir_tails = str(tmpdir)
+    cd_id_long = '{}:3:CL:20:{}'.format(DID, 'x' * 120)  # member names need pax headers
+    (hash_a, content_a) = tails_file(dir_tails, [rr_id_for('0'), rr_id_for('1')], 1000)
+    (hash_b, content_b) = tails_file(dir_tails, [rr_id_for('2', cd_id_long)], 1024, cd_id_long)
+    (hash_c, content_c) = tails_file(dir_tails, [], 0)
+    Tails.associate(dir_tails, rr_id_for('3'), hash_c)
+
+    rr_ids = [rr_id_for('0'), rr_id_for('absent'), rr_id_for('2', cd_id_long), rr_id_for('1'), rr_id_for('3')]
+    members = tar_members(dir_tails, rr_ids)
+    assert [m.rr_id for m in members] == [rr_id_for('0'), rr_id_for('2', cd_id_long), rr_id_for('1'), rr_id_for('3')]
+    assert [m.content for m in members] == [True, True, False, True]
+
+    content = archive(members)
+    assert len(content) == tar_size(members)
+
+    with tarfile.open(fileobj=io.BytesIO(content)) as tar:
+        files = {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+        links = {m.name: m.linkname for m in tar.getmembers() if m.issym()}
+    assert files == {
+        '{}/{}'.format(CD_ID, hash_a): content_a,
+        '{}/{}'.format(cd_id_long, hash_b): content_b,
+        '{}/{}'.format(CD_ID, hash_c): content_c
+    }
+    assert links == {
+        '{}/{}'.format(CD_ID, rr_id_for('0')): hash_a,
+        '{}/{}'.format(CD_ID, rr_id_for('1')): hash_a,
+        '{}/{}'.format(cd_id_long, rr_id_for('2', cd_id_long)): hash_b,
+        '{}/{}'.format(CD_ID, rr_id_for('3')): hash_c
+    }
+
+
+def test_archive_coalesce(tmpdir):
+    dir_tails = str(tmpdir)
+    rr_ids = [rr_id_for(str(i)) for i in range(500)]
+    tails_file(dir_tails, rr_ids, 100)
+
+    members = tar_members(dir_tails, rr_ids)
+    segments = list(tar_segments(members))
+    headers = [s for s in segments if not isinstance(s, tuple)]
+    assert 2 < len(headers) < len(members) / 10  # gathered, but not all at once
+    assert all(len(s) < 2 * COALESCE for s in headers)
+    assert len(archive(members)) == tar_size(members)
+
+    with tarfile.open(fileobj=io.BytesIO(archive(members))) as tar:
+        assert sorted(m.name.split('/')[1] for m in tar.getmembers() if m.issym()) == sorted(rr_ids)
+
+
+def test_archive_empty(tmpdir):
+    assert tar_members(str(tmpdir), [rr_id_for('0')]) == []
+    content = archive([])
+    assert len(content) == tar_size([]) and not content.strip(b'\x00')
+    with tarfile.open(fileobj=io.BytesIO(content)) as tar:
+        assert tar.getmembers() == []
@@ -0,0 +1,181 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import json
+import pytest
+
+from os import makedirs, unlink
+from os.path import join
+
+from von_anchor.tails import Tails
+
+from app.catalog import Catalog, StaleGeneration
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+DID_OTHER = 'Q4zqM7aXqm7gDQkUVLng9h'
+HASH = '1' * 44
+
+
+def cd_id_for(did, tag='tag'):
+    return '{}:3:CL:20:{}'.format(did, tag)
+
+
+def rr_id_for(did, tag, cd_tag='tag'):
+    return '{}:4:{}:CL_ACCUM:{}'.format(did, cd_id_for(did, cd_tag), tag)
+
+
+def tails_tree(dir_tails, rr_ids):
+    for rr_id in rr_ids:
+        cd_id = rr_id.split(':4:')[1].rsplit(':CL_ACCUM:')[0]
+        makedirs(join(dir_tails, cd_id), exist_ok=True)
+        with open(join(dir_tails, cd_id, HASH), 'wb') as fh:
+            fh.write(b'tails')
+        Tails.associate(dir_tails, rr_id, HASH)
+
+
+async def catalog(tmpdir, **kwargs):
+    rv = Catalog(join(str(tmpdir), 'catalog.db'), join(str(tmpdir), 'tails'), 2, **kwargs)
+    await rv.open()
+    return rv
+
+
+@pytest.mark.asyncio
+async def test_catalog_build(tmpdir):
+    rr_ids = sorted([rr_id_for(DID, '0'), rr_id_for(DID, '1'), rr_id_for(DID, '0', 'other'), rr_id_for(DID_OTHER, '0')])
+    tails_tree(join(str(tmpdir), 'tails'), rr_ids)
+
+    cat = await catalog(tmpdir)
+    try:
+        assert await cat.rr_ids('all') == rr_ids
+        assert await cat.rr_ids(DID) == [r for r in rr_ids if r.startswith(DID)]
+        assert await cat.rr_ids(cd_id_for(DID)) == sorted([rr_id_for(DID, '0'), rr_id_for(DID, '1')])
+        assert await cat.rr_ids(rr_id_for(DID, '1')) == [rr_id_for(DID, '1')]
+        assert await cat.rr_ids('all', rr_ids[0], 2) == rr_ids[1:3]
+        assert await cat.rr_ids('bogus') is None
+        assert json.loads((await cat.listing('all')).decode()) == rr_ids
+        assert await cat.listing('bogus') is None
+
+        unlink(join(str(tmpdir), 'tails', cd_id_for(DID_OTHER), rr_id_for(DID_OTHER, '0')))
+        since = await cat.generation()
+        assert await cat.build() == 3
+        generation = await cat.generation()
+        assert await cat.changes('all', since) == {
+            'generation': generation,
+            'added': [],
+            'removed': [rr_id_for(DID_OTHER, '0')]
+        }
+    finally:
+        cat.close()
+
+    cat = await catalog(tmpdir)  # reopen from database, without rebuild
+    try:
+        assert await cat.generation() == generation
+        assert len(await cat.rr_ids('all')) == 3
+    finally:
+        cat.close()
+
+
+@pytest.mark.asyncio
+async def test_catalog_add_remove(tmpdir):
+    cat = await catalog(tmpdir)
+    try:
+        gen0 = await cat.generation()
+        tag_did = await cat.tag(DID)
+        tag_other = await cat.tag(DID_OTHER)
+        assert await cat.listing('all') == b'[]'
+
+        await cat.add(rr_id_for(DID, '0'), HASH, 100)
+        await cat.add(rr_id_for(DID, '1'), HASH, 100)
+        gen2 = await cat.generation()
+        assert int(gen2.split('.')[1]) == int(gen0.split('.')[1]) + 2
+        assert json.loads((await cat.listing(DID)).decode()) == [rr_id_for(DID, '0'), rr_id_for(DID, '1')]
+        assert await cat.tag(DID) == gen2 != tag_did
+        assert await cat.tag(DID_OTHER) == tag_other
+        assert await cat.tag('all') == gen2
+        assert await cat.tag('bogus') is None
+
+        await cat.add(rr_id_for(DID_OTHER, '0'), HASH, 100)
+        await cat.remove(rr_id_for(DID, '0'))
+        assert await cat.tag(DID_OTHER) != tag_other
+        assert await cat.changes(DID, gen2) == {
+            'generation': await cat.generation(),
+            'added': [],
+            'removed': [rr_id_for(DID, '0')]
+        }
+        assert await cat.changes('all', gen0) == {
+            'generation': await cat.generation(),
+            'added': [rr_id_for(DID, '1'), rr_id_for(DID_OTHER, '0')],
+            'removed': [rr_id_for(DID, '0')]  # as per latest change
+        }
+        assert await cat.changes('bogus', gen0) is None
+
+        await cat.remove('all')
+        assert await cat.rr_ids('all') == []
+        assert (await cat.changes('all', gen2))['removed'] == [
+            rr_id_for(DID, '0'),
+            rr_id_for(DID, '1'),
+            rr_id_for(DID_OTHER, '0')]
+    finally:
+        cat.close()
+
+
+@pytest.mark.asyncio
+async def test_catalog_changes_floor(tmpdir):
+    cat = await catalog(tmpdir, history=10)
+    try:
+        gen0 = await cat.generation()
+        for i in range(11):
+            await cat.add(rr_id_for(DID, str(i)), HASH, 100)
+        assert len((await cat.changes('all', gen0))['added']) == 11  # within slack of retention
+
+        gen11 = await cat.generation()
+        await cat.add(rr_id_for(DID, '11'), HASH, 100)  # prune to latest 10
+        with pytest.raises(StaleGeneration):
+            await cat.changes('all', gen0)
+        assert (await cat.changes('all', gen11))['added'] == [rr_id_for(DID, '11')]
+
+        (cat_id, _, generation) = gen11.partition('.')
+        assert (await cat.changes('all', '{}.{}'.format(cat_id, int(generation) - 9)))['added']
+        for since in (
+                '{}.{}'.format(cat_id, int(generation) - 10),  # below floor: history pruned
+                '{}.{}'.format(cat_id, int(generation) + 2),  # ahead of catalog
+                'abcdef.{}'.format(generation),  # another catalog
+                cat_id,
+                None):
+            with pytest.raises(StaleGeneration):
+                await cat.changes('all', since)
+    finally:
+        cat.close()
+
+
+@pytest.mark.asyncio
+async def test_catalog_shared(tmpdir):
+    (cat_a, cat_b) = (await catalog(tmpdir), await catalog(tmpdir))
+    try:
+        assert await cat_a.generation() == await cat_b.generation()
+        assert await cat_b.listing('all') == b'[]'
+
+        await cat_a.add(rr_id_for(DID, '0'), HASH, 100)
+        await cat_b.add(rr_id_for(DID, '1'), HASH, 100)
+        assert await cat_a.generation() == await cat_b.generation()
+        assert json.loads((await cat_b.listing('all')).decode()) == [rr_id_for(DID, '0'), rr_id_for(DID, '1')]
+        assert await cat_a.tag(DID) == await cat_b.tag(DID)
+    finally:
+        cat_a.close()
+        cat_b.close()
@@ -0,0 +1,70 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import pytest
+
+from app.conditional import etag, http_date, is_not_modified, is_range_current
+
+
+TAG = etag('H')
+MTIME = 1577836800.75  # 2020-01-01T00:00:00.75Z
+
+
+def test_etag():
+    assert TAG == '"H"'
+    assert etag('H', 'gzip') == '"H-gzip"'
+    assert http_date(MTIME) == 'Wed, 01 Jan 2020 00:00:00 GMT'
+
+
+@pytest.mark.parametrize('headers,expect', [
+    ({}, False),
+    ({'if-none-match': '"H"'}, True),
+    ({'if-none-match': 'W/"H"'}, True),
+    ({'if-none-match': '"X", "H"'}, True),
+    ({'if-none-match': '*'}, True),
+    ({'if-none-match': '"H-gzip"'}, False),
+    ({'if-none-match': '"X"'}, False),
+    ({'if-modified-since': http_date(MTIME)}, True),
+    ({'if-modified-since': http_date(MTIME + 60)}, True),
+    ({'if-modified-since': http_date(MTIME - 60)}, False),
+    ({'if-modified-since': 'yesterday'}, False),
+    ({'if-none-match': '"X"', 'if-modified-since': http_date(MTIME)}, False),  # if-none-match takes precedence
+    ({'if-none-match': '"H"', 'if-modified-since': http_date(MTIME - 60)}, True)
+])
+def test_is_not_modified(headers, expect):
+    assert is_not_modified(headers, TAG, MTIME) is expect
+
+
+def test_is_not_modified_no_mtime():
+    assert not is_not_modified({'if-modified-since': http_date(MTIME)}, TAG)
+    assert is_not_modified({'if-none-match': '"H"'}, TAG)
+
+
+@pytest.mark.parametrize('headers,expect', [
+    ({}, True),
+    ({'if-range': ''}, True),
+    ({'if-range': '"H"'}, True),
+    ({'if-range': 'W/"H"'}, False),  # strong comparison only
+    ({'if-range': '"X"'}, False),
+    ({'if-range': http_date(MTIME)}, True),
+    ({'if-range': http_date(MTIME - 1)}, False),
+    ({'if-range': http_date(MTIME + 1)}, False),
+    ({'if-range': 'yesterday'}, False)
+])
+def test_is_range_current(headers, expect):
+    assert is_range_current(headers, TAG, MTIME) is expect
@@ -0,0 +1,154 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import pytest
+
+from os import pread, urandom
+from os.path import join
+from types import SimpleNamespace
+
+from app.delivery import Delivery
+
+
+class Protocol:
+    """
+    Stand-in for server protocol, collecting content written to response.
+    """
+
+    def __init__(self):
+        self.transport = SimpleNamespace(protocol=self)
+        self.content = b''
+
+    async def push_data(self, data):
+        self.content += data
+
+    async def drain(self):
+        pass
+
+
+async def content_of(rv):
+    rv.protocol = Protocol()
+    await rv.streaming_fn(rv)
+    return rv.protocol.content
+
+
+def native_sendfile(monkeypatch, budget=None):
+    """
+    Give event loop native sendfile for stand-in transport, counting calls, for as many calls as budget allows.
+    """
+
+    rv = {'calls': 0}
+
+    async def _sendfile(transport, fh, offset, count, fallback=True):
+        rv['calls'] += 1
+        if budget is not None and rv['calls'] > budget:
+            raise NotImplementedError('no native sendfile')
+        chunk = pread(fh.fileno(), count, offset)
+        await transport.protocol.push_data(chunk)
+        return len(chunk)
+
+    monkeypatch.setattr(asyncio.get_event_loop(), 'sendfile', _sendfile, raising=False)
+    return rv
+
+
+@pytest.fixture
+def tails(tmpdir):
+    rv = urandom(10000)
+    path = join(str(tmpdir), 'tails')
+    with open(path, 'wb') as fh:
+        fh.write(rv)
+    return (path, rv)
+
+
+def test_delivery_config():
+    delivery = Delivery.from_config({}, '/tails')
+    assert delivery.offload is None and delivery._sendfile and delivery._chunk_size == 262144
+
+    delivery = Delivery.from_config({'Tails Server': {'download.chunk.kb': '1', 'download.sendfile': 'no'}}, '/tails')
+    assert not delivery._sendfile and delivery._chunk_size == 4096  # floor
+
+
+@pytest.mark.asyncio
+async def test_delivery_file_pread(tails):
+    (path, content) = tails
+    released = []
+    delivery = Delivery(4096, sendfile=False)
+
+    rv = delivery.file(path, [(0, 10000)], release=lambda: released.append(True))
+    assert rv.headers['Content-Length'] == '10000' and rv.content_type == 'text/plain'
+    assert await content_of(rv) == content
+    assert released == [True]
+
+    with open(path, 'rb') as fh:  # responses share file handle: reads at explicit offsets only
+        responses = [
+            delivery.file(path, [b'--a\r\n', (5000, 5000), b'\r\n--a--'], status=206, fh=fh),
+            delivery.file(path, [(100, 50)], status=206, fh=fh)
+        ]
+        assert responses[0].headers['Content-Length'] == str(5000 + 12)
+        (multi, single) = await asyncio.gather(*[content_of(rv) for rv in responses])
+    assert multi == b'--a\r\n' + content[5000:] + b'\r\n--a--'
+    assert single == content[100:150]
+
+
+@pytest.mark.asyncio
+async def test_delivery_file_sendfile(tails, monkeypatch):
+    (path, content) = tails
+    sendfile = native_sendfile(monkeypatch)
+    delivery = Delivery(4096)
+
+    assert await content_of(delivery.file(path, [(0, 10000), b'end'])) == content + b'end'
+    assert sendfile['calls'] == 3  # in chunks of configured size
+
+
+@pytest.mark.asyncio
+async def test_delivery_sendfile_fallback(tails, monkeypatch):
+    (path, content) = tails
+    sendfile = native_sendfile(monkeypatch, 1)  # transport refuses sendfile after first chunk
+    delivery = Delivery(4096)
+
+    assert await content_of(delivery.file(path, [(0, 10000), (0, 10000)])) == content * 2  # remainder via reads
+    assert sendfile['calls'] == 2  # no retry of sendfile on later segments
+
+
+def test_delivery_offload_config():
+    delivery = Delivery.from_config({'Tails Server': {'download.offload': 'X-Accel-Redirect'}}, '/srv/tails')
+    assert delivery.offload == 'X-Accel-Redirect' and delivery._offload_prefix == '/tails-internal'
+
+    delivery = Delivery.from_config({'Tails Server': {'download.offload': 'x-sendfile'}}, '/srv/tails')
+    assert delivery.offload == 'X-Sendfile' and delivery._offload_prefix == '/srv/tails'
+
+    assert Delivery.from_config({'Tails Server': {'download.offload': 'x-lighttpd'}}, '/srv/tails').offload is None
+
+
+def test_delivery_redirect():
+    cd_id = 'LjgpST2rjsoxYegQDRm7EL:3:CL:20:tag'
+    path = join('/srv/tails', cd_id, 'H')
+
+    delivery = Delivery(offload='X-Accel-Redirect', dir_root='/srv/tails', offload_prefix='/tails-internal')
+    rv = delivery.redirect(path, {'ETag': '"H"'})
+    assert rv.status == 200 and not rv.body
+    assert rv.headers['X-Accel-Redirect'] == '/tails-internal/LjgpST2rjsoxYegQDRm7EL:3:CL:20:tag/H'
+    assert rv.headers['ETag'] == '"H"' and rv.content_type == 'text/plain'
+
+    rv = delivery.redirect(join('/srv/tails', 'cd id', 'H'), content_type='application/octet-stream')
+    assert rv.headers['X-Accel-Redirect'] == '/tails-internal/cd%20id/H'  # URI for nginx
+    assert rv.content_type == 'application/octet-stream'
+
+    delivery = Delivery(offload='X-Sendfile', dir_root='/srv/tails', offload_prefix='/mnt/tails')
+    assert delivery.redirect(join('/srv/tails', 'cd id', 'H')).headers['X-Sendfile'] == '/mnt/tails/cd id/H'  # path
@@ -0,0 +1,107 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import json
+import pytest
+
+from hashlib import sha256
+from os import makedirs, urandom
+from os.path import join
+
+from base58 import b58encode
+from von_anchor.tails import Tails
+
+from app import heat
+from app.heat import Heat
+from app.statcache import StatCache
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+CD_ID = '{}:3:CL:20:tag'.format(DID)
+
+
+def rr_id_for(tag):
+    return '{}:4:{}:CL_ACCUM:{}'.format(DID, CD_ID, tag)
+
+
+def publish(dir_tails, rr_id, size):
+    content = urandom(size)
+    tails_hash = b58encode(sha256(content).digest()).decode()
+    makedirs(Tails.dir(dir_tails, rr_id), exist_ok=True)
+    with open(join(Tails.dir(dir_tails, rr_id), tails_hash), 'wb') as fh:
+        fh.write(content)
+    Tails.associate(dir_tails, rr_id, tails_hash)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    rv = [1577836800.0]
+    monkeypatch.setattr(heat, 'time', lambda: rv[0])
+    return rv
+
+
+def test_heat_decay(clock, tmpdir):
+    counters = Heat(join(str(tmpdir), 'heat.json'), None, half_life=100)
+    counters.record('old', 1000)
+    clock[0] += 200  # two half-lives
+    counters.record('new', 300)
+
+    assert counters.hottest() == ['new', 'old']  # 300 bytes now outweigh 1000 bytes then (250 decayed)
+    assert counters._decayed('old', clock[0])[:2] == [0.25, 250]
+    counters.record('old', 100)
+    assert counters.hottest(1) == ['old']
+    assert counters._decayed('old', clock[0])[:2] == [1.25, 350]
+
+
+@pytest.mark.asyncio
+async def test_heat_persist(clock, tmpdir):
+    path = join(str(tmpdir), 'heat.json')
+    counters = Heat(path, None, half_life=100)
+    counters.record('hot', 1000)
+    counters.record('cold', 1000)
+    clock[0] += 100
+    counters.record('hot', 1000)
+    clock[0] += 600  # cold decays below threshold, hot does not yet
+    await counters.persist()
+
+    assert list(Heat(path, None, half_life=100)._counters) == ['hot']  # reloads
+
+    with open(path, 'w') as fh:
+        fh.write('{not json')
+    assert Heat(path, None)._counters == {}  # ignores unreadable file
+
+    with open(path, 'w') as fh:
+        json.dump([], fh)
+    assert Heat(path, None)._counters == {}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('warm_count,warm_bytes,expect', [(64, 1 << 30, 3), (2, 1 << 30, 2), (64, 7000, 2)])
+async def test_heat_warm(warm_count, warm_bytes, expect, clock, tmpdir):
+    dir_tails = str(tmpdir.mkdir('tails'))
+    stat_cache = StatCache(dir_tails)
+    counters = Heat(join(str(tmpdir), 'heat.json'), stat_cache, warm_count=warm_count, warm_bytes=warm_bytes)
+    for (tag, size) in (('a', 4096), ('b', 2048), ('c', 1024)):
+        publish(dir_tails, rr_id_for(tag), size)
+        counters.record(rr_id_for(tag), size)
+    counters.record(rr_id_for('gone'), 1 << 20)  # hottest, but tails file since deleted
+
+    assert await counters.warm() == expect  # hottest first, within bounds
+    assert rr_id_for('gone') not in counters.hottest()
+    assert [e['rr_id'] for e in stat_cache._entries.values()][:expect] == [rr_id_for(t) for t in 'abc'][:expect]
+    assert all(e['refs'] == 1 for e in stat_cache._entries.values())  # warming lets go of file handles
@@ -0,0 +1,99 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import pytest
+
+from types import SimpleNamespace
+
+from app.jobs import JobsBusy, UploadJobs
+
+
+RR_ID = 'LjgpST2rjsoxYegQDRm7EL:4:LjgpST2rjsoxYegQDRm7EL:3:CL:20:tag:CL_ACCUM:0'
+
+
+def upload(status=200, delay=0.0, gate=None):
+    async def process():
+        if gate:
+            await gate.wait()
+        await asyncio.sleep(delay)
+        if status is None:
+            raise ValueError('no ledger')
+        return SimpleNamespace(status=status, body='status {}'.format(status).encode())
+    return process
+
+
+async def done(jobs, job_id):
+    while jobs.get(job_id)['state'] != 'done':
+        await asyncio.sleep(0.01)
+    return jobs.get(job_id)
+
+
+def test_jobs_config():
+    assert UploadJobs.from_config({'Tails Server': {'upload.async.ttl.sec': 0}})._ttl == 0  # explicit zero stands
+    assert UploadJobs.from_config({'Tails Server': {'upload.async.ttl.sec': ''}})._ttl == 3600
+    assert UploadJobs.from_config({})._workers == 2
+
+
+@pytest.mark.asyncio
+async def test_jobs_process():
+    jobs = UploadJobs(2, 4, 3600)
+    cleaned = []
+    try:
+        ok = jobs.submit(RR_ID, upload(200), lambda: cleaned.append('ok'))
+        bad = jobs.submit(RR_ID, upload(400), lambda: cleaned.append('bad'))
+        failed = jobs.submit(RR_ID, upload(None), lambda: cleaned.append('failed'))
+        assert ok['state'] == 'queued' and ok['rr_id'] == RR_ID and ok['status'] is None
+
+        assert (await done(jobs, ok['id']))['status'] == 200
+        assert (await done(jobs, bad['id']))['message'] == 'status 400'
+        state = await done(jobs, failed['id'])
+        assert state['status'] == 500 and 'no ledger' in state['message']
+        assert sorted(cleaned) == ['bad', 'failed', 'ok']
+        assert jobs.pending == 0
+        assert jobs.get('f' * 32) is None
+    finally:
+        jobs.close()
+
+
+@pytest.mark.asyncio
+async def test_jobs_busy():
+    jobs = UploadJobs(1, 2, 3600)
+    gate = asyncio.Event()
+    cleaned = []
+    try:
+        first = jobs.submit(RR_ID, upload(gate=gate), lambda: cleaned.append(1))
+        jobs.submit(RR_ID, upload(gate=gate), lambda: cleaned.append(2))
+        with pytest.raises(JobsBusy):
+            jobs.submit(RR_ID, upload(), lambda: cleaned.append(3))
+        await asyncio.sleep(0.01)
+        assert jobs.get(first['id'])['state'] == 'running'
+    finally:
+        jobs.close()  # releases staged content of job not yet started
+    assert cleaned == [2]
+
+
+@pytest.mark.asyncio
+async def test_jobs_ttl():
+    jobs = UploadJobs(1, 2, 0)
+    try:
+        job = jobs.submit(RR_ID, upload(), lambda: None)
+        while jobs.get(job['id']) is not None:  # pruned once done, with no time to live
+            await asyncio.sleep(0.01)
+    finally:
+        jobs.close()
@@ -0,0 +1,138 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import pytest
+
+from os import listdir
+from os.path import join
+
+from app import publish
+from app.publish import Publisher
+
+
+def stage(dir_staging, dir_final, names):
+    rv = []
+    for name in names:
+        with open(join(dir_staging, name), 'wb') as fh:
+            fh.write(name.encode())
+        rv.append((join(dir_staging, name), join(dir_final, name)))
+    return rv
+
+
+@pytest.fixture
+def fsyncs(monkeypatch):
+    rv = []
+    fsync_path = publish._fsync_path
+
+    def _fsync_path(path):
+        rv.append(path)
+        fsync_path(path)
+
+    monkeypatch.setattr(publish, '_fsync_path', _fsync_path)
+    return rv
+
+
+def test_publisher_policy():
+    assert Publisher.from_config({}).policy == 'batched'
+    assert Publisher.from_config({'Tails Server': {'fsync.policy': 'Never'}}).policy == 'never'
+    with pytest.raises(ValueError):
+        Publisher('sometimes')
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy', Publisher.POLICIES)
+async def test_publish(policy, fsyncs, tmpdir):
+    (dir_staging, dir_final) = (str(tmpdir.mkdir('staging')), str(tmpdir.mkdir('final')))
+    paths = stage(dir_staging, dir_final, ['a', 'b', 'c'])
+    linked = []
+
+    publisher = Publisher(policy, 0.05)
+    await asyncio.gather(*[publisher.publish(s, f, lambda f=f: linked.append(f)) for (s, f) in paths])
+
+    assert sorted(listdir(dir_final)) == ['a', 'b', 'c'] and not listdir(dir_staging)
+    assert sorted(linked) == sorted(f for (_, f) in paths)
+    if policy == 'never':
+        assert not fsyncs
+    elif policy == 'always':  # each staged file before rename, then its directory
+        assert sorted(fsyncs) == sorted([dir_final] * 3 + [s for (s, _) in paths])
+    else:  # all staged files of batch before rename, then their directory once
+        assert sorted(fsyncs[:3]) == sorted(s for (s, _) in paths)
+        assert fsyncs[3:] == [dir_final]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy', Publisher.POLICIES)
+async def test_publish_failure(policy, tmpdir):
+    (dir_staging, dir_final) = (str(tmpdir.mkdir('staging')), str(tmpdir.mkdir('final')))
+    ((staged_a, final_a), (staged_b, final_b)) = stage(dir_staging, dir_final, ['a', 'b'])
+
+    def link():
+        raise OSError('link failed')
+
+    publisher = Publisher(policy, 0.05)
+    rv = await asyncio.gather(
+        publisher.publish(staged_a, final_a, link),
+        publisher.publish(staged_b, final_b, lambda: None),
+        publisher.publish(join(dir_staging, 'absent'), join(dir_final, 'absent'), lambda: None),
+        return_exceptions=True)
+
+    assert isinstance(rv[0], OSError) and rv[1] is None and isinstance(rv[2], OSError)
+    assert sorted(listdir(dir_final)) == ['a', 'b']
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('policy', ['always', 'batched'])
+async def test_publish_fsync_error(policy, monkeypatch, tmpdir):
+    (dir_staging, dir_final) = (str(tmpdir.mkdir('staging')), str(tmpdir.mkdir('final')))
+    ((staged_a, final_a), (staged_b, final_b)) = stage(dir_staging, dir_final, ['a', 'b'])
+
+    def _fsync_path(path):
+        raise RuntimeError('fsync went wrong')
+
+    monkeypatch.setattr(publish, '_fsync_path', _fsync_path)
+    publisher = Publisher(policy, 0.05)
+    rv = await asyncio.wait_for(
+        asyncio.gather(
+            publisher.publish(staged_a, final_a, lambda: None),
+            publisher.publish(staged_b, final_b, lambda: None),
+            return_exceptions=True),
+        5)
+
+    assert all(isinstance(x, RuntimeError) for x in rv)
+    assert not listdir(dir_final)
+
+
+@pytest.mark.asyncio
+async def test_publish_unexpected_error(monkeypatch, tmpdir):
+    (dir_staging, dir_final) = (str(tmpdir.mkdir('staging')), str(tmpdir.mkdir('final')))
+    ((staged_a, final_a), (staged_b, final_b)) = stage(dir_staging, dir_final, ['a', 'b'])
+
+    async def _fsync_all(paths):
+        raise RuntimeError('batch went wrong')
+
+    publisher = Publisher('batched', 0.05)
+    monkeypatch.setattr(publisher, '_fsync_all', _fsync_all)
+    rv = await asyncio.wait_for(
+        asyncio.gather(
+            publisher.publish(staged_a, final_a, lambda: None),
+            publisher.publish(staged_b, final_b, lambda: None),
+            return_exceptions=True),
+        5)
+
+    assert all(isinstance(x, RuntimeError) for x in rv)
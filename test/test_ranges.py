@@ -0,0 +1,71 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import pytest
+
+from app.ranges import MAX_RANGES, ByteRange, UnsatisfiableRange, parse_range
+
+
+@pytest.mark.parametrize('header,expect', [
+    ('bytes=0-99', [(0, 99)]),
+    ('bytes=100-', [(100, 999)]),
+    ('bytes=-100', [(900, 999)]),
+    ('bytes=-2000', [(0, 999)]),
+    ('bytes=900-5000', [(900, 999)]),
+    ('BYTES = 0-0', [(0, 0)]),
+    ('bytes=500-599,0-99, 900-', [(500, 599), (0, 99), (900, 999)]),
+    ('bytes=0-99,2000-3000', [(0, 99)]),
+    ('bytes=0-99,-0', [(0, 99)])
+])
+def test_parse_range(header, expect):
+    rv = parse_range(header, 1000)
+    assert [(r.start, r.end) for r in rv] == expect
+    assert all(r.size == r.end - r.start + 1 and r.total == 1000 for r in rv)
+
+
+@pytest.mark.parametrize('header', [
+    None,
+    '',
+    'items=0-99',
+    'bytes=',
+    'bytes=-',
+    'bytes=abc',
+    'bytes=99-0',
+    'bytes=0-99,50-149',
+    'bytes=0-99,-950',
+    ','.join(['bytes=0-0'] + ['{}-{}'.format(i * 2, i * 2) for i in range(1, MAX_RANGES + 1)])
+])
+def test_parse_range_whole(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize('header,total', [
+    ('bytes=1000-', 1000),
+    ('bytes=1000-1999,2000-', 1000),
+    ('bytes=-0', 1000),
+    ('bytes=-100', 0),
+    ('bytes=0-', 0)
+])
+def test_parse_range_unsatisfiable(header, total):
+    with pytest.raises(UnsatisfiableRange):
+        parse_range(header, total)
+
+
+def test_content_range():
+    assert ByteRange(10, 19, 10, 1000).content_range() == 'bytes 10-19/1000'
+    assert parse_range('bytes=-1', 1000)[0].content_range() == 'bytes 999-999/1000'
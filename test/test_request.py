@@ -0,0 +1,69 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+from types import SimpleNamespace
+
+from sanic.exceptions import PayloadTooLarge
+
+from app.request import BoundedRequest
+
+
+class Protocol:
+    def __init__(self):
+        self.errors = []
+
+    def write_error(self, exception):
+        self.errors.append(exception)
+
+
+def request(buffer_max_size=None):
+    config = SimpleNamespace(REQUEST_MAX_SIZE=1 << 20)
+    if buffer_max_size is not None:
+        config.REQUEST_BUFFER_MAX_SIZE = buffer_max_size
+    protocol = Protocol()
+    transport = SimpleNamespace(get_protocol=lambda: protocol, get_extra_info=lambda *args: None)
+    rv = BoundedRequest(b'/tails/session/0', {}, '1.1', 'POST', transport, SimpleNamespace(config=config))
+    rv.body_init()
+    return (rv, protocol)
+
+
+def test_bounded_request_within():
+    (req, protocol) = request(1024)
+    req.body_push(bytes(512))
+    req.body_push(bytes(512))
+    req.body_finish()
+    assert req.body == bytes(1024)
+    assert not protocol.errors
+
+
+def test_bounded_request_over():
+    (req, protocol) = request(1024)
+    req.body_push(bytes(1000))
+    req.body_push(bytes(25))
+    req.body_push(bytes(1000))  # ignored once refused
+    assert len(protocol.errors) == 1 and isinstance(protocol.errors[0], PayloadTooLarge)
+    req.body_finish()
+    assert req.body == b''
+
+
+def test_bounded_request_default():
+    (req, protocol) = request()  # no buffer limit configured: REQUEST_MAX_SIZE
+    req.body_push(bytes(1 << 20))
+    assert not protocol.errors
+    req.body_push(b'x')
+    assert len(protocol.errors) == 1
@@ -23,12 +23,13 @@ import pytest
 import requests
 import socket
 import subprocess
+import tarfile
 
 from configparser import ConfigParser
 from contextlib import closing
 from hashlib import sha256
-from io import StringIO
-from os.path import abspath, basename, dirname, expandvars, isfile, join as join
+from io import BytesIO, StringIO
+from os.path import abspath, basename, dirname, expandvars, getsize, isfile, join as join
 from requests.exceptions import ConnectionError
 from time import sleep, time
 
@@ -338,12 +339,88 @@ async def test_von_tails(pool_ip, genesis_txn_file, path_cli_ini, cli_ini, path_
             assert len(r.json()) == len(rr_ids_up)
         print('\n\n== 12 == All listing views at server come back OK with {} uploaded files'.format(len(rr_ids_up)))
 
+        # Exercise preflight: server has tails files already, refuses bad rev reg id and excess size
+        rr_id = sorted(rr_ids_up)[0]
+        path_tails = Tails.linked(ian.dir_tails, rr_id)
+        url = url_for(tsrv.port, 'tails/{}/preflight'.format(rr_id))
+        r = requests.put(url, params={'tails-hash': basename(path_tails), 'size': getsize(path_tails)})
+        assert r.status_code == 403
+        r = requests.put(url, params={'tails-hash': basename(path_tails), 'size': 1 << 40})
+        assert r.status_code == 413
+        r = requests.put(url_for(tsrv.port, 'tails/{}/preflight'.format(cd_id)), params={'tails-hash': 'x'})
+        assert r.status_code == 400
+        print('\n\n== 12.1 == Preflight answers 403, 413, and 400 as expected')
+
+        # Exercise listing by page, as NDJSON, and conditionally
+        rr_ids_paged = []
+        url = url_for(tsrv.port, 'tails/list/all?limit=1')
+        while url:
+            r = requests.get(url)
+            assert r.status_code == 200
+            assert len(r.json()) <= 1
+            rr_ids_paged.extend(r.json())
+            url = url_for(tsrv.port, r.links['next']['url'].lstrip('/')) if 'next' in r.links else None
+        assert rr_ids_paged == sorted(rr_ids_up)
+        r = requests.get(url_for(tsrv.port, 'tails/list/{}'.format(cd_id)), headers={'Accept': 'application/x-ndjson'})
+        assert r.status_code == 200
+        assert [json.loads(line) for line in r.text.splitlines()] == sorted(rr_ids_up)
+        r = requests.get(url_for(tsrv.port, 'tails/list/{}'.format(ian.did)))
+        assert r.headers.get('X-Tails-Generation', None)
+        r = requests.get(
+            url_for(tsrv.port, 'tails/list/{}'.format(ian.did)),
+            headers={'If-None-Match': r.headers['ETag']})
+        assert r.status_code == 304
+        print('\n\n== 12.2 == Listing views by page, as NDJSON, and conditionally come back OK')
+
+        # Exercise tails file download: metadata, conditional GET, ranges
+        with open(path_tails, 'rb') as fh_tails:
+            content = fh_tails.read()
+        url = url_for(tsrv.port, 'tails/{}'.format(rr_id))
+        r = requests.head(url, headers={'Accept-Encoding': 'identity'})
+        assert r.status_code == 200
+        assert int(r.headers['Content-Length']) == len(content)
+        r = requests.get(url, headers={'Accept-Encoding': 'identity'})
+        assert r.status_code == 200
+        assert r.content == content
+        etag = r.headers['ETag']
+        r = requests.get(url, headers={'Accept-Encoding': 'identity', 'If-None-Match': etag})
+        assert r.status_code == 304
+        r = requests.get(url, headers={'Accept-Encoding': 'identity', 'Range': 'bytes=100-199'})
+        assert r.status_code == 206
+        assert r.headers['Content-Range'] == 'bytes 100-199/{}'.format(len(content))
+        assert r.content == content[100:200]
+        r = requests.get(url, headers={'Accept-Encoding': 'identity', 'Range': 'bytes=0-99', 'If-Range': '"x"'})
+        assert r.status_code == 200
+        r = requests.get(url, headers={'Accept-Encoding': 'identity', 'Range': 'bytes={}-'.format(len(content))})
+        assert r.status_code == 416
+        r = requests.get(url_for(tsrv.port, 'tails/{}/meta'.format(rr_id)))
+        assert r.status_code == 200
+        assert r.json()['size'] == len(content)
+        print('\n\n== 12.3 == Tails file download answers 200, 304, 206, and 416 as expected')
+
+        # Exercise archive download, by cred def id and by list of rev reg ids
+        r = requests.get(url_for(tsrv.port, 'tails/archive/{}'.format(cd_id)))
+        assert r.status_code == 200
+        assert int(r.headers['Content-Length']) == len(r.content)
+        with tarfile.open(fileobj=BytesIO(r.content)) as tar:
+            links = {basename(m.name): m.linkname for m in tar.getmembers() if m.issym()}
+            assert tar.extractfile('{}/{}'.format(cd_id, basename(path_tails))).read() == content
+        assert links == {rr: basename(Tails.linked(ian.dir_tails, rr)) for rr in rr_ids_up}
+        r = requests.post(url_for(tsrv.port, 'tails/archive'), json=[rr_id])
+        assert r.status_code == 200
+        assert r.headers['X-Tails-Count'] == '1'
+        with tarfile.open(fileobj=BytesIO(r.content)) as tar:
+            assert [basename(m.name) for m in tar.getmembers() if m.issym()] == [rr_id]
+        print('\n\n== 12.4 == Archive views come back OK with tails files as uploaded')
+
         rv = pexpect.run('python ../src/sync/sync.py {}'.format(path_cli_ini['prover']))
         print('\n\n== 13 == Prover sync downloaded remote tails files')
 
         rr_ids_down = {basename(link) for link in Tails.links(config['prover']['Tails Client']['tails.dir'], ian.did)}
         assert rr_ids_down == rr_ids_up
 
+        generation = requests.get(url_for(tsrv.port, 'tails/list/all')).headers['X-Tails-Generation']
+
         # Exercise admin-delete
         rv = pexpect.run('python ../src/admin/delete.py {} all'.format(path_cli_ini['admin']))
         print('\n\n== 14 == Admin called for deletion at tails server')
@@ -355,6 +432,53 @@ async def test_von_tails(pool_ip, genesis_txn_file, path_cli_ini, cli_ini, path_
         assert not r.json()
         print('\n\n== 15 == All listing views at server come back OK and empty as expected')
 
+        # Exercise changes since generation
+        r = requests.get(url_for(tsrv.port, 'tails/list/all'), params={'since': generation})
+        assert r.status_code == 200
+        assert r.json()['removed'] == sorted(rr_ids_up) and not r.json()['added']
+        r = requests.get(url_for(tsrv.port, 'tails/list/all'), params={'since': 'x.{}'.format(generation)})
+        assert r.status_code == 410
+        generation = r.headers['X-Tails-Generation']
+        print('\n\n== 15.1 == Listing changes since generation comes back OK with {} removed files'.format(
+            len(rr_ids_up)))
+
+        # Exercise resumable upload session: open, put in two parts, check state, finalize
+        path_tails = Tails.linked(ian.dir_tails, rr_id)
+        tails_hash = basename(path_tails)
+        with open(path_tails, 'rb') as fh_tails:
+            content = fh_tails.read()
+        epoch = int(time())
+        r = requests.post(
+            url_for(tsrv.port, 'tails/session/{}'.format(rr_id)),
+            params={'tails-hash': tails_hash, 'size': len(content), 'epoch': epoch},
+            data=await ian.sign('{}||{}||{}||{}'.format(epoch, rr_id, tails_hash, len(content)).encode()))
+        assert r.status_code == 200
+        assert r.json()['offset'] == 0
+        url = url_for(tsrv.port, 'tails/session/{}'.format(r.json()['id']))
+        half = len(content) // 2
+        content_range = 'bytes 0-{}/{}'.format(half - 1, len(content))
+        r = requests.put(url, data=content[:half], headers={'Content-Range': content_range})
+        assert r.status_code == 200
+        r = requests.put(url, data=content[:half], headers={'Content-Range': content_range})
+        assert r.status_code == 409  # not at committed offset
+        r = requests.get(url)
+        assert r.status_code == 200
+        assert r.json()['offset'] == half
+        r = requests.put(
+            url,
+            data=content[half:],
+            headers={'Content-Range': 'bytes {}-{}/{}'.format(half, len(content) - 1, len(content))})
+        assert r.status_code == 200
+        assert r.json()['offset'] == len(content)
+        epoch = int(time())
+        r = requests.post(
+            '{}/{}'.format(url, epoch),
+            data=await ian.sign('{}||{}||{}'.format(epoch, rr_id, sha256(content).hexdigest()).encode()))
+        assert r.status_code == 200
+        r = requests.get(url_for(tsrv.port, 'tails/list/all'), params={'since': generation})
+        assert r.json()['added'] == [rr_id]
+        print('\n\n== 15.2 == Upload session put, resumed, and finalized tails file for {}'.format(rr_id))
+
         rv = pexpect.run('python ../src/sync/multisync.py 1 {}'.format(path_cli_ini['issuer']))
         print('\n\n== 16 == Issuer multisync on 1 sync iteration uploaded local tails files')
 
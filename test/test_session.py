@@ -0,0 +1,121 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import pytest
+
+from hashlib import sha256
+from os import listdir, urandom, utime
+from os.path import isfile
+from time import time
+from types import SimpleNamespace
+
+from base58 import b58encode
+
+from app.session import BadRange, SessionsFull, UploadSession
+
+
+RR_ID = 'LjgpST2rjsoxYegQDRm7EL:4:LjgpST2rjsoxYegQDRm7EL:3:CL:20:tag:CL_ACCUM:0'
+HASH = '1' * 44
+
+
+class Stream:
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    async def read(self):
+        return self.chunks.pop(0) if self.chunks else None
+
+
+def body(*chunks):
+    return SimpleNamespace(stream=Stream(chunks))
+
+
+def test_session_open(tmpdir):
+    dir_sessions = str(tmpdir)
+    session = UploadSession.open(dir_sessions, RR_ID, HASH, 1000)
+    assert len(session.id) == 32
+    assert session.state() == {'id': session.id, 'rr_id': RR_ID, 'tails_hash': HASH, 'size': 1000, 'offset': 0}
+
+    assert UploadSession.open(dir_sessions, RR_ID, HASH, 1000).id == session.id  # resume
+    assert UploadSession.get(dir_sessions, session.id).filename == HASH
+    assert UploadSession.get(dir_sessions, 'f' * 32) is None
+
+    other = UploadSession.open(dir_sessions, RR_ID, HASH, 2000)  # other size: start over
+    assert other.id != session.id
+    assert UploadSession.get(dir_sessions, session.id) is None
+    assert [s.id for s in UploadSession.sessions(dir_sessions)] == [other.id]
+
+
+def test_session_capacity(tmpdir):
+    dir_sessions = str(tmpdir)
+    UploadSession.open(dir_sessions, RR_ID, HASH, 1000, 2, 3000)
+    with pytest.raises(SessionsFull):  # total size
+        UploadSession.open(dir_sessions, RR_ID.replace(':0', ':1'), HASH, 2001, 2, 3000)
+    UploadSession.open(dir_sessions, RR_ID.replace(':0', ':1'), HASH, 2000, 2, 3000)
+    with pytest.raises(SessionsFull):  # count
+        UploadSession.open(dir_sessions, RR_ID.replace(':0', ':2'), HASH, 1, 2, 3000)
+    assert UploadSession.open(dir_sessions, RR_ID, HASH, 1000, 2, 3000)  # resume despite capacity
+
+
+def test_session_expire(tmpdir):
+    dir_sessions = str(tmpdir)
+    (idle, active) = (
+        UploadSession.open(dir_sessions, RR_ID, HASH, 1000),
+        UploadSession.open(dir_sessions, RR_ID.replace(':0', ':1'), HASH, 1000))
+    utime(idle.path, (time() - 3600, time() - 3600))
+
+    UploadSession.expire(dir_sessions, 600)
+    assert sorted(listdir(dir_sessions)) == sorted(['{}.part'.format(active.id), '{}.json'.format(active.id)])
+
+
+@pytest.mark.asyncio
+async def test_session_write(tmpdir):
+    content = urandom(4096)
+    session = UploadSession.open(str(tmpdir), RR_ID, b58encode(sha256(content).digest()).decode(), len(content))
+
+    assert await session.write(body(content[:1000], content[1000:2000]), 'bytes 0-1999/4096') == 2000
+    for content_range in (
+            None,
+            'bytes 0-999/4096',  # not at committed offset
+            'bytes 2000-4096/4096',  # past end
+            'bytes 2000-2999/5000',  # other size
+            'bytes 2999-2000/4096',
+            'items 2000-2999/4096'):
+        with pytest.raises(BadRange):
+            await session.write(body(content[2000:3000]), content_range)
+    assert session.offset == 2000
+
+    with pytest.raises(BadRange):  # content past range end: keep content within range
+        await session.write(body(content[2000:3000], content[3000:3500]), 'bytes 2000-2999/4096')
+    assert session.offset == 3000 and not session.complete
+
+    assert await session.write(body(content[3000:]), 'bytes 3000-4095/4096') == 4096
+    assert session.complete
+
+    await session.hash()
+    assert session.tails_hash == session.filename and session.digest == sha256(content).digest()
+
+    path = session.claim()
+    assert isfile(path) and session.path is None
+    assert UploadSession.get(str(tmpdir), session.id) is None  # metadata gone with claim
+
+
+def test_session_discard(tmpdir):
+    session = UploadSession.open(str(tmpdir), RR_ID, HASH, 1000)
+    session.discard()
+    assert not listdir(str(tmpdir)) and session.offset == 0
@@ -0,0 +1,125 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import gzip
+import pytest
+
+from hashlib import sha256
+from os import listdir, urandom
+from os.path import isfile
+
+from base58 import b58encode
+
+from app.spool import BadUpload, MAX_FIELD_SIZE, MultipartSpool, OversizeUpload, zstandard
+
+
+BOUNDARY = 'x-tails-boundary'
+
+
+def part(name, content, filename=None, encoding=None):
+    headers = 'Content-Disposition: form-data; name="{}"{}\r\n'.format(
+        name,
+        '; filename="{}"'.format(filename) if filename else '')
+    if encoding:
+        headers += 'Content-Encoding: {}\r\n'.format(encoding)
+    return '--{}\r\n{}\r\n'.format(BOUNDARY, headers).encode() + content + b'\r\n'
+
+
+def body(*parts):
+    return b'preamble\r\n' + b''.join(parts) + '--{}--\r\nepilogue'.format(BOUNDARY).encode()
+
+
+def spool(tmpdir, content, chunk_size=None, max_size=1 << 20):
+    rv = MultipartSpool(BOUNDARY, str(tmpdir), 'tails', max_size)
+    chunk_size = chunk_size or len(content)
+    try:
+        for i in range(0, len(content), chunk_size):
+            rv.feed(content[i:i + chunk_size])
+        rv.close()
+    except Exception:
+        rv.discard()
+        raise
+    return rv
+
+
+@pytest.mark.parametrize('chunk_size', [None, 1, 7, 64, 4099])
+def test_spool_chunks(chunk_size, tmpdir):
+    tails = urandom(10000) + '\r\n--{}'.format(BOUNDARY[:-1]).encode()  # near-boundary content
+    content = body(part('epoch', b'1234'), part('tails', tails, 'H'), part('sig', b'\x00\r\n\x01'))
+    rv = spool(tmpdir, content, chunk_size)
+
+    assert rv.filename == 'H'
+    assert rv.size == len(tails)
+    assert rv.tails_hash == b58encode(sha256(tails).digest()).decode()
+    assert rv.fields == {'epoch': b'1234', 'sig': b'\x00\r\n\x01'}
+    with open(rv.path, 'rb') as fh:
+        assert fh.read() == tails
+
+    path = rv.claim()
+    assert rv.path is None and isfile(path)
+
+
+def test_spool_oversize(tmpdir):
+    with pytest.raises(OversizeUpload):
+        spool(tmpdir, body(part('tails', bytes(1025), 'H')), 256, max_size=1024)
+    assert not listdir(str(tmpdir))  # discarded
+
+    rv = spool(tmpdir, body(part('tails', bytes(1024), 'H')), 256, max_size=1024)
+    assert rv.size == 1024
+    rv.discard()
+
+    with pytest.raises(BadUpload):
+        spool(tmpdir, body(part('tails', b'', 'H'), part('sig', bytes(MAX_FIELD_SIZE + 1))))
+
+
+@pytest.mark.parametrize('encoding', ['gzip', 'zstd'])
+def test_spool_encoded(encoding, tmpdir):
+    if encoding == 'zstd' and zstandard is None:
+        pytest.skip('zstandard package not installed')
+
+    tails = urandom(4096) * 64
+    encoded = gzip.compress(tails) if encoding == 'gzip' else zstandard.ZstdCompressor().compress(tails)
+    rv = spool(tmpdir, body(part('tails', encoded, 'H', encoding)), 1000)
+    assert rv.size == len(tails)
+    assert rv.tails_hash == b58encode(sha256(tails).digest()).decode()
+
+    with pytest.raises(OversizeUpload):  # limit applies to decoded content
+        spool(tmpdir, body(part('tails', encoded, 'H', encoding)), 1000, max_size=len(encoded) * 2)
+
+
+def test_spool_bad_encoding(tmpdir):
+    with pytest.raises(BadUpload):
+        spool(tmpdir, body(part('tails', b'abc', 'H', 'br')))
+    with pytest.raises(BadUpload):
+        spool(tmpdir, body(part('tails', gzip.compress(urandom(1024))[:-8], 'H', 'gzip')))
+    with pytest.raises(BadUpload):
+        spool(tmpdir, body(part('tails', b'not gzip', 'H', 'gzip')))
+
+
+def test_spool_malformed(tmpdir):
+    with pytest.raises(BadUpload):  # no tails part
+        spool(tmpdir, body(part('sig', b'abc')))
+    with pytest.raises(BadUpload):  # two tails parts
+        spool(tmpdir, body(part('tails', b'abc', 'H'), part('tails', b'def', 'H')))
+    with pytest.raises(BadUpload):  # no closing boundary
+        spool(tmpdir, body(part('tails', b'abc', 'H'))[:-len('--\r\nepilogue')])
+    with pytest.raises(BadUpload):  # part without name
+        spool(tmpdir, '--{}\r\nContent-Type: text/plain\r\n\r\nabc\r\n--{}--'.format(BOUNDARY, BOUNDARY).encode())
+    with pytest.raises(BadUpload):  # bad trailer after delimiter
+        spool(tmpdir, '--{}xx'.format(BOUNDARY).encode())
+    assert not listdir(str(tmpdir))
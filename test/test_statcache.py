@@ -0,0 +1,130 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import pytest
+
+from hashlib import sha256
+from os import makedirs, unlink, urandom
+from os.path import join
+
+from base58 import b58encode
+from von_anchor.tails import Tails
+
+from app.statcache import StatCache
+from app.variants import variant_path
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+CD_ID = '{}:3:CL:20:tag'.format(DID)
+
+
+def rr_id_for(tag):
+    return '{}:4:{}:CL_ACCUM:{}'.format(DID, CD_ID, tag)
+
+
+def publish(dir_tails, rr_id, size=1024):
+    content = urandom(size)
+    tails_hash = b58encode(sha256(content).digest()).decode()
+    makedirs(Tails.dir(dir_tails, rr_id), exist_ok=True)
+    rv = join(Tails.dir(dir_tails, rr_id), tails_hash)
+    with open(rv, 'wb') as fh:
+        fh.write(content)
+    Tails.associate(dir_tails, rr_id, tails_hash)
+    return rv
+
+
+def test_stat_cache_get(tmpdir):
+    dir_tails = str(tmpdir)
+    rr_id = rr_id_for('get')
+    path_tails = publish(dir_tails, rr_id)
+    cache = StatCache(dir_tails, ttl=3600)
+
+    assert cache.get(rr_id_for('absent')) is None
+    entry = cache.get(rr_id)
+    assert entry['path'] == path_tails and entry['size'] == 1024 and entry['variants'] == {}
+    assert entry['cd_id'] == CD_ID and entry['issuer_did'] == DID
+    assert cache.get(rr_id) is entry
+
+    with open(variant_path(path_tails, 'gzip'), 'wb') as fh:
+        fh.write(b'gz')
+    assert cache.get(rr_id) is entry  # within time to live: no revalidation
+    cache.invalidate(rr_id)
+    assert entry['fh'].closed
+    assert cache.get(rr_id)['variants'] == {'gzip': 2}
+
+
+def test_stat_cache_revalidate(tmpdir):
+    dir_tails = str(tmpdir)
+    rr_id = rr_id_for('revalidate')
+    path_tails = publish(dir_tails, rr_id)
+    cache = StatCache(dir_tails, ttl=0)  # revalidate on every hit
+
+    entry = cache.get(rr_id)
+    assert cache.get(rr_id) is entry  # unchanged
+
+    with open(variant_path(path_tails, 'gzip'), 'wb') as fh:
+        fh.write(b'gz')
+    entry_gz = cache.get(rr_id)  # variant added
+    assert entry_gz is not entry and entry_gz['variants'] == {'gzip': 2} and entry['fh'].closed
+
+    unlink(variant_path(path_tails, 'gzip'))
+    assert cache.get(rr_id)['variants'] == {}  # variant removed
+
+    unlink(join(Tails.dir(dir_tails, rr_id), rr_id))
+    path_other = publish(dir_tails, rr_id)  # link to other tails file, as per mirror
+    assert cache.get(rr_id)['path'] == path_other
+
+    unlink(join(Tails.dir(dir_tails, rr_id), rr_id))
+    assert cache.get(rr_id) is None
+
+
+def test_stat_cache_refs(tmpdir):
+    dir_tails = str(tmpdir)
+    rr_id = rr_id_for('refs')
+    publish(dir_tails, rr_id)
+    cache = StatCache(dir_tails)
+
+    entry = cache.acquire(rr_id)
+    assert entry['refs'] == 2  # cache's and response's
+    cache.invalidate()
+    assert entry['refs'] == 1 and not entry['fh'].closed  # response still streaming
+    StatCache.release(entry)
+    assert entry['refs'] == 0 and entry['fh'].closed
+
+    assert cache.acquire(rr_id_for('absent')) is None
+
+
+@pytest.mark.parametrize('max_entries,max_bytes', [(2, 1 << 30), (256, 2048)])
+def test_stat_cache_evict(max_entries, max_bytes, tmpdir):
+    dir_tails = str(tmpdir)
+    rr_ids = [rr_id_for(tag) for tag in ('a', 'b', 'c')]
+    for rr_id in rr_ids:
+        publish(dir_tails, rr_id)
+    cache = StatCache(dir_tails, max_entries, max_bytes, 3600)
+
+    (entry_a, entry_b) = (cache.get(rr_ids[0]), cache.acquire(rr_ids[1]))
+    cache.get(rr_ids[0])  # most recently used: b goes first
+    cache.get(rr_ids[2])
+    assert list(cache._entries) == [rr_ids[0], rr_ids[2]] and cache._bytes == 2048
+    assert entry_b['refs'] == 1 and not entry_b['fh'].closed  # evicted, but response holds it
+    StatCache.release(entry_b)
+    assert entry_b['fh'].closed and not entry_a['fh'].closed
+
+    cache = StatCache(dir_tails, max_bytes=512)
+    assert cache.get(rr_ids[0]) and cache.get(rr_ids[1])  # always keeps latest entry, even beyond size
+    assert list(cache._entries) == [rr_ids[1]]
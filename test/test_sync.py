@@ -0,0 +1,255 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+import json
+import pytest
+
+from email.parser import BytesParser
+from hashlib import sha256
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import makedirs, urandom
+from os.path import join
+from re import match
+from socketserver import ThreadingMixIn
+from threading import Thread
+from types import SimpleNamespace
+from urllib.parse import unquote, urlparse
+
+from base58 import b58encode
+from von_anchor.tails import Tails
+
+from sync.sync import download_tails, preflight, sync_issuer
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+CD_ID = '{}:3:CL:20:tag'.format(DID)
+
+
+def rr_id_for(tag):
+    return '{}:4:{}:CL_ACCUM:{}'.format(DID, CD_ID, tag)
+
+
+def tails_file(dir_tails, rr_id, size=4096):
+    content = urandom(size)
+    tails_hash = b58encode(sha256(content).digest()).decode()
+    makedirs(join(dir_tails, CD_ID), exist_ok=True)
+    with open(join(dir_tails, CD_ID, tails_hash), 'wb') as fh:
+        fh.write(content)
+    Tails.associate(dir_tails, rr_id, tails_hash)
+    return (join(dir_tails, CD_ID, tails_hash), content)
+
+
+class Issuer:
+    """
+    Stand-in for issuer anchor: DID, wallet name, and (insecure) signature.
+    """
+
+    def __init__(self):
+        self.did = DID
+        self.wallet = SimpleNamespace(name='issuer')
+
+    async def sign(self, message):
+        return sha256(message).digest()
+
+
+class TailsServer(ThreadingMixIn, HTTPServer):
+    """
+    Tails server in the manner of releases before upload preflight: it lists and accepts uploads,
+    but answers any other request with the configured status, as Sanic does for a route it does not have;
+    or, if so configured, refuses to open upload sessions with the configured status.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, no_route, session_status=None):
+        super().__init__(('127.0.0.1', 0), TailsHandler)
+        self.no_route = no_route
+        self.session_status = session_status
+        self.uploads = {}
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class TailsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body=b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.startswith('/tails/list/'):
+            self._respond(200, json.dumps(sorted(self.server.uploads)).encode())
+        else:
+            self._respond(self.server.no_route)
+
+    def do_PUT(self):
+        self._respond(self.server.no_route)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        segments = urlparse(self.path).path.split('/')
+        if segments[1:3] == ['tails', 'session'] and self.server.session_status:
+            self._respond(self.server.session_status, b'refused')
+            return
+        if len(segments) != 4 or segments[1] != 'tails' or not segments[3].isdigit():
+            self._respond(self.server.no_route)
+            return
+        message = BytesParser().parsebytes(
+            'Content-Type: {}\r\n\r\n'.format(self.headers['Content-Type']).encode() + body)
+        self.server.uploads[unquote(segments[2])] = {
+            part.get_param('name', header='content-disposition'): (part.get_filename(), part.get_payload(decode=True))
+            for part in message.get_payload()
+        }
+        self._respond(200)
+
+
+@pytest.fixture(params=[404, 405])
+def tails_server(request):
+    server = TailsServer(request.param)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_preflight_no_route(tails_server, tmpdir):
+    rr_id = rr_id_for('0')
+    (path_tails, _) = tails_file(str(tmpdir), rr_id)
+
+    assert preflight('127.0.0.1', tails_server.port, rr_id, path_tails)  # server predates preflight: proceed
+
+
+@pytest.mark.parametrize('status,proceed', [(200, True), (403, False), (413, False), (503, False)])
+def test_preflight_answer(status, proceed, tmpdir):
+    server = TailsServer(status)  # answers preflight with status
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        rr_id = rr_id_for('0')
+        (path_tails, _) = tails_file(str(tmpdir), rr_id)
+        assert preflight('127.0.0.1', server.port, rr_id, path_tails) == proceed
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.asyncio
+async def test_sync_issuer_no_preflight_route(tails_server, tmpdir):
+    dir_tails = str(tmpdir)
+    contents = {}
+    for tag in ('0', '1'):
+        rr_id = rr_id_for(tag)
+        (path_tails, content) = tails_file(dir_tails, rr_id, 65536 + int(tag))
+        contents[rr_id] = (path_tails, content)
+
+    await sync_issuer(dir_tails, '127.0.0.1', tails_server.port, set(contents), Issuer())
+
+    assert set(tails_server.uploads) == set(contents)
+    for (rr_id, (path_tails, content)) in contents.items():
+        fields = tails_server.uploads[rr_id]
+        assert fields['tails-file'] == (path_tails.rsplit('/', 1)[1], content)
+        assert fields['version'] == (None, b'2')
+        assert len(fields['signature'][1]) == 32  # stand-in signature over epoch, rev reg id, and digest
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('session_status', [400, 503])
+async def test_sync_issuer_session_refused(session_status, tmpdir):
+    server = TailsServer(404, session_status)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        dir_tails = str(tmpdir)
+        rr_id = rr_id_for('0')
+        (path_tails, content) = tails_file(dir_tails, rr_id, 65536)
+
+        await sync_issuer(dir_tails, '127.0.0.1', server.port, {rr_id}, Issuer(), chunk_size=4096)
+
+        assert server.uploads[rr_id]['tails-file'] == (path_tails.rsplit('/', 1)[1], content)  # single POST
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class DownloadServer(ThreadingMixIn, HTTPServer):
+    """
+    Tails server that drops its first response halfway, then answers range requests starting at the
+    configured shift past the requested offset; it records the request headers it receives.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, content, shift):
+        super().__init__(('127.0.0.1', 0), DownloadHandler)
+        self.content = content
+        self.tails_hash = b58encode(sha256(content).digest()).decode()
+        self.shift = shift
+        self.requests = []
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+class DownloadHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        content = server.content
+        re_range = match(r'bytes=([0-9]+)-$', self.headers.get('Range', ''))
+        start = int(re_range.group(1)) + server.shift if re_range else 0
+        self.send_response(206 if re_range else 200)
+        self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(server.tails_hash))
+        self.send_header('ETag', '"{}"'.format(server.tails_hash))
+        self.send_header('Content-Length', str(len(content) - start))
+        if re_range:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, len(content) - 1, len(content)))
+        self.end_headers()
+        if len(server.requests) == 1:
+            self.wfile.write(content[:len(content) // 2])  # drop halfway
+            self.close_connection = True
+        else:
+            self.wfile.write(content[start:])
+
+
+@pytest.mark.parametrize('shift', [0, 16])
+def test_download_tails_resume(shift, tmpdir):
+    content = urandom(65536)
+    server = DownloadServer(content, shift)
+    Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        rr_id = rr_id_for('0')
+        (path_tmp, tails_hash) = download_tails(
+            'http://127.0.0.1:{}/tails/{}'.format(server.port, rr_id),
+            str(tmpdir),
+            size=len(content))
+        with open(path_tmp, 'rb') as fh:
+            assert fh.read() == content  # shifted range: truncated and started over
+        assert tails_hash == server.tails_hash
+        assert all(req['If-Range'] == '"{}"'.format(tails_hash) for req in server.requests if 'Range' in req)
+        assert len(server.requests) == (2 if not shift else 3)
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,82 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import gzip
+import pytest
+
+from os import listdir, urandom
+from os.path import isfile, join
+
+from app.variants import Variants, accepted, remove_variants, variant_path, zstandard
+
+
+def write_tails(tmpdir, content):
+    rv = join(str(tmpdir), 'H')
+    with open(rv, 'wb') as fh:
+        fh.write(content)
+    return rv
+
+
+def test_accepted():
+    assert accepted(None) == {}
+    assert accepted('gzip, deflate, br') == {'gzip': 1.0, 'deflate': 1.0, 'br': 1.0}
+    assert accepted('GZIP;q=0.5, zstd; q=0, *;q=0.1') == {'gzip': 0.5, 'zstd': 0.0, '*': 0.1}
+    assert accepted('gzip;q=x') == {'gzip': 0.0}
+
+
+def test_variants_config():
+    assert Variants.from_config({}).encodings == ['gzip']
+    assert Variants.from_config({'Tails Server': {'variant.encodings': ''}}).encodings == []
+    assert Variants.from_config({'Tails Server': {'variant.encodings': 'GZIP, br'}}).encodings == ['gzip']
+    expect = ['zstd', 'gzip'] if zstandard else ['gzip']
+    assert Variants.from_config({'Tails Server': {'variant.encodings': 'gzip,zstd'}}).encodings == expect
+
+
+def test_negotiate():
+    variants = Variants(['zstd', 'gzip'])
+    sizes = {'gzip': 100, 'zstd': 90} if zstandard else {'gzip': 100}
+    assert variants.negotiate(None, sizes) is None
+    assert variants.negotiate('gzip', sizes) == 'gzip'
+    assert variants.negotiate('gzip;q=0, br', sizes) is None
+    assert variants.negotiate('*', sizes) == ('zstd' if zstandard else 'gzip')  # smallest admitted
+    assert variants.negotiate('gzip', {}) is None  # no variant present
+    assert Variants([]).negotiate('gzip', sizes) is None  # not configured: serve as is
+
+
+@pytest.mark.asyncio
+async def test_produce(tmpdir):
+    content = b'\x00' * 65536 + urandom(64)
+    path_tails = write_tails(tmpdir, content)
+    variants = Variants(['gzip'])
+
+    assert await variants.produce(path_tails) == ['gzip']
+    with open(variant_path(path_tails, 'gzip'), 'rb') as fh:
+        assert gzip.decompress(fh.read()) == content
+    assert await variants.produce(path_tails) == []  # already present
+    assert sorted(listdir(str(tmpdir))) == ['H', 'H.gz']  # no temporary files left
+
+    remove_variants(path_tails)
+    assert not isfile(variant_path(path_tails, 'gzip')) and isfile(path_tails)
+
+
+@pytest.mark.asyncio
+async def test_produce_incompressible(tmpdir):
+    path_tails = write_tails(tmpdir, urandom(65536))
+
+    assert await Variants(['gzip']).produce(path_tails) == []  # not worth serving
+    assert listdir(str(tmpdir)) == ['H']
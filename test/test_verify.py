@@ -0,0 +1,108 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import json
+import pytest
+
+from hashlib import sha256
+
+from app.verify import Verifier, VerifyBusy
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+
+
+class Anchor:
+    """
+    Stand-in for tails server anchor, verifying (insecure) signatures slowly, counting concurrent verifications.
+    """
+
+    did = 'V4SGRU86Z58d6TV7PBUe6f'
+    verkey = 'x'
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.active = 0
+        self.max_active = 0
+
+    async def verify(self, message, signature, signer):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.active -= 1
+        return signature == sha256(message if isinstance(message, bytes) else message.encode()).digest()
+
+    async def get_nym(self, did):
+        return json.dumps({})
+
+
+def sign(message):
+    return sha256(message).digest()
+
+
+def test_verifier_config():
+    with pytest.raises(ValueError):
+        Verifier('thread')
+    verifier = Verifier.from_config({'Tails Server': {'verify.executor': 'anchor'}})
+    assert verifier.pending == 0
+    verifier.close()
+
+
+@pytest.mark.asyncio
+async def test_verify_anchor():
+    verifier = Verifier('anchor', 2, 8)
+    tsan = Anchor()
+
+    assert await verifier.verify(tsan, b'message', sign(b'message'), DID)
+    assert not await verifier.verify(tsan, b'message', sign(b'other'), DID)
+    assert not await verifier.verify(tsan, b'message', b'', DID)
+    assert await verifier.verify(tsan, lambda: b'callable', sign(b'callable'), DID)  # produced off the loop
+
+    rv = await asyncio.gather(*[verifier.verify(tsan, b'm', sign(b'm'), DID) for _ in range(6)])
+    assert all(rv)
+    assert tsan.max_active == 2  # bounded by workers
+    assert verifier.pending == 0
+    assert verifier.stats['count'] == 10 and verifier.stats['failed'] == 2 and verifier.stats['rejected'] == 0
+    verifier.close()
+
+
+@pytest.mark.asyncio
+async def test_verify_busy():
+    verifier = Verifier('anchor', 1, 3)
+    tsan = Anchor()
+
+    rv = await asyncio.gather(*[verifier.verify(tsan, b'm', sign(b'm'), DID) for _ in range(5)], return_exceptions=True)
+    assert rv[:3] == [True] * 3
+    assert all(isinstance(x, VerifyBusy) for x in rv[3:])
+    assert verifier.stats['rejected'] == 2
+    assert verifier.pending == 0
+    assert await verifier.verify(tsan, b'm', sign(b'm'), DID)  # capacity again once drained
+    verifier.close()
+
+
+@pytest.mark.asyncio
+async def test_verify_process():
+    verifier = Verifier('process', 1, 4)
+    tsan = Anchor()
+    try:
+        assert not await verifier.verify(tsan, b'message', sign(b'message'), DID)  # no verkey on ledger
+        assert not await verifier.verify(tsan, b'message', sign(b'message'), tsan.did)  # indy rejects bad verkey
+        assert verifier.stats['failed'] == 2
+    finally:
+        verifier.close()
@@ -0,0 +1,355 @@
+"""
+Copyright 2017-2020 Government of Canada - Public Services and Procurement Canada - buyandsell.gc.ca
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+
+
+import asyncio
+import json
+import pytest
+import sys
+
+from hashlib import sha256
+from importlib.util import module_from_spec, spec_from_file_location
+from mimetypes import guess_type
+from os import makedirs, urandom
+from os.path import dirname, join, realpath
+from shutil import copy
+from time import time
+from types import SimpleNamespace
+from urllib.parse import quote, urlencode
+
+from base58 import b58encode
+from sanic import Sanic, response
+from sanic.compat import Header
+from von_anchor.error import AbsentRevReg
+from von_anchor.tails import Tails
+
+from app.cache import MEM_CACHE
+from app.delivery import Delivery
+from app.locks import FileLock
+from app.request import BoundedRequest
+from app.statcache import StatCache
+from app.variants import Variants
+from app.verify import Verifier
+
+
+DID = 'LjgpST2rjsoxYegQDRm7EL'
+CD_ID = '{}:3:CL:20:tag'.format(DID)
+
+
+def rr_id_for(tag):
+    return '{}:4:{}:CL_ACCUM:{}'.format(DID, CD_ID, tag)
+
+
+def sign(message):
+    return sha256(message).digest()
+
+
+class Anchor:
+    """
+    Stand-in for tails server anchor: ledger of tails hashes by rev reg id, and (insecure) verification
+    that, like indy-sdk, takes only bytes as signed content.
+    """
+
+    did = 'V4SGRU86Z58d6TV7PBUe6f'
+    verkey = 'x'
+
+    def __init__(self):
+        self.ledger = {}
+
+    async def verify(self, message, signature, signer):
+        return isinstance(message, bytes) and signature == sign(message)
+
+    async def get_rev_reg_def(self, rr_id):
+        if rr_id not in self.ledger:
+            raise AbsentRevReg('No rev reg {}'.format(rr_id))
+        return json.dumps({'value': {'tailsHash': self.ledger[rr_id]}})
+
+
+class Stream:
+    """
+    Stand-in for streaming request body, counting chunks read.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.read_count = 0
+
+    async def read(self):
+        if not self.chunks:
+            return None
+        self.read_count += 1
+        return self.chunks.pop(0)
+
+
+@pytest.fixture(scope='module')
+def views(tmpdir_factory):
+    """
+    Views module, loaded from a copy so that its tails and staging directories (beside its package directory)
+    are scratch directories.
+    """
+
+    dir_root = str(tmpdir_factory.mktemp('server'))
+    makedirs(join(dir_root, 'app'))
+    copy(join(sys.modules['app'].__path__[0], 'views.py'), join(dir_root, 'app'))
+    if not hasattr(sys.modules['app'], 'app'):
+        sys.modules['app'].app = Sanic('test_views', request_class=BoundedRequest)
+
+    spec = spec_from_file_location('app.views', join(dir_root, 'app', 'views.py'))
+    rv = module_from_spec(spec)
+    sys.modules['app.views'] = rv
+    spec.loader.exec_module(rv)
+    rv.DIR_TAILS = join(dir_root, 'tails')
+    rv.DIR_SESSIONS = join(dir_root, 'staging', 'sessions')
+    return rv
+
+
+async def serve(config=None):
+    rv = Anchor()
+    await MEM_CACHE.set('config', {'Tails Server': {'max.upload.mb': '1', **(config or {})}})
+    await MEM_CACHE.set('tsan', rv)
+    await MEM_CACHE.set('verifier', Verifier('anchor'))
+    return rv
+
+
+async def deliver(views, config=None):
+    config = {'Tails Server': config or {}}
+    await MEM_CACHE.set('delivery', Delivery.from_config(config, views.DIR_TAILS))
+    await MEM_CACHE.set('variants', Variants.from_config(config))
+    await MEM_CACHE.set('stat_cache', StatCache.from_config(config, views.DIR_TAILS))
+
+
+def handler(views, name):
+    rv = getattr(views, name)
+    return rv[1] if isinstance(rv, tuple) else rv  # Sanic 20 route decorator returns (routes, handler)
+
+
+def request(method, path, args=None, body=b'', headers=None, chunks=None):
+    url = '{}{}'.format(quote(path), '?{}'.format(urlencode(args)) if args else '')
+    transport = SimpleNamespace(get_protocol=lambda: None, get_extra_info=lambda *args: None)
+    rv = BoundedRequest(url.encode(), Header(headers or {}), '1.1', method, transport, sys.modules['app'].app)
+    rv.body = body
+    if chunks is not None:
+        rv.stream = Stream(chunks)
+    return rv
+
+
+def tails_for(tsan, rr_id, size=4096):
+    content = urandom(size)
+    tsan.ledger[rr_id] = b58encode(sha256(content).digest()).decode()
+    return (tsan.ledger[rr_id], content)
+
+
+def publish_tails(views, rr_id, content):
+    tails_hash = b58encode(sha256(content).digest()).decode()
+    makedirs(Tails.dir(views.DIR_TAILS, rr_id), exist_ok=True)
+    with open(join(Tails.dir(views.DIR_TAILS, rr_id), tails_hash), 'wb') as fh_tails:
+        fh_tails.write(content)
+    Tails.associate(views.DIR_TAILS, rr_id, tails_hash)
+    return join(Tails.dir(views.DIR_TAILS, rr_id), tails_hash)
+
+
+async def open_session(views, rr_id, tails_hash, size):
+    epoch = int(time())
+    return await handler(views, 'open_upload_session')(
+        request(
+            'POST',
+            '/tails/session/{}'.format(rr_id),
+            {'tails-hash': tails_hash, 'size': size, 'epoch': epoch},
+            sign('{}||{}||{}||{}'.format(epoch, rr_id, tails_hash, size).encode())),
+        rr_id)
+
+
+@pytest.mark.asyncio
+async def test_open_upload_session(views):
+    tsan = await serve()
+    rr_id = rr_id_for('open')
+    (tails_hash, content) = tails_for(tsan, rr_id)
+
+    rv = await open_session(views, rr_id, tails_hash, len(content))
+    assert rv.status == 200
+    state = json.loads(rv.body)
+    assert state['rr_id'] == rr_id and state['offset'] == 0 and state['size'] == len(content)
+
+    rv = await open_session(views, rr_id, tails_hash, len(content))  # resume same session
+    assert json.loads(rv.body)['id'] == state['id']
+
+    epoch = int(time())
+    rv = await handler(views, 'open_upload_session')(
+        request(
+            'POST',
+            '/tails/session/{}'.format(rr_id),
+            {'tails-hash': tails_hash, 'size': len(content), 'epoch': epoch},
+            sign('{}||{}||{}||{}'.format(epoch, rr_id, tails_hash, len(content) + 1).encode())),
+        rr_id)
+    assert rv.status == 400  # signature over other size
+
+    rv = await open_session(views, rr_id_for('absent'), tails_hash, len(content))
+    assert rv.status == 400  # not on ledger
+
+
+@pytest.mark.asyncio
+async def test_put_upload_session(views):
+    tsan = await serve()
+    rr_id = rr_id_for('put')
+    (tails_hash, content) = tails_for(tsan, rr_id)
+    sid = json.loads((await open_session(views, rr_id, tails_hash, len(content))).body)['id']
+    put = handler(views, 'put_upload_session')
+
+    def put_request(first, last, chunks):
+        return request(
+            'PUT',
+            '/tails/session/{}'.format(sid),
+            headers={'Content-Range': 'bytes {}-{}/{}'.format(first, last, len(content))},
+            chunks=chunks)
+
+    req = put_request(0, 1023, [content[:512], content[512:1024]])
+    rv = await put(req, sid)
+    assert rv.status == 200 and json.loads(rv.body)['offset'] == 1024
+
+    req = put_request(0, 1023, [content[:512], content[512:1024]])  # not at committed offset
+    rv = await put(req, sid)
+    assert rv.status == 409 and json.loads(rv.body)['offset'] == 1024
+    assert not req.stream.chunks  # drained: nothing left on connection for next request
+
+    req = put_request(1024, 2047, [content[1024:1536], content[1536:2048], b'excess', b'more'])
+    rv = await put(req, sid)
+    assert rv.status == 409 and json.loads(rv.body)['offset'] == 2048  # keeps content within range
+    assert not req.stream.chunks
+
+    req = put_request(0, 1023, [content[:1024]])
+    rv = await put(req, 'f' * 32)
+    assert rv.status == 404
+    assert not req.stream.chunks
+
+    lock = FileLock(join(views.DIR_SESSIONS, '{}.json'.format(sid)), create=False)
+    assert lock.acquire()  # as per request on session in another worker
+    req = put_request(2048, 3071, [content[2048:3072]])
+    rv = await put(req, sid)
+    assert rv.status == 409 and json.loads(rv.body)['offset'] == 2048
+    assert not req.stream.chunks
+    lock.release()
+
+    req = put_request(2048, 3071, [content[2048:3072]])
+    rv = await put(req, sid)
+    assert rv.status == 200 and json.loads(rv.body)['offset'] == 3072
+
+    rv = await handler(views, 'get_upload_session')(request('GET', '/tails/session/{}'.format(sid)), sid)
+    assert json.loads(rv.body)['offset'] == 3072
+
+
+class Upload:
+    """
+    Stand-in for processing of staged upload, holding until released and counting calls.
+    """
+
+    def __init__(self, status=200):
+        self.status = status
+        self.calls = 0
+        self.shared = 0
+        self.release = asyncio.Event()
+
+    async def process(self):
+        self.calls += 1
+        await self.release.wait()
+        return response.text('' if self.status == 200 else 'no', status=self.status)
+
+    def share(self):
+        self.shared += 1
+
+
+@pytest.mark.asyncio
+async def test_process_upload_coalesce(views):
+    rr_id = rr_id_for('coalesce')
+    (first, second) = (Upload(), Upload())
+    tasks = [
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'hash', first.process, first.share)),
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'hash', second.process, second.share))
+    ]
+    await asyncio.sleep(0.1)
+    assert (first.calls, second.calls) == (1, 0)  # duplicate waits
+    first.release.set()
+    assert [rv.status for rv in await asyncio.gather(*tasks)] == [200, 200]
+    assert (second.calls, second.shared) == (0, 1)  # duplicate shares outcome
+    assert rr_id not in views.UPLOADS_IN_FLIGHT
+
+    (first, second) = (Upload(400), Upload())  # failure: duplicate processes on its own merits
+    second.release.set()
+    tasks = [
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'hash', first.process, first.share)),
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'hash', second.process, second.share))
+    ]
+    await asyncio.sleep(0.1)
+    assert second.calls == 0
+    first.release.set()
+    assert [rv.status for rv in await asyncio.gather(*tasks)] == [400, 200]
+    assert (second.calls, second.shared) == (1, 0)
+
+    (first, second) = (Upload(), Upload())  # other tails hash: duplicate processes on its own merits
+    second.release.set()
+    tasks = [
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'hash', first.process, first.share)),
+        asyncio.ensure_future(views._process_upload('POST', rr_id, 'other', second.process, second.share))
+    ]
+    await asyncio.sleep(0.1)
+    first.release.set()
+    await asyncio.gather(*tasks)
+    assert (second.calls, second.shared) == (1, 0)
+
+
+@pytest.mark.asyncio
+async def test_process_upload_across_workers(views):
+    rr_id = rr_id_for('workers')
+    tails_hash = b58encode(sha256(b'workers').digest()).decode()
+    lock = FileLock(join(dirname(dirname(realpath(views.__file__))), 'staging', 'locks', '{}.lock'.format(rr_id)))
+    assert lock.acquire()  # as per upload in processing in another worker
+
+    upload = Upload()
+    upload.release.set()
+    task = asyncio.ensure_future(views._process_upload('POST', rr_id, tails_hash, upload.process, upload.share))
+    await asyncio.sleep(0.2)
+    assert not task.done() and upload.calls == 0
+
+    dir_tails = join(dirname(dirname(realpath(views.__file__))), 'tails')  # other worker publishes tails file
+    makedirs(Tails.dir(dir_tails, rr_id), exist_ok=True)
+    with open(join(Tails.dir(dir_tails, rr_id), tails_hash), 'wb') as fh_tails:
+        fh_tails.write(b'workers')
+    Tails.associate(dir_tails, rr_id, tails_hash)
+    lock.release()
+
+    rv = await task
+    assert rv.status == 200 and (upload.calls, upload.shared) == (0, 1)
+
+    task = asyncio.ensure_future(views._process_upload('POST', rr_id, tails_hash, upload.process, upload.share))
+    assert (await task).status == 200 and upload.calls == 1  # lock free: no sharing with an earlier upload
+
+
+@pytest.mark.asyncio
+async def test_head_tails(views):
+    await serve()
+    await deliver(views)
+    rr_id = rr_id_for('head')
+    path_tails = publish_tails(views, rr_id, urandom(4096))
+
+    rv = await handler(views, 'head_tails')(request('HEAD', '/tails/{}'.format(rr_id)), rr_id)
+    assert rv.status == 200 and not rv.body
+    assert rv.content_type == (guess_type(path_tails)[0] or 'text/plain')  # as per GET
+    assert rv.headers['Content-Length'] == '4096'
+
+    rv = await handler(views, 'head_tails')(
+        request('HEAD', '/tails/{}'.format(rr_id), headers={'If-None-Match': rv.headers['ETag']}),
+        rr_id)
+    assert rv.status == 304